@@ -0,0 +1,10 @@
+"""
+Put the checkout the benchmarks live in on sys.path, so that they import
+the package from it even when it isn't installed. Each benchmark imports
+this module before the package.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
@@ -0,0 +1,101 @@
+"""
+Compare the size and the write and read throughput of each backup
+compression on synthetic site data shaped like a real backup.
+
+    python benchmarks/bench_compression.py [SITES]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+import _path  # pylint: disable=unused-import
+from sigsci_site_manager.backup import load_backup, write_backup
+from sigsci_site_manager.compression import CODECS, open_file, zstandard
+
+
+def make_site(seed):
+    """Backup of a site with lists, rules, signals and advanced rules"""
+    rand = random.Random(seed)
+
+    def ip():
+        return '10.%d.%d.%d' % (rand.randrange(256), rand.randrange(256),
+                                rand.randrange(256))
+    return {
+        'source': {'corp': 'corp', 'site': 'site%d' % seed},
+        'site': {'agentLevel': 'block', 'blockDurationSeconds': 86400,
+                 'blockHTTPCode': 406},
+        'rule_lists': [{
+            'name': 'list%d' % i, 'type': 'ip', 'description': 'IP list',
+            'entries': [ip() for _ in range(rand.randrange(10, 1000))]
+        } for i in range(20)],
+        'site_rules': [{
+            'type': 'request', 'enabled': True, 'groupOperator': 'all',
+            'conditions': [{
+                'type': 'single', 'field': 'path', 'operator': 'equals',
+                'value': '/api/v%d/resource/%d' % (j % 3, rand.randrange(1000))
+            } for j in range(rand.randrange(1, 20))],
+            'actions': [{'type': 'block'}], 'reason': 'Rule %d' % i,
+            'expiration': ''
+        } for i in range(200)],
+        'custom_signals': [{
+            'tagName': 'site.signal-%d' % i, 'shortName': 'signal-%d' % i,
+            'description': 'Custom signal %d' % i
+        } for i in range(50)],
+        'templated_rules': {},
+        'custom_alerts': [{
+            'tagName': 'site.signal-%d' % i, 'longName': 'Alert %d' % i,
+            'interval': 10, 'threshold': 5, 'enabled': True,
+            'action': 'flagged'
+        } for i in range(50)],
+        'site_members': [{
+            'user': {'email': 'user%d@example.com' % i, 'apiUser': False},
+            'role': 'user'
+        } for i in range(30)],
+        'advanced_rules': [{
+            'id': str(i), 'shortName': 'advanced-%d' % i, 'enabled': True,
+            'preRule': 'if req.path == "/login" { tag("site.login") }\n' * 20,
+            'sampleRequest': 'GET /login HTTP/1.1\r\nHost: example.com\r\n' *
+                             50
+        } for i in range(5)],
+        'integrations': []
+    }
+
+
+def main():
+    sites = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    data = [make_site(i) for i in range(sites)]
+    codecs = [None] + [c for c in sorted(CODECS)
+                       if c != 'zstd' or zstandard is not None]
+
+    print('%d sites' % sites)
+    print('%-6s %12s %8s %14s %14s' %
+          ('codec', 'bytes', 'ratio', 'write MB/s', 'read MB/s'))
+    with tempfile.TemporaryDirectory() as tmp:
+        raw_size = None
+        for codec in codecs:
+            file_names = [os.path.join(tmp, '%s-%d.json' % (codec, i))
+                          for i in range(sites)]
+            start = time.perf_counter()
+            for site, file_name in zip(data, file_names):
+                with open_file(file_name, 'w', codec) as f:
+                    write_backup(f, site.items())
+            write_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for file_name in file_names:
+                load_backup(file_name)
+            read_time = time.perf_counter() - start
+
+            size = sum(os.path.getsize(x) for x in file_names)
+            raw_size = raw_size or size
+            print('%-6s %12d %8.1f %14.1f %14.1f' %
+                  (codec or 'none', size, float(raw_size) / size,
+                   raw_size / write_time / 1e6, raw_size / read_time / 1e6))
+    if zstandard is None:
+        print('zstd skipped, install zstandard to include it')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+Time the diff of two synthetic sites with many rules and large lists, where
+a few percent of the rules and list entries differ.
+
+    python benchmarks/bench_diff.py [RULES]
+"""
+import copy
+import io
+import random
+import sys
+import time
+from contextlib import redirect_stdout
+
+import _path  # pylint: disable=unused-import
+from bench_compression import make_site
+from sigsci_site_manager.diff import diff_snapshots, print_diff
+
+
+def main():
+    rules = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rand = random.Random(0)
+    old = make_site(0)
+    old['site_rules'] = [rule for i in range(rules // 200 + 1)
+                         for rule in make_site(i)['site_rules']][:rules]
+    new = copy.deepcopy(old)
+    for rule in rand.sample(new['site_rules'], rules // 50):
+        rule['reason'] += ' (changed)'
+    for rule in rand.sample(new['site_rules'], rules // 50):
+        rule['conditions'].reverse()
+    for rule in rand.sample(new['site_rules'], rules // 50):
+        rule['actions'] = [{'type': 'allow'}]
+    for rule_list in new['rule_lists']:
+        rule_list['entries'] = rule_list['entries'][5:] + ['10.0.0.1']
+
+    start = time.perf_counter()
+    result = diff_snapshots(old, new)
+    elapsed = time.perf_counter() - start
+    with redirect_stdout(io.StringIO()):
+        print_diff(result, 'old', 'new')
+    site_rules = result['categories']['site_rules']
+    print('%d rules: %.3f s, %d rules changed, %d added, %d removed' % (
+        rules, elapsed, len(site_rules['changed']), len(site_rules['added']),
+        len(site_rules['removed'])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+Time migrate.get_rule_dependencies on rules with a growing number of
+conditions. The time per condition should stay flat as the rules grow.
+
+    python benchmarks/bench_migrate.py
+"""
+import timeit
+
+import _path  # pylint: disable=unused-import
+from sigsci_site_manager.migrate import get_rule_dependencies
+
+SIZES = [1000, 2000, 4000, 8000, 16000]
+
+
+def make_rule(conditions):
+    """Rule with `conditions` list conditions spread over nested groups"""
+    groups = []
+    for i in range(0, conditions, 10):
+        groups.append({
+            'type': 'group',
+            'groupOperator': 'any',
+            'conditions': [{
+                'type': 'single',
+                'field': 'ip',
+                'operator': 'inList',
+                'value': 'corp.list-%d' % (j % 500)
+            } for j in range(i, min(i + 10, conditions))]
+        })
+    return {
+        'conditions': [{'type': 'group', 'groupOperator': 'all',
+                        'conditions': groups}],
+        'actions': [{'type': 'addSignal', 'signal': 'corp.flagged'}]
+    }
+
+
+def main():
+    print('%12s %12s %16s' % ('conditions', 'seconds', 'usec/condition'))
+    for size in SIZES:
+        rule = make_rule(size)
+        runs = 5
+        seconds = min(timeit.repeat(lambda: get_rule_dependencies(rule),
+                                    number=runs, repeat=3)) / runs
+        print('%12d %12.4f %16.2f' % (size, seconds, seconds / size * 1e6))
+
+
+if __name__ == '__main__':
+    main()
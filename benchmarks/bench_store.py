@@ -0,0 +1,62 @@
+"""
+Time loading synthetic sites into a snapshot store and the queries of the
+query command across all of them.
+
+    python benchmarks/bench_store.py [SITES]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import _path  # pylint: disable=unused-import
+from bench_compression import make_site
+from sigsci_site_manager.store import (lists_containing, list_snapshots,
+                                       open_store, rules_matching,
+                                       sites_using_list, store_backup)
+
+
+def make_store_site(seed):
+    """
+    Site backup whose rules and lists are hit by the queries below: every
+    tenth rule blocks IPs in list3, half through the corp list, and list3
+    of every other site contains 10.1.2.3
+    """
+    data = make_site(seed)
+    for i, rule in enumerate(data['site_rules'][::10]):
+        rule['conditions'].append({
+            'type': 'group', 'groupOperator': 'any', 'conditions': [{
+                'type': 'single', 'field': 'ip', 'operator': 'inList',
+                'value': '%s.list3' % ('corp' if i % 2 else 'site')}]})
+    if seed % 2 == 0:
+        data['rule_lists'][3]['entries'].append('10.1.2.3')
+    return data
+
+
+def timed(name, func, *args):
+    start = time.perf_counter()
+    rows = func(*args)
+    print('%-20s %8.2f ms %6d rows' %
+          (name, (time.perf_counter() - start) * 1000, len(rows)))
+
+
+def main():
+    sites = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = open_store(os.path.join(tmp, 'corp.db'))
+        start = time.perf_counter()
+        for i in range(sites):
+            store_backup(conn, make_store_site(i))
+        print('%d sites stored in %.1f s' %
+              (sites, time.perf_counter() - start))
+
+        timed('snapshots', list_snapshots, conn)
+        timed('condition', rules_matching, conn, 'path',
+              '/api/v1/resource/42', 'block')
+        timed('list', sites_using_list, conn, 'list3')
+        timed('entry', lists_containing, conn, '10.1.2.3')
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
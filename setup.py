@@ -26,6 +26,9 @@ setup(
     install_requires=[
         'pysigsci>=3.10.0'
     ],
+    extras_require={
+        'zstd': ['zstandard>=0.15']
+    },
     tests_require=[
         'pytest'
     ],
@@ -1,4 +1,24 @@
+import atexit
+import json
+import threading
+
+import pysigsci
 from pysigsci import sigsciapi
+import requests
+from requests.adapters import HTTPAdapter
+
+from sigsci_site_manager.cache import DEFAULT_CACHE_TTL, TTLCache
+from sigsci_site_manager.ratelimit import RateGovernor
+from sigsci_site_manager.token_cache import load_token, save_token
+
+# Minimum number of keep-alive connections kept open to the API
+DEFAULT_POOL_SIZE = 10
+
+# Corp level resources whose GET responses are cached
+CACHED_RESOURCES = ('users', 'sites', 'lists', 'tags')
+
+# APIs created by init_api, used to report statistics at exit
+_APIS = []
 
 
 def noop(*args, **kwargs):
@@ -17,13 +37,246 @@ def update_corp_user(self, email, data):
         method="PUT")
 
 
-def init_api(username, password, token, corp, dry_run=False):
-    api = sigsciapi.SigSciApi(
-        email=username, password=password, api_token=token)
-    api.corp = corp
+def _corp_path(api, endpoint):
+    """Split a corp endpoint into its path segments after the corp name"""
+    prefix = '{}/{}/'.format(api.ep_corps, api.corp)
+    if not endpoint.startswith(prefix):
+        return prefix, None
+    return prefix, endpoint[len(prefix):].split('?')[0].split('/')
+
+
+def _cache_key(api, endpoint, params):
+    """Cache key of a GET request, None when its response isn't cached"""
+    _, parts = _corp_path(api, endpoint)
+    if not parts or parts[0] not in CACHED_RESOURCES:
+        return None
+    if parts[0] == 'sites' and len(parts) > 1:
+        # Only the list of sites is corp level, site contents aren't cached
+        return None
+    if params:
+        return endpoint + '?' + json.dumps(params, sort_keys=True)
+    return endpoint
+
+
+def _invalidated_prefixes(api, endpoint):
+    """Prefixes of the cache keys made stale by a write to an endpoint"""
+    prefix, parts = _corp_path(api, endpoint)
+    if not parts:
+        return []
+    prefixes = [prefix + parts[0]]
+    if parts[0] == 'sites' and 'members' in parts:
+        # Site members are also part of the corp users' memberships
+        prefixes.append(prefix + 'users')
+    return prefixes
+
+
+def _make_request(self, endpoint, params=None, data=None, json=None,
+                  method="GET", retry_auth=True):
+    """
+    Replacement for SigSciApi._make_request that sends every request through
+    the session created by init_api so connections are kept alive and reused.
+    Headers are built per request so that it is safe to use from several
+    threads at once. When logged in with a password an expired session token
+    is refreshed and the request retried once. Requests are paced and
+    throttled requests retried by the API's RateGovernor. Corp level GETs
+    are answered from the API's cache when possible.
+    """
+    cache = getattr(self, 'cache', None)
+    cache_key = None
+    if cache is not None and method == 'GET':
+        cache_key = _cache_key(self, endpoint, params)
+        if cache_key is not None:
+            hit, value = cache.get(cache_key)
+            if hit:
+                return value
+
+    bearer_token = self.bearer_token
+    headers = {
+        'Content-Type': 'application/json',
+        'User-Agent': 'pysigsci v' + pysigsci.VERSION
+    }
+    if endpoint != self.ep_auth and bearer_token is not None:
+        headers['Authorization'] = 'Bearer {}'.format(bearer_token['token'])
+    elif endpoint != self.ep_auth:
+        headers['X-Api-User'] = self.api_user
+        headers['X-Api-Token'] = self.api_token
+
+    url = self.base_url + self.api_version + endpoint
+
+    if method in ('GET', 'DELETE'):
+        kwargs = {'params': params}
+    elif method == 'POST':
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        kwargs = {'data': data}
+    elif method in ('POST_JSON', 'PUT', 'PATCH'):
+        kwargs = {'json': json}
+    else:
+        raise Exception("InvalidRequestMethod: " + str(method))
+    http_method = 'POST' if method == 'POST_JSON' else method
+
+    def send():
+        return self.session.request(http_method, url, headers=headers,
+                                    cookies=self.cookies, **kwargs)
+
+    governor = getattr(self, 'governor', None)
+    result = governor.call(send) if governor else send()
+
+    if cache is not None and method != 'GET':
+        for prefix in _invalidated_prefixes(self, endpoint):
+            cache.invalidate(prefix)
+
+    if (result.status_code == 401 and retry_auth and
+            endpoint != self.ep_auth and getattr(self, 'refresh_auth', None)):
+        self.refresh_auth(self, bearer_token)
+        return self._make_request(endpoint, params, data, json, method,
+                                  retry_auth=False)
+
+    if result.status_code == 429:
+        raise Exception('429 Too Many Requests: {} {}'.format(method,
+                                                             endpoint))
+
+    if result.status_code == 204:
+        return dict({'message': '{} {}'.format(method, 'successful.')})
+
+    if result.status_code == 400:
+        raise Exception('400 Bad Request: {}'.format(
+            result.json()['message']))
+
+    response = result.json()
+    if cache_key is not None and result.status_code == 200:
+        cache.put(cache_key, response)
+    return response
 
+
+def create_session(pool_size=DEFAULT_POOL_SIZE):
+    """
+    Create an HTTP session with a keep-alive connection pool large enough
+    for `pool_size` concurrent requests
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1,
+                          pool_maxsize=max(pool_size, DEFAULT_POOL_SIZE))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def pool_stats(api):
+    """
+    Return connection statistics for the session of an API: the number of
+    requests sent, connections opened, the fraction of requests that reused
+    an existing connection and the connections currently open.
+    """
+    stats = {'requests': 0, 'connections': 0, 'open_connections': 0}
+    adapters = {id(a): a for a in api.session.adapters.values()}
+    for adapter in adapters.values():
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            stats['requests'] += pool.num_requests
+            stats['connections'] += pool.num_connections
+            stats['open_connections'] += len([
+                c for c in list(pool.pool.queue)
+                if c is not None and getattr(c, 'sock', None) is not None])
+    stats['reuse_ratio'] = 0.0
+    if stats['requests']:
+        stats['reuse_ratio'] = (
+            1 - float(stats['connections']) / stats['requests'])
+    return stats
+
+
+def print_stats():
+    for api in _APIS:
+        stats = pool_stats(api)
+        print('API connection pool: %d requests, %d connections opened, '
+              '%.0f%% reused, %d open' %
+              (stats['requests'], stats['connections'],
+               stats['reuse_ratio'] * 100, stats['open_connections']))
+        if api.cache is not None:
+            stats = api.cache.stats()
+            print('API cache: %d hits, %d misses, %d invalidated, %d entries'
+                  % (stats['hits'], stats['misses'], stats['invalidations'],
+                     stats['entries']))
+        stats = api.governor.stats()
+        print('API rate governor: %d requests, %d throttled, %d failed, '
+              'concurrency limit %d' %
+              (stats['requests'], stats['throttled'], stats['failures'],
+               stats['concurrency']))
+
+
+def _login(api, username, password, corp, token_cache):
+    """
+    Log in with a password, reusing a cached session token when a token
+    cache is in use
+    """
+    if token_cache:
+        token = load_token(token_cache, corp, username)
+        if token:
+            api.bearer_token = {'token': token}
+            return
+    api.auth(username, password)
+    if token_cache:
+        save_token(token_cache, corp, username, api.bearer_token['token'])
+
+
+def _refresh_auth(api, username, password, corp, token_cache):
+    """
+    Build the function used to log in again when a session token expires.
+    The new token is shared with every copy of the API (see api_for_site).
+    """
+    lock = threading.Lock()
+    current = {'token': api.bearer_token}
+
+    def refresh_auth(target, expired_token):
+        with lock:
+            # Another worker may have already replaced the expired token
+            if current['token'] is expired_token:
+                api.auth(username, password)
+                current['token'] = api.bearer_token
+                if token_cache:
+                    save_token(token_cache, corp, username,
+                               api.bearer_token['token'])
+            target.bearer_token = current['token']
+    return refresh_auth
+
+
+def api_options(args):
+    """init_api keyword arguments from the global command line options"""
+    return {
+        'token_cache': args.token_cache,
+        'rate_limit': args.rate_limit,
+        'cache_ttl': args.cache_ttl,
+        'cache_file': args.cache_file
+    }
+
+
+def init_api(username, password, token, corp, dry_run=False,
+             pool_size=DEFAULT_POOL_SIZE, token_cache=None, rate_limit=None,
+             cache_ttl=DEFAULT_CACHE_TTL, cache_file=None):
     # Work around missing functionality in pysigsci
     setattr(sigsciapi.SigSciApi, 'update_corp_user', update_corp_user)
+    # Send requests through a pooled keep-alive session
+    setattr(sigsciapi.SigSciApi, '_make_request', _make_request)
+
+    api = sigsciapi.SigSciApi()
+    api.session = create_session(pool_size)
+    api.governor = RateGovernor(rate=rate_limit,
+                                max_concurrency=max(pool_size,
+                                                    DEFAULT_POOL_SIZE))
+    api.cache = None
+    if cache_ttl:
+        api.cache = TTLCache(ttl=cache_ttl, path=cache_file)
+        if cache_file:
+            atexit.register(api.cache.save)
+    if username is not None and password is not None:
+        _login(api, username, password, corp, token_cache)
+        api.refresh_auth = _refresh_auth(api, username, password, corp,
+                                         token_cache)
+    elif username is not None and token is not None:
+        api.api_user = username
+        api.api_token = token
+    api.corp = corp
+    _APIS.append(api)
 
     if dry_run:
         # When doing a dry run override the API methods that make changes so
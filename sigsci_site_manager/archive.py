@@ -0,0 +1,218 @@
+import datetime
+import hashlib
+import json
+import os
+import threading
+
+# Layout of an archive directory:
+#   objects/<hash[:2]>/<hash>.json   each item stored once under its hash
+#   sites/<site>/<snapshot>.json     snapshot manifest listing item hashes
+# A category unchanged since the previous snapshot is listed as a reference
+# to the snapshot holding it, {"ref": <snapshot>}.
+OBJECTS_DIR = 'objects'
+SITES_DIR = 'sites'
+ARCHIVE_VERSION = 2
+
+# Value of a category that wasn't fetched because the site is unchanged
+UNCHANGED = object()
+
+
+def is_archive(path):
+    return os.path.isdir(os.path.join(path, OBJECTS_DIR))
+
+
+def parse_archive_spec(spec):
+    """
+    Split a DIR#SITE[@SNAPSHOT] archive spec into its parts. Returns None
+    when spec is a plain file name.
+    """
+    if '#' not in spec:
+        return None
+    path, site = spec.rsplit('#', 1)
+    snapshot = None
+    if '@' in site:
+        site, snapshot = site.split('@', 1)
+    if not path or not site:
+        return None
+    return path, site, snapshot
+
+
+def object_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _encode(value):
+    # Canonical text so equal items get the same hash whatever their key
+    # order
+    return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+
+def category_fingerprint(value):
+    return object_hash(_encode(value))
+
+
+def _object_path(path, digest):
+    return os.path.join(path, OBJECTS_DIR, digest[:2], digest + '.json')
+
+
+def _write_atomic(file_name, text):
+    directory = os.path.dirname(file_name)
+    os.makedirs(directory, exist_ok=True)
+    tmp_name = '%s.%d.%d.tmp' % (file_name, os.getpid(),
+                                 threading.get_ident())
+    with open(tmp_name, 'w') as f:
+        f.write(text)
+    os.replace(tmp_name, file_name)
+
+
+def _create_atomic(file_name, text):
+    """
+    Create a file unless it exists. Returns whether this call created it,
+    so that of several workers storing the same object only one counts it.
+    """
+    directory = os.path.dirname(file_name)
+    os.makedirs(directory, exist_ok=True)
+    tmp_name = '%s.%d.%d.tmp' % (file_name, os.getpid(),
+                                 threading.get_ident())
+    with open(tmp_name, 'w') as f:
+        f.write(text)
+    try:
+        # Unlike os.replace, linking fails when the file already exists
+        os.link(tmp_name, file_name)
+        return True
+    except FileExistsError:
+        return False
+    finally:
+        os.remove(tmp_name)
+
+
+def store_object(path, value, stats):
+    """Store a value under its hash unless already stored, return the hash"""
+    text = _encode(value)
+    digest = object_hash(text)
+    file_name = _object_path(path, digest)
+    stats['objects'] += 1
+    if not os.path.exists(file_name) and _create_atomic(file_name, text):
+        stats['written'] += 1
+        stats['bytes'] += len(text)
+    return digest
+
+
+def new_snapshot_id():
+    return datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%S%fZ')
+
+
+def _ref(manifest, key):
+    """Reference to the snapshot holding a category of a manifest"""
+    entry = manifest['categories'][key]
+    if isinstance(entry, dict):
+        return entry
+    return {'ref': manifest['snapshot']}
+
+
+def store_snapshot(path, site_name, items, snapshot=None, previous=None):
+    """
+    Store the (key, value) pairs of a site backup in an archive. List
+    categories are stored one item per object, other values as a single
+    object. When given the manifest of the previous snapshot, categories
+    whose fingerprint hasn't changed, or whose value is UNCHANGED, are
+    stored as a reference to it. Returns the snapshot id and counts of the
+    objects stored.
+    """
+    snapshot = snapshot or new_snapshot_id()
+    stats = {'objects': 0, 'written': 0, 'bytes': 0, 'unchanged': 0}
+    fingerprints = previous.get('fingerprints', {}) if previous else {}
+    manifest = {
+        'version': ARCHIVE_VERSION,
+        'site': site_name,
+        'snapshot': snapshot,
+        'created': datetime.datetime.utcnow().isoformat() + 'Z',
+        'categories': {},
+        'fingerprints': {}
+    }
+    for key, value in items:
+        if key == 'source':
+            manifest['source'] = value
+            continue
+        if value is UNCHANGED:
+            # Not fetched, assumed to be the same as in the previous snapshot
+            manifest.setdefault('unverified', []).append(key)
+            manifest['categories'][key] = _ref(previous, key)
+            manifest['fingerprints'][key] = fingerprints[key]
+            stats['unchanged'] += 1
+            continue
+        fingerprint = category_fingerprint(value)
+        manifest['fingerprints'][key] = fingerprint
+        if fingerprints.get(key) == fingerprint:
+            manifest['categories'][key] = _ref(previous, key)
+            stats['unchanged'] += 1
+        elif isinstance(value, list):
+            manifest['categories'][key] = [
+                store_object(path, item, stats) for item in value]
+        else:
+            manifest['categories'][key] = store_object(path, value, stats)
+
+    text = json.dumps(manifest, indent=2)
+    _write_atomic(os.path.join(path, SITES_DIR, site_name,
+                               snapshot + '.json'), text)
+    stats['bytes'] += len(text)
+    return snapshot, stats
+
+
+def list_snapshots(path, site_name):
+    """Snapshot ids of a site, oldest first"""
+    directory = os.path.join(path, SITES_DIR, site_name)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(x[:-len('.json')] for x in os.listdir(directory)
+                  if x.endswith('.json'))
+
+
+def latest_manifest(path, site_name):
+    """Manifest of the latest snapshot of a site, None if there is none"""
+    if not list_snapshots(path, site_name):
+        return None
+    return load_manifest(path, site_name)
+
+
+def load_manifest(path, site_name, snapshot=None):
+    if snapshot is None:
+        snapshots = list_snapshots(path, site_name)
+        if not snapshots:
+            raise Exception("No snapshots of site '%s' in archive '%s'" %
+                            (site_name, path))
+        snapshot = snapshots[-1]
+    file_name = os.path.join(path, SITES_DIR, site_name, snapshot + '.json')
+    if not os.path.exists(file_name):
+        raise Exception("No snapshot '%s' of site '%s' in archive '%s'" %
+                        (snapshot, site_name, path))
+    with open(file_name, 'r') as f:
+        return json.loads(f.read())
+
+
+def load_object(path, digest, objects):
+    """Load an object, caching it in objects as many items repeat"""
+    if digest not in objects:
+        with open(_object_path(path, digest), 'r') as f:
+            objects[digest] = f.read()
+    return json.loads(objects[digest])
+
+
+def load_snapshot(path, site_name, snapshot=None):
+    """Rebuild a site backup from a snapshot, the latest one by default"""
+    manifest = load_manifest(path, site_name, snapshot)
+    manifests = {manifest['snapshot']: manifest}
+    objects = {}
+    data = {'source': manifest['source']}
+    for key, value in manifest['categories'].items():
+        if isinstance(value, dict):
+            # Unchanged category stored by an earlier snapshot
+            if value['ref'] not in manifests:
+                manifests[value['ref']] = load_manifest(path, site_name,
+                                                        value['ref'])
+            value = manifests[value['ref']]['categories'][key]
+        if isinstance(value, list):
+            data[key] = [load_object(path, x, objects) for x in value]
+        else:
+            data[key] = load_object(path, value, objects)
+    return data
@@ -1,7 +1,25 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import datetime
 import json
-
+import os
+import threading
+
+from sigsci_site_manager.archive import (UNCHANGED, category_fingerprint,
+                                         is_archive, latest_manifest,
+                                         load_snapshot, parse_archive_spec,
+                                         store_snapshot)
+from sigsci_site_manager.compression import (CODECS, compression_for_name,
+                                             open_file)
+from sigsci_site_manager.parallel import api_for_site, run_per_item
+from sigsci_site_manager.store import (is_store, load_stored, open_store,
+                                       store_backup)
 from sigsci_site_manager.util import filter_data
 
+MANIFEST_FILE = 'manifest.json'
+# Characters read at a time when loading a backup
+BACKUP_READ_SIZE = 64 * 1024
+
 
 def get_site(api):
     keys = ['agentLevel', 'blockDurationSeconds', 'blockHTTPCode']
@@ -91,32 +109,326 @@ def get_integrations(api):
     return filter_data(data['data'], keys)
 
 
-def backups(api, site_name):
+# Categories of a backup in order and the functions fetching them
+BACKUP_STEPS = [
+    ('site', get_site),
+    ('rule_lists', get_rule_lists),
+    ('site_rules', get_site_rules),
+    ('custom_signals', get_custom_signals),
+    ('templated_rules', get_templated_rules),
+    ('custom_alerts', get_custom_alerts),
+    ('site_members', get_site_members),
+    ('advanced_rules', get_advanced_rules),
+    ('integrations', get_integrations),
+]
+
+# Small categories fetched first by an incremental backup skipping
+# unchanged sites
+CHEAP_CATEGORIES = ['site', 'custom_signals', 'custom_alerts',
+                    'site_members', 'integrations']
+
+
+def iter_backup(api, site_name, workers=1, keys=None):
+    """
+    Generate the (key, value) pairs of a site backup in backup order, only
+    for the given category keys if any. Each category is yielded as soon as
+    it and the ones before it have arrived.
+    """
     api.site = site_name
-
-    data = {}
-    data['source'] = {'corp': api.corp, 'site': api.site}
-    data['site'] = get_site(api)
-    data['rule_lists'] = get_rule_lists(api)
+    yield 'source', {'corp': api.corp, 'site': api.site}
     #data['request_rules'] = get_request_rules(api) # add support for category exclusion if there are still sites that need legacy format
-    print('Using get_site_rules instead of get_request_rules and get_signal_rules...')
-    data['site_rules'] = get_site_rules(api)
-    data['custom_signals'] = get_custom_signals(api)
     #data['signal_rules'] = get_signal_rules(api)
-    data['templated_rules'] = get_templated_rules(api)
-    data['custom_alerts'] = get_custom_alerts(api)
-    data['site_members'] = get_site_members(api)
-    data['advanced_rules'] = get_advanced_rules(api)
-    data['integrations'] = get_integrations(api)
-
-    return data
-
+    print('Using get_site_rules instead of get_request_rules and get_signal_rules...')
 
-def backup(api, site_name, file_name):
+    # Each category is an independent GET so they can be fetched at the same
+    # time. Results are assigned in this order regardless of which request
+    # finishes first so the output is identical to a sequential backup.
+    steps = [(key, func) for key, func in BACKUP_STEPS
+             if keys is None or key in keys]
+    if workers is None or workers <= 1:
+        for key, func in steps:
+            yield key, func(api)
+        return
+
+    # At most `workers` categories are requested or held at once, so that
+    # memory stays bounded by the largest few categories rather than the
+    # whole site
+    with ThreadPoolExecutor(max_workers=min(workers, len(steps))) as pool:
+        pending = deque()
+        for key, func in steps:
+            if len(pending) == workers:
+                done_key, future = pending.popleft()
+                yield done_key, future.result()
+            pending.append((key, pool.submit(func, api)))
+        while pending:
+            done_key, future = pending.popleft()
+            yield done_key, future.result()
+
+
+def backups(api, site_name, workers=1):
+    return dict(iter_backup(api, site_name, workers))
+
+
+def write_backup(f, items):
+    """
+    Write (key, value) pairs to f as a JSON object one value at a time, so
+    that only the value being written and its text need to be kept in
+    memory. The output is the same as json.dumps of the whole dict.
+    """
+    f.write('{')
+    for i, (key, value) in enumerate(items):
+        if i:
+            f.write(', ')
+        # json.dumps of a whole value uses the C encoder, which is many
+        # times faster than encoding it in pieces with iterencode
+        f.write(json.dumps(key) + ': ' + json.dumps(value))
+    f.write('}')
+
+
+def iter_backup_file(f, chunk_size=BACKUP_READ_SIZE):
+    """
+    Generate the (key, value) pairs of a backup file, parsing one top level
+    value at a time. Only the text of the value being parsed is kept.
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+
+    def fill(size):
+        nonlocal buf, pos, eof
+        data = f.read(size)
+        eof = not data
+        buf = buf[pos:] + data
+        pos = 0
+
+    def skip(chars):
+        # Skip whitespace and at most one of the expected characters
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            fill(chunk_size)
+        if pos < len(buf) and buf[pos] in chars:
+            pos += 1
+            return buf[pos - 1]
+        return None
+
+    def decode():
+        # Decode the next value, reading more until the whole value and the
+        # character after it are in the buffer. The read size doubles so
+        # large values are parsed again only a few times.
+        nonlocal pos
+        size = chunk_size
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+                if end < len(buf) or eof:
+                    pos = end
+                    return value
+            except ValueError:
+                if eof:
+                    raise
+            fill(max(size, len(buf) - pos))
+            size *= 2
+
+    fill(chunk_size)
+    if skip('{') != '{':
+        raise ValueError('Backup is not a JSON object')
+    if skip('}') == '}':
+        return
+    while True:
+        skip('')
+        key = decode()
+        if skip(':') != ':':
+            raise ValueError('Expected : after backup key %r' % key)
+        skip('')
+        yield key, decode()
+        separator = skip(',}')
+        if separator == '}':
+            return
+        if separator != ',':
+            raise ValueError('Expected , or } after backup key %r' % key)
+
+
+def load_backup(file_name):
+    """
+    Load a backup file one category at a time, decompressing it on the fly
+    when it is compressed. A DIR#SITE[@SNAPSHOT] name loads a site snapshot
+    from a backup archive, or from a snapshot store with the snapshot id.
+    """
+    spec = parse_archive_spec(file_name)
+    if spec and is_archive(spec[0]):
+        return load_snapshot(*spec)
+    if spec and is_store(spec[0]):
+        return load_stored(*spec)
+    with open_file(file_name, 'r') as f:
+        return dict(iter_backup_file(f))
+
+
+def backup(api, site_name, file_name, workers=1, compression=None):
     print("Backing up site '%s' to file '%s'..." %
           (site_name, file_name))
 
-    data = backups(api, site_name)
-
-    with open(file_name, 'w') as f:
-        f.write(json.dumps(data))
+    # Each category is written as soon as it arrives rather than holding
+    # the whole site and its JSON text in memory. The backup only replaces
+    # the file once complete so a failed backup leaves no partial file.
+    tmp_name = '%s.%d.tmp' % (file_name, os.getpid())
+    try:
+        with open_file(tmp_name, 'w',
+                       compression or compression_for_name(file_name)) as f:
+            write_backup(f, iter_backup(api, site_name, workers))
+        os.replace(tmp_name, file_name)
+    finally:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+
+
+def _skip_unchanged(api, site_name, previous, workers):
+    """
+    Fetch the cheap categories of a site and, only when any of them changed
+    since the previous snapshot, the rest. Categories that aren't fetched
+    are given as UNCHANGED.
+    """
+    cheap = dict(iter_backup(api, site_name, workers, CHEAP_CATEGORIES))
+    fingerprints = previous.get('fingerprints', {})
+    if all(category_fingerprint(cheap[key]) == fingerprints.get(key)
+           for key in CHEAP_CATEGORIES):
+        print('  Unchanged since snapshot %s, not fetching the other '
+              'categories' % previous['snapshot'])
+        rest = {}
+    else:
+        rest = dict(iter_backup(api, site_name, workers,
+                                [k for k, _ in BACKUP_STEPS
+                                 if k not in cheap]))
+    return [('source', cheap['source'])] + [
+        (key, cheap[key] if key in cheap else rest.get(key, UNCHANGED))
+        for key, _ in BACKUP_STEPS]
+
+
+def backup_to_archive(api, site_name, path, workers=1, incremental=False,
+                      skip_unchanged=False):
+    """
+    Backup a site to an archive. An incremental backup only stores the
+    categories that changed since the latest snapshot of the site and, with
+    skip_unchanged, doesn't fetch the other categories of a site whose
+    cheap categories are unchanged.
+    """
+    print("Backing up site '%s' to archive '%s'..." % (site_name, path))
+    previous = latest_manifest(path, site_name) if incremental else None
+    if previous and skip_unchanged:
+        items = _skip_unchanged(api, site_name, previous, workers)
+    else:
+        items = iter_backup(api, site_name, workers)
+    snapshot, stats = store_snapshot(path, site_name, items,
+                                     previous=previous)
+    print('  Snapshot %s: %d items, %d new, %d unchanged categories, %d '
+          'bytes written' % (snapshot, stats['objects'], stats['written'],
+                             stats['unchanged'], stats['bytes']))
+    return stats
+
+
+def archive_sites(api, site_names, path, workers=1, incremental=False,
+                  skip_unchanged=False):
+    """
+    Backup sites to an archive, up to `workers` sites at a time. Items
+    shared by several sites or unchanged since earlier snapshots are only
+    stored once.
+    """
+    print("Backing up %d site%s to archive '%s'..." %
+          (len(site_names), 's' if len(site_names) != 1 else '', path))
+
+    def _archive_site(site_name):
+        return backup_to_archive(api_for_site(api, site_name), site_name,
+                                 path, incremental=incremental,
+                                 skip_unchanged=skip_unchanged)
+
+    results = run_per_item(_archive_site, site_names, workers)
+    stats = {'objects': 0, 'written': 0, 'bytes': 0, 'unchanged': 0}
+    for result in results:
+        if not result.error:
+            for key in stats:
+                stats[key] += result.result[key]
+    failed = [r.name for r in results if r.error]
+    print('Backed up %d of %d sites: %d items, %d new, %d unchanged '
+          'categories, %d bytes written' %
+          (len(results) - len(failed), len(results), stats['objects'],
+           stats['written'], stats['unchanged'], stats['bytes']))
+    for site_name in failed:
+        print('  Failed: %s' % site_name)
+    return stats
+
+
+def store_sites(api, site_names, path, workers=1):
+    """
+    Backup sites to a snapshot store, up to `workers` sites at a time. Each
+    site becomes a new snapshot so earlier ones remain queryable.
+    """
+    print("Backing up %d site%s to store '%s'..." %
+          (len(site_names), 's' if len(site_names) != 1 else '', path))
+    conn = open_store(path)
+    # Sites are fetched in parallel but SQLite takes one writer at a time
+    lock = threading.Lock()
+
+    def _store_site(site_name):
+        data = backups(api_for_site(api, site_name), site_name)
+        with lock:
+            snapshot_id = store_backup(conn, data)
+        print("  Site '%s' stored as snapshot %d" % (site_name, snapshot_id))
+        return snapshot_id
+
+    try:
+        results = run_per_item(_store_site, site_names, workers)
+    finally:
+        conn.close()
+    failed = [r.name for r in results if r.error]
+    print('Backed up %d of %d sites' %
+          (len(results) - len(failed), len(results)))
+    for site_name in failed:
+        print('  Failed: %s' % site_name)
+    return {r.name: r.result for r in results if not r.error}
+
+
+def backup_sites(api, site_names, out_dir, workers=1, compression=None):
+    print("Backing up %d site%s to directory '%s'..." %
+          (len(site_names), 's' if len(site_names) != 1 else '', out_dir))
+    os.makedirs(out_dir, exist_ok=True)
+
+    def _backup_site(site_name):
+        file_name = os.path.join(out_dir, '%s.json%s' % (
+            site_name, CODECS[compression][0] if compression else ''))
+        backup(api_for_site(api, site_name), site_name, file_name,
+               compression=compression)
+        return file_name
+
+    # Sites are backed up in parallel while the categories of each site are
+    # fetched one after another, keeping the number of requests in flight at
+    # the number of workers.
+    results = run_per_item(_backup_site, site_names, workers)
+
+    manifest = {
+        'corp': api.corp,
+        'created': datetime.datetime.utcnow().isoformat() + 'Z',
+        'sites': []
+    }
+    for result in results:
+        entry = {'site': result.name}
+        if result.error:
+            entry['status'] = 'failed'
+            entry['error'] = str(result.error)
+        else:
+            entry['status'] = 'ok'
+            entry['file'] = os.path.basename(result.result)
+        manifest['sites'].append(entry)
+
+    with open(os.path.join(out_dir, MANIFEST_FILE), 'w') as f:
+        f.write(json.dumps(manifest, indent=2))
+
+    failed = [r.name for r in results if r.error]
+    print('Backed up %d of %d sites' %
+          (len(results) - len(failed), len(results)))
+    for site_name in failed:
+        print('  Failed: %s' % site_name)
+    return manifest
@@ -0,0 +1,100 @@
+from collections import OrderedDict
+from copy import deepcopy
+import json
+import os
+import threading
+import time
+
+# Seconds a cached response is used before it is fetched again
+DEFAULT_CACHE_TTL = 300
+# Maximum number of responses kept, least recently used are dropped first
+DEFAULT_CACHE_ENTRIES = 1000
+
+
+class TTLCache(object):
+    """
+    Thread-safe LRU cache of API responses that expire after `ttl` seconds.
+    When a path is given the cache is loaded from and saved to that file so
+    entries can be reused by later runs.
+    """
+
+    def __init__(self, ttl=DEFAULT_CACHE_TTL,
+                 max_entries=DEFAULT_CACHE_ENTRIES, path=None,
+                 clock=time.time):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = os.path.expanduser(path) if path else None
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        if self.path:
+            self.load()
+
+    def get(self, key):
+        """Return (True, value) for a fresh cached entry or (False, None)"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > self.clock():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                # Hand out copies so callers can't modify the cached value
+                return True, deepcopy(entry[1])
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (self.clock() + self.ttl, deepcopy(value))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, prefix):
+        """Drop every entry whose key starts with prefix"""
+        with self.lock:
+            for key in [k for k in self.entries if k.startswith(prefix)]:
+                del self.entries[key]
+                self.invalidations += 1
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                entries = json.loads(f.read())
+        except (OSError, ValueError):
+            return
+        now = self.clock()
+        with self.lock:
+            for key, expires, value in entries:
+                if expires > now:
+                    self.entries[key] = (expires, value)
+
+    def save(self):
+        if not self.path:
+            return
+        now = self.clock()
+        with self.lock:
+            entries = [[k, e[0], e[1]] for k, e in self.entries.items()
+                       if e[0] > now]
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        # Corp data such as the user list is cached so keep the file private
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(json.dumps(entries))
+        os.replace(tmp_path, self.path)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'entries': len(self.entries)
+            }
@@ -0,0 +1,60 @@
+import gzip
+import lzma
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compression formats: file extension and the magic bytes files start with
+CODECS = {
+    'gzip': ('.gz', b'\x1f\x8b'),
+    'xz': ('.xz', b'\xfd7zXZ\x00'),
+    'zstd': ('.zst', b'\x28\xb5\x2f\xfd')
+}
+
+
+def compression_for_name(file_name):
+    """Compression implied by the extension of a file name, if any"""
+    for codec, (extension, _) in CODECS.items():
+        if file_name.endswith(extension):
+            return codec
+    return None
+
+
+def detect_compression(file_name):
+    """Compression of an existing file, from the magic bytes it starts with"""
+    with open(file_name, 'rb') as f:
+        head = f.read(max(len(magic) for _, magic in CODECS.values()))
+    for codec, (_, magic) in CODECS.items():
+        if head.startswith(magic):
+            return codec
+    return None
+
+
+def open_file(file_name, mode='r', compression=None):
+    """
+    Open a text file that may be compressed. When reading, the compression
+    is detected from the file contents. When writing, it is the given
+    compression or the one implied by the file extension.
+    """
+    if 'r' in mode:
+        compression = detect_compression(file_name)
+    elif compression is None:
+        compression = compression_for_name(file_name)
+    mode = mode.replace('t', '') + 't'
+
+    if compression is None:
+        return open(file_name, mode)
+    if compression == 'gzip':
+        # Level 6, like the gzip command, is much faster to write than the
+        # module's default of 9 for a slightly larger file
+        return gzip.open(file_name, mode, compresslevel=6)
+    if compression == 'xz':
+        return lzma.open(file_name, mode)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise Exception('zstd compression requires the zstandard '
+                            'package (pip install zstandard)')
+        return zstandard.open(file_name, mode)
+    raise ValueError('Unknown compression: %s' % compression)
@@ -1,6 +1,4 @@
-from collections import OrderedDict
-import json
-
+from sigsci_site_manager.backup import load_backup
 from sigsci_site_manager.consts import (RULE_LISTS,
                                         CUSTOM_SIGNALS,
                                         REQUEST_RULES,
@@ -11,8 +9,18 @@ from sigsci_site_manager.consts import (RULE_LISTS,
                                         SITE_MEMBERS,
                                         INTEGRATIONS,
                                         ADVANCED_RULES)
+from sigsci_site_manager.journal import SITE, pending, record
+from sigsci_site_manager.parallel import run_concurrently
 from sigsci_site_manager.util import add_new_user, filter_data
 
+# Categories are deployed in stages. Rule conditions, alerts and advanced
+# rules can reference site lists and signals so those are created first.
+DEPLOY_STAGES = [
+    [RULE_LISTS, CUSTOM_SIGNALS],
+    [TEMPLATED_RULES, CUSTOM_ALERTS, SITE_MEMBERS, INTEGRATIONS,
+     ADVANCED_RULES, SITE_RULES, REQUEST_RULES, SIGNAL_RULES]
+]
+
 
 def create_site(api, site_name, data, display_name):
     # Create new site
@@ -29,66 +37,101 @@ def create_site(api, site_name, data, display_name):
     return True
 
 
-def create_rule_lists(api, data):
+def _create_all(api, category, create, items, workers, journal):
+    """
+    Create each item with create(item) using up to `workers` threads. Items
+    the journal has as already created are skipped and newly created items
+    are recorded. create() returns False when an item wasn't created.
+    """
+    def create_and_record(item, key):
+        if create(item) is not False:
+            record(api, journal, category, key)
+    run_concurrently([(create_and_record, pair)
+                      for pair in pending(api, journal, category, items)],
+                     workers)
+
+
+def create_rule_lists(api, data, workers=1, journal=None):
     print('Creating lists...')
-    for item in data:
+
+    def create(item):
         print('  %s' % item['name'])
         api.add_rule_lists(item)
+    _create_all(api, RULE_LISTS, create, data, workers,
+                journal)
 
 
-def create_custom_signals(api, data):
+def create_custom_signals(api, data, workers=1, journal=None):
     print('Creating custom signals...')
-    for item in data:
+
+    def create(item):
         print('  %s' % item['shortName'])
         api.add_custom_signals(item)
+    _create_all(api, CUSTOM_SIGNALS, create, data, workers,
+                journal)
 
 
-def create_request_rules(api, data):
+def create_request_rules(api, data, workers=1, journal=None):
     print('Creating request rules...')
-    for item in data:
+
+    def create(item):
         print('  %s' % item['reason'])
         api.add_request_rules(item)
+    _create_all(api, REQUEST_RULES, create, data, workers,
+                journal)
 
 
-def create_site_rules(api, data):
+def create_site_rules(api, data, workers=1, journal=None):
     print('Creating site rules...')
-    for item in data:
+
+    def create(item):
         print('  %s' % item['reason'])
         api.add_site_rules(item)
+    _create_all(api, SITE_RULES, create, data, workers,
+                journal)
 
 
-def create_signal_rules(api, data):
+def create_signal_rules(api, data, workers=1, journal=None):
     print('Creating signal rules...')
-    for item in data:
+
+    def create(item):
         print('  %s' % item['reason'])
         api.add_signal_rules(item)
+    _create_all(api, SIGNAL_RULES, create, data, workers,
+                journal)
 
 
-def update_templated_rules(api, data):
+def update_templated_rules(api, data, workers=1, journal=None):
     print('Updating templated rules...')
-    for item in data:
+
+    def create(item):
         print('  %s' % item)
         api.add_templated_rules(item, data[item])
+    _create_all(api, TEMPLATED_RULES, create, list(data), workers,
+                journal)
 
 
-def create_custom_alerts(api, data):
+def create_custom_alerts(api, data, workers=1, journal=None):
     print('Creating custom alerts...')
-    for item in data:
-        if item['action'] == 'siteMetricInfo':
-            # Default agent alerts are added at site creation
-            continue
+
+    def create(item):
         print('  %s' % item['longName'])
         api.add_custom_alert(item)
+    # Default agent alerts are added at site creation
+    _create_all(api, CUSTOM_ALERTS, create,
+                [item for item in data if item['action'] != 'siteMetricInfo'],
+                workers, journal)
 
 
-def add_site_members(api, data):
+def add_site_members(api, data, workers=1, journal=None):
     print('Adding users...')
 
     # Get existing corp users in case user needs to be added
     keys = ['email']
     src = api.get_corp_users()
-    users = [user['email'] for user in filter_data(src['data'], keys)]
-    for item in data:
+    users = {user['email'] for user in filter_data(src['data'], keys)}
+
+    def create(item):
         if item['user']['email'] not in users:
             # User does not exist in corp so invite it to the corp and add it
             # to the site
@@ -102,33 +145,43 @@ def add_site_members(api, data):
                          item['user']['apiUser'])
         elif item['role'] == 'owner':
             # Owners are auto-added at site creation
-            continue
+            return
         else:
             # User exists in corp and is not an owner to add it to the site
             print('  %s' % item['user']['email'])
             api.add_members_to_site({"members": [item['user']['email']]})
+    _create_all(api, SITE_MEMBERS, create, data, workers,
+                journal)
 
 
-def create_integrations(api, data):
+def create_integrations(api, data, workers=1, journal=None):
     print('Adding integrations...')
-    for item in data:
+
+    def create(item):
         print('  %s' % item['name'])
         try:
             api.add_integration(item)
         except Exception as e:  # pylint: disable=broad-except
             print('    Failed: %s' % e)
+            return False
+    _create_all(api, INTEGRATIONS, create, data, workers,
+                journal)
 
 
-def create_advanced_rules(api, source, data):
+def create_advanced_rules(api, source, data, workers=1, journal=None):
     print('Creating advanced rules...')
     not_copied = []
-    for item in data:
+
+    def copy(item):
         try:
             response = api.copy_advanced_rule(item['shortName'],
                                               source['site']) or item
             print('  %s (ID %s)' % (response['shortName'], response['id']))
         except Exception as e:  # pylint: disable=broad-except
             not_copied.append(item)
+            return False
+        return True
+    _create_all(api, ADVANCED_RULES, copy, data, workers, journal)
     if not_copied:
         print('\nEmail support@signalsciences.com with the following...\n'
               'Please copy the following advanced rules from %s/%s to %s/%s:' %
@@ -136,12 +189,13 @@ def create_advanced_rules(api, source, data):
         for item in not_copied:
             print('    %s (ID %s)' % (item['shortName'], item['id']))
 
+
 def create_corp_signals(api, data):
     print("Creating corp signals...")
     corp_signals = api.get_corp_signals()
-    current_corp_signals = []
+    current_corp_signals = set()
     if 'data' in corp_signals:
-        current_corp_signals = [x['tagName'] for x in corp_signals['data']]
+        current_corp_signals = {x['tagName'] for x in corp_signals['data']}
     for signal in data:
         if signal['tagName'] in current_corp_signals:
             print("  corp signal {} exists, skipping".format(signal['tagName']))
@@ -153,9 +207,9 @@ def create_corp_signals(api, data):
 def create_corp_rule_lists(api, data):
     print("Creating corp rule lists...")
     corp_rule_lists = api.get_corp_rule_lists()
+    current_corp_rule_lists = set()
     if 'data' in corp_rule_lists:
-        current_corp_rule_lists['rule_list'] = [x['id'] for x in
-            corp_rule_lists['data']]
+        current_corp_rule_lists = {x['id'] for x in corp_rule_lists['data']}
     for rule_list in data:
         if rule_list['id'] in current_corp_rule_lists:
             print("  corp rule list {} exists, skipping".format(rule_list['id']))
@@ -163,7 +217,8 @@ def create_corp_rule_lists(api, data):
             api.add_corp_rule_lists(rule_list)
             print("  {}".format(rule_list['id']))
 
-def deploys(api, site_name, data, display_name, categories):
+
+def _create_new_site(api, site_name, data, display_name, journal):
     # Check that the site doesn't already exist
     try:
         api.get_corp_site(site_name)
@@ -177,20 +232,32 @@ def deploys(api, site_name, data, display_name, categories):
     else:
         # Site was successfully retrieved, which means it already exists
         print("Site '%s' already exists" % site_name)
-        return
+        return False
 
     if not create_site(api, site_name, data['site'], display_name):
+        return False
+    if journal:
+        journal.record(site_name, SITE)
+    return True
+
+
+def deploys(api, site_name, data, display_name, categories, workers=1,
+            journal=None):
+    if journal and journal.is_completed(site_name, SITE):
+        # The site was created by the run being resumed
+        print("Resuming deploy to site '%s'..." % site_name)
+    elif not _create_new_site(api, site_name, data, display_name, journal):
         return
 
     api.site = site_name
 
     if 'corp_items' in data:
         if 'rule_list' in data['corp_items']:
-            create_corp_rule_lists(data['corp_items']['rule_list'])
+            create_corp_rule_lists(api, data['corp_items']['rule_list'])
         if 'signal' in data['corp_items']:
-            create_corp_signals(data['corp_items']['signal'])
+            create_corp_signals(api, data['corp_items']['signal'])
 
-    steps = OrderedDict()
+    steps = {}
     steps[RULE_LISTS] = (
         create_rule_lists, (api, data['rule_lists'])
     )
@@ -226,19 +293,28 @@ def deploys(api, site_name, data, display_name, categories):
         steps[SIGNAL_RULES] = (
             create_signal_rules, (api, data['signal_rules'])
         )
-        
-    for k in steps:
-        if categories and k in categories:
-            steps[k][0](*steps[k][1])
-        else:
-            print('Skipping %s (excluded)' % k)
-
 
-def deploy(api, site_name, file_name, display_name, categories=None):
+    # Run the stages in order so that nothing is created before the lists
+    # and signals it depends on. The items of each category are created
+    # concurrently.
+    for stage in DEPLOY_STAGES:
+        for k in stage:
+            if k not in steps:
+                continue
+            if not categories or k not in categories:
+                print('Skipping %s (excluded)' % k)
+            elif journal and journal.is_completed(site_name, k):
+                print('Skipping %s (completed)' % k)
+            else:
+                steps[k][0](*steps[k][1], workers=workers, journal=journal)
+                record(api, journal, k)
+
+
+def deploy(api, site_name, file_name, display_name, categories=None,
+           workers=1, journal=None):
     print("Deploying to new site '%s' from file '%s'..." %
           (site_name, file_name))
 
-    with open(file_name, 'r') as f:
-        data = json.loads(f.read())
+    data = load_backup(file_name)
 
-    deploys(api, site_name, data, display_name, categories)
+    deploys(api, site_name, data, display_name, categories, workers, journal)
@@ -0,0 +1,264 @@
+from contextlib import redirect_stdout
+import json
+import sys
+
+from sigsci_site_manager.backup import backups, load_backup
+from sigsci_site_manager.consts import (RULE_LISTS,
+                                        CUSTOM_SIGNALS,
+                                        REQUEST_RULES,
+                                        SITE_RULES,
+                                        SIGNAL_RULES,
+                                        TEMPLATED_RULES,
+                                        CUSTOM_ALERTS,
+                                        SITE_MEMBERS,
+                                        INTEGRATIONS,
+                                        ADVANCED_RULES)
+from sigsci_site_manager.journal import item_key
+from sigsci_site_manager.util import (conditions_fingerprint,
+                                      find_equal_rule, index_rules,
+                                      rule_fingerprint)
+
+# Prefix of a snapshot spec naming a live site rather than a backup
+LIVE_SITE_PREFIX = 'site:'
+
+# Backup keys compared by the diff, in backup order, and their category
+DIFF_CATEGORIES = [
+    ('site', None),
+    ('rule_lists', RULE_LISTS),
+    ('request_rules', REQUEST_RULES),
+    ('site_rules', SITE_RULES),
+    ('signal_rules', SIGNAL_RULES),
+    ('custom_signals', CUSTOM_SIGNALS),
+    ('templated_rules', TEMPLATED_RULES),
+    ('custom_alerts', CUSTOM_ALERTS),
+    ('site_members', SITE_MEMBERS),
+    ('advanced_rules', ADVANCED_RULES),
+    ('integrations', INTEGRATIONS)
+]
+
+# Categories whose items are identified by their rule fingerprint
+RULE_CATEGORIES = (REQUEST_RULES, SITE_RULES, SIGNAL_RULES)
+# Rule fields compared when matching rules, which only differ in form or by
+# being missing from one side between matched rules
+FINGERPRINT_FIELDS = ['groupOperator', 'conditions', 'action', 'actions',
+                      'signal']
+
+
+def is_live_site(spec):
+    return spec.startswith(LIVE_SITE_PREFIX)
+
+
+def load_snapshot_spec(api, spec, workers=1):
+    """
+    Load a site snapshot from a backup file, an archive or store spec, or
+    a live site given as site:NAME
+    """
+    if is_live_site(spec):
+        return backups(api, spec[len(LIVE_SITE_PREFIX):], workers)
+    return load_backup(spec)
+
+
+def _group(items, key):
+    """Group items by key, keeping their order"""
+    groups = {}
+    for item in items:
+        groups.setdefault(key(item), []).append(item)
+    return groups
+
+
+def _pair(old, new, key):
+    """
+    Match the items of two lists by key in a single pass over each. Returns
+    the matched (old, new) pairs and the unmatched items of both lists.
+    Items with the same key are paired in their original order.
+    """
+    old_groups = _group(old, key)
+    pairs = []
+    added = []
+    for k, items in _group(new, key).items():
+        old_items = old_groups.pop(k, [])
+        pairs.extend(zip(old_items, items))
+        added.extend(items[len(old_items):])
+        old_groups[k] = old_items[len(items):]
+    removed = [x for items in old_groups.values() for x in items]
+    return pairs, added, removed
+
+
+def _changed_fields(old, new):
+    """Top level fields that differ between two versions of an item"""
+    fields = {}
+    for field in sorted(set(old) | set(new), key=str):
+        if old.get(field) != new.get(field):
+            fields[field] = {'old': old.get(field), 'new': new.get(field)}
+    return fields
+
+
+def _change(category, key, old, new):
+    change = {'key': key, 'name': _label(category, new),
+              'fields': _changed_fields(old, new)}
+    entries = change['fields'].pop('entries', None)
+    if entries is not None:
+        # Only the entry deltas of a list, not whole lists of entries
+        old_entries = set(old.get('entries') or [])
+        new_entries = set(new.get('entries') or [])
+        change['entries'] = {
+            'additions': [x for x in dict.fromkeys(new.get('entries') or [])
+                          if x not in old_entries],
+            'deletions': [x for x in dict.fromkeys(old.get('entries') or [])
+                          if x not in new_entries]
+        }
+    return change
+
+
+def diff_rules(key, old, new, signal_rule=False):
+    """
+    Diff two lists of rules matched like merge matches them, by equal
+    conditions and equal actions, so a rule whose conditions or actions are
+    modified shows as removed and added, while one with a different reason,
+    expiration or enabled state is changed. Identical rules are matched on
+    their JSON text first and only the others are normalized. The text isn't
+    key-sorted, which is much faster: the same rule with its keys in another
+    order is still matched by its normal form.
+    """
+    _, added, removed = _pair(old, new, json.dumps)
+    index = index_rules(removed)
+    matched = set()
+    pairs = []
+    unmatched = []
+    for rule in added:
+        match = find_equal_rule(index, rule, signal_rule)
+        if match is None:
+            unmatched.append(rule)
+            continue
+        candidates = index[conditions_fingerprint(match)]
+        candidates[:] = [x for x in candidates if x is not match]
+        matched.add(id(match))
+        pairs.append((match, rule))
+
+    changed = []
+    for a, b in pairs:
+        change = _change(key, rule_fingerprint(b, signal_rule), a, b)
+        for field in FINGERPRINT_FIELDS:
+            change['fields'].pop(field, None)
+        if change['fields']:
+            changed.append(change)
+    return {'added': unmatched,
+            'removed': [x for x in removed if id(x) not in matched],
+            'changed': changed}
+
+
+def diff_items(key, category, old, new):
+    """Diff two lists of items identified by their category identity key"""
+    pairs, added, removed = _pair(old, new,
+                                  lambda x: item_key(category, x))
+    return {
+        'added': added,
+        'removed': removed,
+        'changed': [_change(key, item_key(category, a), a, b)
+                    for a, b in pairs if a != b]
+    }
+
+
+def diff_snapshots(old, new):
+    """
+    Compare two site snapshots category by category. Returns the added,
+    removed and changed items of every category that differs.
+    """
+    result = {'old': old.get('source'), 'new': new.get('source'),
+              'categories': {}}
+    for key, category in DIFF_CATEGORIES:
+        if key not in old and key not in new:
+            continue
+        if category is None:
+            # Site settings are a single item
+            a, b = old.get(key) or {}, new.get(key) or {}
+            diff = {'added': [], 'removed': [],
+                    'changed': [_change(key, key, a, b)] if a != b else []}
+        elif category == TEMPLATED_RULES:
+            # Templated rules are a dict of configurations by rule name
+            a, b = old.get(key) or {}, new.get(key) or {}
+            diff = {
+                'added': [{'name': x, **b[x]} for x in b if x not in a],
+                'removed': [{'name': x, **a[x]} for x in a if x not in b],
+                'changed': [_change(key, x, {'name': x, **a[x]},
+                                    {'name': x, **b[x]})
+                            for x in a if x in b and a[x] != b[x]]
+            }
+        elif category in RULE_CATEGORIES:
+            diff = diff_rules(key, old.get(key) or [], new.get(key) or [],
+                              signal_rule=category == SIGNAL_RULES)
+        else:
+            diff = diff_items(key, category, old.get(key) or [],
+                              new.get(key) or [])
+        if any(diff.values()):
+            result['categories'][key] = diff
+    return result
+
+
+def _label(key, item):
+    """Short human readable name of an item"""
+    if key == 'rule_lists':
+        return "'%s' (%s)" % (item.get('name'), item.get('type'))
+    if key in ('custom_signals', 'custom_alerts'):
+        return "'%s'" % (item.get('longName') or item.get('shortName') or
+                         item.get('tagName'))
+    if key == 'site_members':
+        return item.get('user', {}).get('email')
+    if key == 'integrations':
+        return '%s %s' % (item.get('type'), item.get('url'))
+    if key == 'advanced_rules':
+        return "'%s'" % item.get('shortName')
+    if key == 'templated_rules':
+        return item.get('name')
+    if key == 'site':
+        return 'site settings'
+    # Rules have no name, describe them by their reason and conditions
+    return "'%s' (%s, %d conditions)" % (
+        item.get('reason'), item.get('type', 'request'),
+        len(item.get('conditions') or []))
+
+
+def print_diff(result, old_name, new_name):
+    print("Comparing '%s' with '%s'" % (old_name, new_name))
+    if not result['categories']:
+        print('No differences')
+        return
+    for key, diff in result['categories'].items():
+        print('%s: %d added, %d removed, %d changed' %
+              (key, len(diff['added']), len(diff['removed']),
+               len(diff['changed'])))
+        for item in diff['added']:
+            print('  + %s' % _label(key, item))
+        for item in diff['removed']:
+            print('  - %s' % _label(key, item))
+        for change in diff['changed']:
+            print('  ~ %s' % change['name'])
+            for field, values in change['fields'].items():
+                print('      %s: %s -> %s' % (field,
+                                             json.dumps(values['old']),
+                                             json.dumps(values['new'])))
+            if 'entries' in change:
+                entries = change['entries']
+                print('      entries: %d added, %d removed' %
+                      (len(entries['additions']), len(entries['deletions'])))
+                for entry in entries['additions']:
+                    print('        + %s' % entry)
+                for entry in entries['deletions']:
+                    print('        - %s' % entry)
+
+
+def diff(api, old_spec, new_spec, as_json=False, workers=1):
+    """
+    Compare two snapshots, each a backup file, an archive or store spec or
+    a live site, and print the differences. Returns the diff.
+    """
+    # Progress printed while fetching a live site would corrupt the JSON
+    with redirect_stdout(sys.stderr if as_json else sys.stdout):
+        old = load_snapshot_spec(api, old_spec, workers)
+        new = load_snapshot_spec(api, new_spec, workers)
+    result = diff_snapshots(old, new)
+    if as_json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_diff(result, old_spec, new_spec)
+    return result
@@ -0,0 +1,109 @@
+import json
+import os
+import threading
+
+from sigsci_site_manager.consts import (RULE_LISTS,
+                                        CUSTOM_SIGNALS,
+                                        REQUEST_RULES,
+                                        SITE_RULES,
+                                        SIGNAL_RULES,
+                                        CUSTOM_ALERTS,
+                                        SITE_MEMBERS,
+                                        INTEGRATIONS,
+                                        ADVANCED_RULES)
+from sigsci_site_manager.util import rule_fingerprint
+
+# Journal category for the creation of the site itself
+SITE = 'SITE'
+# Key recorded once every item of a category has been handled
+CATEGORY_DONE = '*'
+
+
+def item_key(category, item):
+    """Identity of an item of a category as recorded in the journal"""
+    if category == RULE_LISTS:
+        return '%s|%s' % (item['name'], item['type'])
+    if category == CUSTOM_SIGNALS:
+        return item['tagName']
+    if category in (REQUEST_RULES, SITE_RULES):
+        return rule_fingerprint(item)
+    if category == SIGNAL_RULES:
+        return rule_fingerprint(item, signal_rule=True)
+    if category == CUSTOM_ALERTS:
+        return '%s|%s' % (item['tagName'], item['longName'])
+    if category == SITE_MEMBERS:
+        return item['user']['email']
+    if category == INTEGRATIONS:
+        return '%s|%s' % (item['url'], item['type'])
+    if category == ADVANCED_RULES:
+        return item['shortName']
+    # Templated rules are identified by their name
+    return item
+
+
+class Journal(object):
+    """
+    Append-only journal of the writes made by a deploy or merge, one JSON
+    record per line. Each record is flushed as soon as it is written so the
+    journal survives the command dying part way through. When resuming, the
+    records of the previous run are loaded so completed work can be skipped.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.completed = set()
+        self.lock = threading.Lock()
+        if resume and os.path.exists(path):
+            size = 0
+            with open(path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # Last line is cut short if the run was killed
+                        break
+                    size += len(line)
+                    try:
+                        record = json.loads(line.decode('utf-8'))
+                    except ValueError:
+                        continue
+                    self.completed.add((record['site'], record['category'],
+                                        record['key']))
+            # Drop a cut short last line so that new records aren't
+            # appended to it
+            os.truncate(path, size)
+        self.file = open(path, 'a' if resume else 'w')
+
+    def is_completed(self, site, category, key=CATEGORY_DONE):
+        return (site, category, key) in self.completed
+
+    def record(self, site, category, key=CATEGORY_DONE):
+        with self.lock:
+            self.completed.add((site, category, key))
+            self.file.write(json.dumps({'site': site, 'category': category,
+                                        'key': key}) + '\n')
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def pending(api, journal, category, items):
+    """
+    Return the items of a category that the journal doesn't have as written
+    to the API's site, each with its journal key. Without a journal every
+    item is returned and keys aren't computed.
+    """
+    if journal is None:
+        return [(item, None) for item in items]
+    keyed = [(item, item_key(category, item)) for item in items]
+    todo = [(item, key) for item, key in keyed
+            if not journal.is_completed(api.site, category, key)]
+    if len(todo) < len(keyed):
+        print('  Skipping %d completed item%s' %
+              (len(keyed) - len(todo), 's' if len(keyed) - len(todo) > 1
+               else ''))
+    return todo
+
+
+def record(api, journal, category, key=CATEGORY_DONE):
+    if journal is not None:
+        journal.record(api.site, category, key)
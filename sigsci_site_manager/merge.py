@@ -1,7 +1,6 @@
 from collections import OrderedDict
-import json
 
-from sigsci_site_manager.backup import backups
+from sigsci_site_manager.backup import backups, load_backup
 from sigsci_site_manager.consts import (RULE_LISTS,
                                         CUSTOM_SIGNALS,
                                         REQUEST_RULES,
@@ -12,7 +11,48 @@ from sigsci_site_manager.consts import (RULE_LISTS,
                                         SITE_MEMBERS,
                                         INTEGRATIONS,
                                         ADVANCED_RULES)
-from sigsci_site_manager.util import add_new_user, filter_data, equal_rules
+from sigsci_site_manager.journal import pending, record
+from sigsci_site_manager.parallel import run_concurrently
+from sigsci_site_manager.util import (add_new_user, filter_data,
+                                     find_equal_rule, index_rules)
+
+# Maximum number of entries sent in a single rule list update
+LIST_UPDATE_CHUNK_SIZE = 1000
+
+# Destination reads made by the merge of each category
+DEST_READS = {
+    RULE_LISTS: ['get_rule_lists'],
+    CUSTOM_SIGNALS: ['get_custom_signals'],
+    REQUEST_RULES: ['get_request_rules'],
+    SITE_RULES: ['get_site_rules'],
+    SIGNAL_RULES: ['get_signal_rules'],
+    TEMPLATED_RULES: ['get_templated_rules'],
+    CUSTOM_ALERTS: ['get_custom_alerts'],
+    SITE_MEMBERS: ['get_site_members', 'get_corp_users'],
+    INTEGRATIONS: ['get_integrations'],
+    ADVANCED_RULES: ['get_advanced_rules']
+}
+
+# Fields of the destination items that the merge of each category compares
+DEST_KEYS = {
+    RULE_LISTS: ['id', 'name', 'type', 'entries'],
+    CUSTOM_SIGNALS: ['tagName'],
+    REQUEST_RULES: ['enabled', 'groupOperator', 'conditions',
+                    'action', 'actions', 'signal', 'reason', 'expiration'],
+    SITE_RULES: ['type', 'enabled', 'groupOperator', 'conditions',
+                 'actions', 'reason', 'expiration'],
+    SIGNAL_RULES: ['enabled', 'groupOperator', 'conditions', 'signal',
+                   'reason'],
+    CUSTOM_ALERTS: ['id', 'tagName', 'longName', 'interval',
+                    'threshold', 'enabled', 'action'],
+    INTEGRATIONS: ['id', 'name', 'type', 'url', 'events'],
+    ADVANCED_RULES: ['shortName']
+}
+
+# Fields compared only when a destination item has them
+DEST_OPTIONAL_KEYS = {
+    SITE_RULES: ['signal']
+}
 
 
 def _find_match(needle: dict, haystack: list, keys: list):
@@ -26,29 +66,129 @@ def _find_match(needle: dict, haystack: list, keys: list):
     return None
 
 
-def _merge_lists(api, item, existing):
-    """Helper method to merge one list into another"""
-    merged = {
-        'entries': {
-            'additions': [],
-            'deletions': []
+def _index(items: list, keys: list):
+    """
+    Index a list of dictionaries on a set of keys. Like _find_match the first
+    item wins when several items have the same values for the keys.
+    """
+    index = {}
+    for item in items:
+        index.setdefault(tuple(item.get(key) for key in keys), item)
+    return index
+
+
+def _key(item: dict, keys: list):
+    return tuple(item[key] for key in keys)
+
+
+def _read(api, existing, name):
+    """
+    Return the response of the API read `name` from the prefetched
+    destination state, or make the read if it wasn't prefetched
+    """
+    if existing is not None and name in existing:
+        return existing[name]
+    return getattr(api, name)()
+
+
+def _dest_items(category, response):
+    """The items of a destination read, with only the fields merges compare"""
+    return filter_data(response.get('data', []), DEST_KEYS[category],
+                       optional_keys=DEST_OPTIONAL_KEYS.get(category, []))
+
+
+def _configured_templated_rules(response):
+    """
+    Names of the configured templated rules of a destination read. Merges
+    skip configured rules so their names are all that matter.
+    """
+    return {rule['name'] for rule in response['data']
+            if rule['detections'] or rule['alerts']}
+
+
+def _member_emails(members, corp_users):
+    """Emails of the site members and of the corp users of a destination"""
+    return ({m['user']['email'] for m in filter_data(members['data'],
+                                                     ['user'])},
+            {u['email'] for u in filter_data(corp_users['data'], ['email'])})
+
+
+def prefetch(api, categories, workers=1):
+    """
+    Make every destination read needed to merge the categories up front,
+    using up to `workers` requests at once
+    """
+    names = list(dict.fromkeys(name for k in categories
+                               for name in DEST_READS.get(k, [])))
+    results = run_concurrently([(getattr(api, name), ()) for name in names],
+                               workers)
+    return dict(zip(names, results))
+
+
+def _diff_entries(entries: list, existing: list, mirror=False):
+    """
+    Work out the entries to add to and, when mirroring, delete from an
+    existing list so that it contains the given entries
+    """
+    existing_entries = set(existing)
+    # dict.fromkeys drops duplicates while keeping the original order
+    additions = [entry for entry in dict.fromkeys(entries)
+                 if entry not in existing_entries]
+    deletions = []
+    if mirror:
+        new_entries = set(entries)
+        deletions = [entry for entry in dict.fromkeys(existing)
+                     if entry not in new_entries]
+    return additions, deletions
+
+
+def _chunk_entries(additions: list, deletions: list,
+                   size=LIST_UPDATE_CHUNK_SIZE):
+    """
+    Split list changes into update payloads of at most `size` entries.
+    Deletions go first to make room in the list for the additions.
+    """
+    changes = ([('deletions', entry) for entry in deletions] +
+               [('additions', entry) for entry in additions])
+    chunks = []
+    for i in range(0, len(changes), size):
+        chunk = {
+            'entries': {
+                'additions': [],
+                'deletions': []
+            }
         }
-    }
-    for entry in item['entries']:
-        if entry not in existing['entries']:
-            # Entry exists in src but not dst
-            merged['entries']['additions'].append(entry)
-    if not merged['entries']['additions']:
+        for kind, entry in changes[i:i + size]:
+            chunk['entries'][kind].append(entry)
+        chunks.append(chunk)
+    return chunks
+
+
+def _merge_lists(api, item, existing, mirror=False):
+    """Helper method to merge one list into another"""
+    additions, deletions = _diff_entries(item['entries'],
+                                         existing['entries'], mirror)
+    if not additions and not deletions:
         print('  Skipping %s (no differences)' % item['name'])
-    else:
-        print('  Updating %s' % item['name'])
+        return True
+
+    print('  Updating %s' % item['name'])
+    chunks = _chunk_entries(additions, deletions)
+    success = True
+    for i, chunk in enumerate(chunks):
         try:
-            api.update_rule_lists(existing['id'], merged)
+            api.update_rule_lists(existing['id'], chunk)
         except AssertionError:
             # Raise this to facilitate unit testing
             raise
         except Exception as e:  # pylint: disable=broad-except
-            print('    Failed: %s' % e)
+            if len(chunks) > 1:
+                print('    Failed (part %d of %d): %s' %
+                      (i + 1, len(chunks), e))
+            else:
+                print('    Failed: %s' % e)
+            success = False
+    return success
 
 
 def _add_list(api, item):
@@ -61,147 +201,205 @@ def _add_list(api, item):
         raise
     except Exception as e:  # pylint: disable=broad-except
         print('    Failed: %s' % e)
-
-
-def merge_rule_lists(api, data):
+        return False
+    return True
+
+
+def _list_action(item, by_name_type, by_name):
+    """
+    Decide how to merge a list, returning ('update', existing list),
+    ('create', list to add) or ('skip', None)
+    """
+    existing = by_name_type.get(_key(item, ['name', 'type']))
+    if existing:
+        # Found an existing list with same name and type
+        return 'update', existing
+
+    if _key(item, ['name']) in by_name:
+        # Found an existing list with the same name but different type.
+        # Set the name to be the original name with the new type appended.
+        # Names can only be 32 characters so need to leave space for the
+        # type.
+        item = dict(item, name='%s-%s' % (
+            item['name'][0:31-len(item['type'])], item['type']))
+
+        # Make sure this new name doesn't already exist. If it does that
+        # means it was already created on a previous merge and so will be
+        # covered on another iteration through the existing lists.
+        if _key(item, ['name']) in by_name:
+            return 'skip', None
+
+    # No matching list was found to exist so add the list as a new one
+    return 'create', item
+
+
+def _alert_action(item, alerts):
+    """
+    Decide how to merge a custom alert, returning ('create', None),
+    ('update', existing alert), ('skip', existing alert) or (None, None)
+    for alerts that are never merged
+    """
+    if item['action'] == 'siteMetricInfo':
+        # Default agent alerts are added at site creation
+        return None, None
+    alert = alerts.get(_key(item, ['tagName', 'longName']))
+    if alert is None:
+        return 'create', None
+    if (not alert['enabled'] and
+            (item['interval'] != alert['interval'] or
+             item['threshold'] != alert['threshold'] or
+             item['enabled'] != alert['enabled'] or
+             item['action'] != alert['action'])):
+        # Alert with same tag and description exists but is not
+        # enabled so update to match the source alert.
+        return 'update', alert
+    # Alert with same tag and description exists and is enabled
+    # or has the same values as the source alert so don't touch
+    # it.
+    return 'skip', alert
+
+
+def _member_action(item, members, corp_users):
+    """
+    Decide how to merge a site member: 'skip' an existing member, 'add' a
+    corp user to the site or 'invite' a new user to the corp
+    """
+    if item['user']['email'] in members:
+        return 'skip'
+    if item['user']['email'] not in corp_users:
+        return 'invite'
+    return 'add'
+
+
+def _integration_action(item, integs):
+    """
+    Decide how to merge an integration, returning ('create', None),
+    ('update', existing integration) or ('skip', existing integration)
+    """
+    integ = integs.get(_key(item, ['url', 'type']))
+    if integ is None:
+        return 'create', None
+    if sorted(item['events']) == sorted(integ['events']):
+        # Integration events are the same
+        return 'skip', integ
+    return 'update', integ
+
+
+def merge_rule_lists(api, data, mirror=False, journal=None, existing=None):
     print('Merging lists...')
 
     # Get the existing lists
-    keys = ['id', 'name', 'type', 'entries']
-    src = api.get_rule_lists()
-    lists = filter_data(src['data'], keys)
-
-    # Loop through the lists to merge in
-    for item in data:
-        existing = _find_match(item, lists, ['name', 'type'])
-        if existing:
-            # Found an existing list with same name and type
-            _merge_lists(api, item, existing)
-            # Go on to the next item
-            continue
-
-        existing = _find_match(item, lists, ['name'])
-        if existing:
-            # Found an existing list with the same name but different type.
-            # Set the name to be the original name with the new type appended.
-            # Names can only be 32 characters so need to leave space for the
-            # type.
-            item['name'] = '%s-%s' % (
-                item['name'][0:31-len(item['type'])], item['type'])
-
-            # Make sure this new name doesn't already exist. If it does that
-            # means it was already created on a previous merge and so will be
-            # covered on another iteration through the existing lists.
-            exist = _find_match(item, lists, ['name'])
-            if not exist:
-                _add_list(api, item)
-            # Go on to the next item
-            continue
-
-        # No matching list was found to exist so add the list as a new one
-        _add_list(api, item)
+    src = _read(api, existing, 'get_rule_lists')
+    lists = _dest_items(RULE_LISTS, src)
+    by_name_type = _index(lists, ['name', 'type'])
+    by_name = _index(lists, ['name'])
+
+    # Loop through the lists to merge in. The journal key is taken before
+    # any renaming.
+    for item, key in pending(api, journal, RULE_LISTS, data):
+        action, target = _list_action(item, by_name_type, by_name)
+        if action == 'update':
+            success = _merge_lists(api, item, target, mirror)
+        elif action == 'create':
+            success = _add_list(api, target)
+        else:
+            # The renamed list already exists
+            success = True
+        if success:
+            record(api, journal, RULE_LISTS, key)
 
 
-def merge_custom_signals(api, data):
+def merge_custom_signals(api, data, journal=None, existing=None):
     print('Merging custom signals...')
 
     # Get the existing custom signals
-    keys = ['tagName']
-    src = api.get_custom_signals()
-    lists = filter_data(src['data'], keys)
-
-    for item in data:
-        for existing in lists:
-            if existing['tagName'] == item['tagName']:
-                print('  Skipping %s (exists)' % item['shortName'])
-                break
+    src = _read(api, existing, 'get_custom_signals')
+    tags = {signal['tagName']
+            for signal in _dest_items(CUSTOM_SIGNALS, src)}
+
+    for item, key in pending(api, journal, CUSTOM_SIGNALS, data):
+        if item['tagName'] in tags:
+            print('  Skipping %s (exists)' % item['shortName'])
         else:
-            # List iteration ended without breaking on a tag match so add
-            # the signal as a new one
             print('  Adding %s' % item['shortName'])
             api.add_custom_signals(item)
+            record(api, journal, CUSTOM_SIGNALS, key)
 
 
-def merge_request_rules(api, data):
+def merge_request_rules(api, data, journal=None, existing=None):
     print('Merging request rules...')
 
     # Get the existing request rules
-    keys = ['enabled', 'groupOperator', 'conditions',
-            'action', 'actions', 'signal', 'reason', 'expiration']
-    src = api.get_request_rules()
-    rules = filter_data(src['data'], keys)
-
-    for item in data:
-        for rule in rules:
-            if equal_rules(rule, item):
-                print('  Skipping %s (exists)' % item['reason'])
-                break
+    src = _read(api, existing, 'get_request_rules')
+    rules = _dest_items(REQUEST_RULES, src)
+    index = index_rules(rules)
+
+    for item, key in pending(api, journal, REQUEST_RULES, data):
+        if find_equal_rule(index, item) is not None:
+            print('  Skipping %s (exists)' % item['reason'])
         else:
             print('  Adding %s' % item['reason'])
             try:
                 api.add_request_rules(item)
             except Exception as e:  # pylint: disable=broad-except
                 print('    Failed: %s' % e)
+            else:
+                record(api, journal, REQUEST_RULES, key)
 
 
-def merge_site_rules(api, data):
+def merge_site_rules(api, data, journal=None, existing=None):
     print('Merging site rules...')
 
     # Get the existing site rules
-    keys = ['type', 'enabled', 'groupOperator', 'conditions',
-            'actions', 'reason', 'expiration']
-    optional_alert_keys = ['signal']
-    src = api.get_site_rules()
-    rules = filter_data(src['data'], keys, optional_keys=optional_alert_keys)
-
-    for item in data:
-        for rule in rules:
-            if equal_rules(rule, item):
-                print('  Skipping %s (exists)' % item['reason'])
-                break
+    src = _read(api, existing, 'get_site_rules')
+    rules = _dest_items(SITE_RULES, src)
+    index = index_rules(rules)
+
+    for item, key in pending(api, journal, SITE_RULES, data):
+        if find_equal_rule(index, item) is not None:
+            print('  Skipping %s (exists)' % item['reason'])
         else:
             print('  Adding %s' % item['reason'])
             try:
                 api.add_site_rules(item)
             except Exception as e:  # pylint: disable=broad-except
                 print('    Failed: %s' % e)
+            else:
+                record(api, journal, SITE_RULES, key)
 
 
-def merge_signal_rules(api, data):
+def merge_signal_rules(api, data, journal=None, existing=None):
     print('Merging signal rules...')
 
     # Get the existing signal rules
-    keys = ['enabled', 'groupOperator', 'conditions', 'signal', 'reason', ]
-    src = api.get_signal_rules()
-    rules = filter_data(src['data'], keys)
-
-    for item in data:
-        for rule in rules:
-            if equal_rules(rule, item, signal_rule=True):
-                print('  Skipping %s (exists)' % item['reason'])
-                break
+    src = _read(api, existing, 'get_signal_rules')
+    rules = _dest_items(SIGNAL_RULES, src)
+    index = index_rules(rules)
+
+    for item, key in pending(api, journal, SIGNAL_RULES, data):
+        if find_equal_rule(index, item, signal_rule=True) is not None:
+            print('  Skipping %s (exists)' % item['reason'])
         else:
             print('  Adding %s' % item['reason'])
             try:
                 api.add_signal_rules(item)
             except Exception as e:  # pylint: disable=broad-except
                 print('    Failed: %s' % e)
+            else:
+                record(api, journal, SIGNAL_RULES, key)
 
 
-def merge_templated_rules(api, data):
+def merge_templated_rules(api, data, journal=None, existing=None):
     print('Merging templated rules...')
 
     # Get existing templated rules. We also only care about the names of
     # configured rules because we're going to skip any configured templated
     # rules.
-    src = api.get_templated_rules()
-    rule_names = []
-    for rule in src['data']:
-        if rule['detections'] or rule['alerts']:
-            rule_names.append(rule['name'])
+    rule_names = _configured_templated_rules(
+        _read(api, existing, 'get_templated_rules'))
 
     # Loop through the templated rules
-    for item in data:
+    for item, key in pending(api, journal, TEMPLATED_RULES, data):
         if item in rule_names:
             # Rule name in the list of already configured rules so skip
             print('  Skipping %s (configured)' % item)
@@ -211,106 +409,83 @@ def merge_templated_rules(api, data):
                 api.add_templated_rules(item, data[item])
             except Exception as e:  # pylint: disable=broad-except
                 print('    Failed: %s' % e)
+            else:
+                record(api, journal, TEMPLATED_RULES, key)
 
 
-def merge_custom_alerts(api, data):
+def merge_custom_alerts(api, data, journal=None, existing=None):
     print('Merging custom alerts...')
 
     # Get existing alerts
-    keys = ['id', 'tagName', 'longName', 'interval',
-            'threshold', 'enabled', 'action']
-    src = api.get_custom_alerts()
-    alerts = filter_data(src['data'], keys)
-
-    for item in data:
-        if item['action'] == 'siteMetricInfo':
-            # Default agent alerts are added at site creation
-            continue
-        for alert in alerts:
-            if (item['tagName'] == alert['tagName'] and
-                    item['longName'] == alert['longName']):
-                if (not alert['enabled'] and
-                        (item['interval'] != alert['interval'] or
-                         item['threshold'] != alert['threshold'] or
-                         item['enabled'] != alert['enabled'] or
-                         item['action'] != alert['action'])):
-                    # Alert with same tag and description exists but is not
-                    # enabled so update to match the source alert.
-                    print('  Updating %s' % item['longName'])
-                    api.update_custom_alert(alert['id'], item)
-                    break
-                else:
-                    # Alert with same tag and description exists and is enabled
-                    # or has the same values as the source alert so don't touch
-                    # it.
-                    print('  Skipping %s (exists)' % item['longName'])
-                    break
-        else:
+    src = _read(api, existing, 'get_custom_alerts')
+    alerts = _index(_dest_items(CUSTOM_ALERTS, src), ['tagName', 'longName'])
+
+    for item, key in pending(api, journal, CUSTOM_ALERTS, data):
+        action, alert = _alert_action(item, alerts)
+        if action == 'create':
             print('  Adding %s' % item['longName'])
             api.add_custom_alert(item)
+            record(api, journal, CUSTOM_ALERTS, key)
+        elif action == 'update':
+            print('  Updating %s' % item['longName'])
+            api.update_custom_alert(alert['id'], item)
+            record(api, journal, CUSTOM_ALERTS, key)
+        elif action == 'skip':
+            print('  Skipping %s (exists)' % item['longName'])
 
 
-def merge_site_members(api, data):
+def merge_site_members(api, data, journal=None, existing=None):
     print('Merging users...')
 
-    # Get existing site users
-    keys = ['user']
-    src = api.get_site_members()
-    users = filter_data(src['data'], keys)
-
-    # Get existing corp users in case user needs to be added
-    keys = ['email']
-    src = api.get_corp_users()
-    corp_users = [user['email'] for user in filter_data(src['data'], keys)]
+    # Get existing site users, and the corp users in case a user needs to
+    # be added
+    users, corp_users = _member_emails(
+        _read(api, existing, 'get_site_members'),
+        _read(api, existing, 'get_corp_users'))
 
     # Loop through the users to add
-    for item in data:
-        for user in users:
+    for item, key in pending(api, journal, SITE_MEMBERS, data):
+        action = _member_action(item, users, corp_users)
+        if action == 'skip':
             # Skip users that exist in the site
-            if item['user']['email'] == user['user']['email']:
-                print('  Skipping %s (exists)' % item['user']['email'])
-                break
+            print('  Skipping %s (exists)' % item['user']['email'])
+            continue
+        if action == 'invite':
+            # User does not exist in corp so invite it to the corp and add
+            # it to the site
+            print('  %s (New user - Corp role: %s, API user: %s)' %
+                  (item['user']['email'],
+                   item['role'],
+                   item['user']['apiUser']))
+            add_new_user(api,
+                         item['user']['email'],
+                         item['role'],
+                         item['user']['apiUser'])
         else:
-            if item['user']['email'] not in corp_users:
-                # User does not exist in corp so invite it to the corp and add
-                # it to the site
-                print('  %s (New user - Corp role: %s, API user: %s)' %
-                      (item['user']['email'],
-                       item['role'],
-                       item['user']['apiUser']))
-                add_new_user(api,
-                             item['user']['email'],
-                             item['role'],
-                             item['user']['apiUser'])
-            else:
-                # Add missing user
-                print('  Adding %s' % item['user']['email'])
-                role = {'role': item['role']}
-                api.add_members_to_site({"members": [item['user']['email']]})
+            # Add missing user
+            print('  Adding %s' % item['user']['email'])
+            api.add_members_to_site({"members": [item['user']['email']]})
+        record(api, journal, SITE_MEMBERS, key)
 
 
-def merge_integrations(api, data):
+def merge_integrations(api, data, journal=None, existing=None):
     print('Merging integrations...')
 
     # Get existing integrations
-    keys = ['id', 'name', 'type', 'url', 'events']
-    src = api.get_integrations()
-    integs = filter_data(src['data'], keys)
+    src = _read(api, existing, 'get_integrations')
+    integs = _index(_dest_items(INTEGRATIONS, src), ['url', 'type'])
 
     # Loop through integrations to add/update
-    for item in data:
-        for integ in integs:
-            if item['url'] == integ['url'] and item['type'] == integ['type']:
-                # Integration exists, see if it needs updating
-                if sorted(item['events']) == sorted(integ['events']):
-                    # Integration events are the same, skip
-                    print('  Skipping %s (exists)' % item['name'])
-                    break
-                else:
-                    # Integration events are different, updating
-                    print('  Updating %s' % item['name'])
-                    api.update_integration(integ['id'], item)
-                    break
+    for item, key in pending(api, journal, INTEGRATIONS, data):
+        action, integ = _integration_action(item, integs)
+        if action == 'skip':
+            # Integration events are the same, skip
+            print('  Skipping %s (exists)' % item['name'])
+        elif action == 'update':
+            # Integration events are different, updating
+            print('  Updating %s' % item['name'])
+            api.update_integration(integ['id'], item)
+            record(api, journal, INTEGRATIONS, key)
         else:
             # Add missing integration
             print('  Adding %s' % item['name'])
@@ -318,17 +493,19 @@ def merge_integrations(api, data):
                 api.add_integration(item)
             except Exception as e:  # pylint: disable=broad-except
                 print('    Failed: %s' % e)
+            else:
+                record(api, journal, INTEGRATIONS, key)
 
 
-def merge_advanced_rules(api, source, data):
+def merge_advanced_rules(api, source, data, journal=None, existing=None):
     print('Merging advanced rules...')
 
     # Get the existing advanced rules
-    src = api.get_advanced_rules()
-    rules = filter_data(src.get('data', []), ['shortName'])
-    rule_names = [r['shortName'] for r in rules]
+    src = _read(api, existing, 'get_advanced_rules')
+    rule_names = {r['shortName']
+                  for r in _dest_items(ADVANCED_RULES, src)}
     not_copied = []
-    for item in data:
+    for item, key in pending(api, journal, ADVANCED_RULES, data):
         if item['shortName'] not in rule_names:
             try:
                 response = api.copy_advanced_rule(item['shortName'],
@@ -337,6 +514,8 @@ def merge_advanced_rules(api, source, data):
                                                response['id']))
             except Exception as e:  # pylint: disable=broad-except
                 not_copied.append(item)
+            else:
+                record(api, journal, ADVANCED_RULES, key)
         else:
             print('  Skipping %s (exists)' % item)
     if not_copied:
@@ -347,7 +526,8 @@ def merge_advanced_rules(api, source, data):
             print('    %s (ID %s)' % (item['shortName'], item['id']))
 
 
-def merges(api, site_name, data, categories):
+def merges(api, site_name, data, categories, mirror_lists=False,
+           journal=None, workers=1):
     # Check that the site already exists
     try:
         api.get_corp_site(site_name)
@@ -355,7 +535,7 @@ def merges(api, site_name, data, categories):
         # If the site is not found we can't continue
         if 'Site not found' in str(e):
             print("Site '%s' does not exist" % site_name)
-            return
+            return False
         # Some other error happened so re-raise the exception
         raise
 
@@ -363,7 +543,7 @@ def merges(api, site_name, data, categories):
 
     steps = OrderedDict()
     steps[RULE_LISTS] = (
-        merge_rule_lists, (api, data['rule_lists'])
+        merge_rule_lists, (api, data['rule_lists'], mirror_lists)
     )
     steps[CUSTOM_SIGNALS] = (
         merge_custom_signals, (api, data['custom_signals'])
@@ -398,21 +578,41 @@ def merges(api, site_name, data, categories):
             merge_signal_rules, (api, data['signal_rules'])
         )
 
+    todo = [k for k in steps if categories and k in categories and
+            not (journal and journal.is_completed(site_name, k))]
+    # Read the destination state of every category at once rather than
+    # alternating reads and writes category by category
+    existing = prefetch(api, todo, workers)
+
     for k in steps:
-        if categories and k in categories:
-            steps[k][0](*steps[k][1])
-        else:
+        if not categories or k not in categories:
             print('Skipping %s (excluded)' % k)
+        elif k not in todo:
+            print('Skipping %s (completed)' % k)
+        else:
+            steps[k][0](*steps[k][1], journal=journal, existing=existing)
+            record(api, journal, k)
 
+    return True
 
-def merge(api, dst_site, src_site=None, file_name=None, categories=None):
+
+def load_source(api, src_site=None, file_name=None, workers=1):
+    """Take a snapshot of the site or file to merge from"""
+    if src_site:
+        return backups(api, src_site, workers)
+    return load_backup(file_name)
+
+
+def merge(api, dst_site, src_site=None, file_name=None, categories=None,
+          workers=1, data=None, mirror_lists=False, journal=None):
     if src_site:
         print('=' * 80)
         print("Merging site '%s' onto site '%s'..." % (src_site, dst_site))
-        data = backups(api, src_site)
     elif file_name:
         print("Merging file '%s' onto site '%s'..." % (file_name, dst_site))
-        with open(file_name, 'r') as f:
-            data = json.loads(f.read())
 
-    merges(api, dst_site, data, categories)
+    if data is None:
+        data = load_source(api, src_site, file_name, workers)
+
+    return merges(api, dst_site, data, categories, mirror_lists, journal,
+                  workers)
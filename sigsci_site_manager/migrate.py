@@ -1,35 +1,60 @@
 import json
+import os
 import re
+import threading
 from copy import deepcopy
 
-def get_dependency_items(item, found=None):
-    if found is None:
-        found = []
-    if isinstance(item, dict):
-        if any([x.startswith('corp.') for x in item.values() if isinstance(x, str)]):
-            if item not in found:
-                found.append(item)
-        for k, v in item.items():
-            if isinstance(v, (list, tuple, dict)):
-                found.extend([x for x in get_dependency_items(v, found=found) if x not in found])
-    elif isinstance(item, (list, tuple)):
-        for i in item:
-            found.extend([x for x in get_dependency_items(i, found=found) if x not in found])
+from sigsci_site_manager.backup import MANIFEST_FILE, load_backup
+from sigsci_site_manager.compression import (CODECS, compression_for_name,
+                                             open_file)
+from sigsci_site_manager.parallel import run_per_item
+
+def _walk(item):
+    """
+    Yield every dict nested in item, parents before their children, using
+    an explicit stack so deeply nested rules can't hit the recursion limit
+    """
+    stack = [item]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            yield item
+            children = item.values()
+        elif isinstance(item, (list, tuple)):
+            children = item
+        else:
+            continue
+        # Reversed so that children are visited in their original order
+        stack.extend(reversed([x for x in children
+                               if isinstance(x, (list, tuple, dict))]))
+
+def _has_corp_value(item):
+    return any(isinstance(x, str) and x.startswith('corp.')
+               for x in item.values())
+
+def get_dependency_items(item):
+    """Return the dicts nested in item that have a corp level value"""
+    found = []
+    seen = set()
+    for x in _walk(item):
+        if id(x) not in seen and _has_corp_value(x):
+            seen.add(id(x))
+            found.append(x)
     return found
 
 def get_rule_dependencies(rule):
+    """
+    Return the corp lists (inList conditions) and corp signals (addSignal
+    actions) used by a rule, in a single pass over the rule
+    """
     dependencies = {'signal': set(), 'rule_list': set()}
-    for item in get_dependency_items(rule):
-        try:
-            if item['operator'] == 'inList':
-                dependencies['rule_list'].add(item['value'])
-        except KeyError:
-            pass
-        try:
-            if item['type'] == 'addSignal':
-                dependencies['signal'].add(item['signal'])
-        except KeyError:
-            pass
+    for item in _walk(rule):
+        if not _has_corp_value(item):
+            continue
+        if item.get('operator') == 'inList' and 'value' in item:
+            dependencies['rule_list'].add(item['value'])
+        if item.get('type') == 'addSignal' and 'signal' in item:
+            dependencies['signal'].add(item['signal'])
     return dependencies
 
 def get_corp_items(api):
@@ -44,16 +69,38 @@ def get_alert_dependencies(alert):
     if alert['tagName'].startswith('corp.'):
         return alert['tagName']
 
+# Fields of an advanced rule holding rule code
+ADVANCED_RULE_BODIES = ['initRule', 'preEarlyRule', 'preRule', 'preLateRule',
+                        'postEarlyRule', 'postRule', 'postLateRule']
+
+# A quoted corp reference in rule code, e.g. "corp.signal" or
+# "matchers/corp.list". References preceded by # are ignored.
+_CORP_REFERENCE = re.compile(r'(?<!#)"(?:(matchers|lists)/+)?/*'
+                             r'(corp\.[^")\s]+)[")\s]')
+
+# Dependencies of the advanced rules already scanned, by rule id and code
+_ADVANCED_RULE_DEPENDENCIES = {}
+
 def get_advanced_rule_dependencies(advanced_rule):
-    dependencies = {'rule_list': set(), 'signal': set()}
-    matches = re.findall('[^\#]"(matchers|lists)*/*(corp\..+?)[")\s]',
-                   str(advanced_rule))
-    for match in matches:
-        if match[0] in ['matchers', 'lists']:
-            dependencies['rule_list'].add(match[1])
-        else:
-            dependencies['signal'].add(match[1])
-    return dependencies
+    """
+    Return the corp lists and signals referenced by the code of an advanced
+    rule. Results are memoized by rule id and code so rules shared by many
+    backups are only scanned once.
+    """
+    bodies = tuple(advanced_rule.get(x) or '' for x in ADVANCED_RULE_BODIES)
+    key = (advanced_rule.get('id'), bodies)
+    dependencies = _ADVANCED_RULE_DEPENDENCIES.get(key)
+    if dependencies is None:
+        dependencies = {'rule_list': set(), 'signal': set()}
+        for body in bodies:
+            for kind, name in _CORP_REFERENCE.findall(body):
+                if kind:
+                    dependencies['rule_list'].add(name)
+                else:
+                    dependencies['signal'].add(name)
+        _ADVANCED_RULE_DEPENDENCIES[key] = dependencies
+    # Copies so callers can't change the memoized sets
+    return {k: set(v) for k, v in dependencies.items()}
 
 def format_dependencies(dependencies):
     # Improve readability of dependency lists
@@ -64,8 +111,15 @@ def format_dependencies(dependencies):
                          f"{', '.join([str(x) for x in dependencies[item]])}")
     return f"({', '.join(items)})"
 
-def migrate(api, file_name, output_file, dest_corp, strip, keep_users):
-    site_backup = json.load(open(file_name))
+def migrate(api, file_name, output_file, dest_corp, strip, keep_users,
+            corp_items=None):
+    """
+    Migrate a backup file for use on dest_corp. corp_items is a function
+    returning the corp items (see get_corp_items) so that they can be
+    fetched once and shared when migrating many files. Returns the output
+    file, the corp dependencies found and the ones missing from the corp.
+    """
+    site_backup = load_backup(file_name)
     new_site = deepcopy(site_backup)
     new_site['source']['corp'] = dest_corp
     corp_dependencies = {'signal': set(), 'rule_list': set()}
@@ -140,9 +194,10 @@ def migrate(api, file_name, output_file, dest_corp, strip, keep_users):
                   f"dependencies: {dependencies}")
 
     # Add corp_items to new backup, if necessary    
+    missing = {'signal': set(), 'rule_list': set()}
     if any(corp_dependencies.values()):
         print("\nAdding corp items to backup...")
-        corp_items = get_corp_items(api)
+        items = corp_items() if corp_items else get_corp_items(api)
         new_site['corp_items'] = {x: [] for x in corp_dependencies 
             if corp_dependencies[x]}
         for dependency_type in corp_dependencies:
@@ -150,14 +205,121 @@ def migrate(api, file_name, output_file, dest_corp, strip, keep_users):
             for dependency in corp_dependencies[dependency_type]:
                 try:
                     new_site['corp_items'][dependency_type].append(
-                        corp_items[dependency_type][dependency])
+                        items[dependency_type][dependency])
                     print(f"  {dependency_type}/{dependency}")
                 except KeyError:
+                    missing[dependency_type].add(dependency)
                     print(f"  Existing broken dependency: {dependency_type}/"
                           f"{dependency}")
 
     if output_file is None:
         output_file = f"migrated_{file_name}"
     print(f"\nWriting {output_file}...")
-    with open(output_file, 'w') as f:
+    with open_file(output_file, 'w') as f:
         json.dump(new_site, f)
+    return {'output': output_file, 'dependencies': corp_dependencies,
+            'missing': missing}
+
+def is_backup_file(file_name):
+    """Whether a file name is that of a (possibly compressed) backup"""
+    compression = compression_for_name(file_name)
+    if compression:
+        file_name = file_name[:-len(CODECS[compression][0])]
+    return file_name.endswith('.json') and file_name != MANIFEST_FILE
+
+def find_backup_files(paths):
+    """
+    Expand the directories in paths to the backup files they contain,
+    skipping the manifest written by a multi-site backup
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(
+                os.path.join(path, x) for x in os.listdir(path)
+                if is_backup_file(x)))
+        else:
+            files.append(path)
+    return files
+
+def _shared_corp_items(api):
+    """Function fetching the corp items on first use and then reusing them"""
+    lock = threading.Lock()
+    fetched = {}
+
+    def corp_items():
+        with lock:
+            if 'items' not in fetched:
+                fetched['items'] = get_corp_items(api)
+        return fetched['items']
+    return corp_items
+
+def migrate_files(api, paths, out_dir, dest_corp, strip, keep_users,
+                  workers=1, report_file=None):
+    """
+    Migrate many backup files, up to `workers` at a time, into out_dir. The
+    corp items are downloaded at most once for all files. Prints, and
+    optionally saves, one report of the corp items the backups depend on.
+    """
+    files = find_backup_files(paths)
+    if not files:
+        print("No backup files found")
+        return None
+    print(f"Migrating {len(files)} backup file{'s' if len(files) > 1 else ''}"
+          f" to '{out_dir}'...")
+    os.makedirs(out_dir, exist_ok=True)
+    corp_items = _shared_corp_items(api)
+
+    def _migrate_file(file_name):
+        output_file = os.path.join(out_dir, os.path.basename(file_name))
+        return migrate(api, file_name, output_file, dest_corp, strip,
+                       keep_users, corp_items)
+
+    results = run_per_item(_migrate_file, files, workers)
+
+    report = {
+        'source_corp': api.corp,
+        'dest_corp': dest_corp,
+        'files': [],
+        'corp_items': {'signal': {}, 'rule_list': {}},
+        'missing': {'signal': {}, 'rule_list': {}}
+    }
+    for result in results:
+        entry = {'file': result.name}
+        if result.error:
+            entry['status'] = 'failed'
+            entry['error'] = str(result.error)
+        else:
+            entry['status'] = 'ok'
+            entry['output'] = result.result['output']
+            for key in ('dependencies', 'missing'):
+                section = 'corp_items' if key == 'dependencies' else key
+                for dependency_type, names in result.result[key].items():
+                    for name in names:
+                        report[section][dependency_type].setdefault(
+                            name, []).append(result.name)
+        report['files'].append(entry)
+
+    print_migrate_report(report)
+    if report_file:
+        with open(report_file, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"\nSaved report to '{report_file}'")
+    return report
+
+def print_migrate_report(report):
+    print('=' * 80)
+    failed = [x for x in report['files'] if x['status'] != 'ok']
+    print(f"Migrated {len(report['files']) - len(failed)} of "
+          f"{len(report['files'])} files")
+    for entry in failed:
+        print(f"  Failed: {entry['file']} ({entry['error']})")
+    for section, title in (('corp_items', 'Corp items used'),
+                           ('missing', 'Missing corp items')):
+        if not any(report[section].values()):
+            continue
+        print(f"\n{title}:")
+        for dependency_type in sorted(report[section]):
+            for name, files in sorted(report[section][dependency_type].items()):
+                print(f"  {dependency_type}/{name} ({len(files)} "
+                      f"file{'s' if len(files) > 1 else ''})")
@@ -0,0 +1,116 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import copy
+import io
+import sys
+import threading
+import time
+
+TaskResult = namedtuple('TaskResult', ['name', 'result', 'error', 'elapsed'])
+
+
+def run_concurrently(calls, workers=1):
+    """
+    Run a list of (func, args) calls and return their results in the same
+    order as the calls. With a single worker the calls are made one after
+    another on the current thread, otherwise they are spread across a thread
+    pool of at most `workers` threads. The first exception raised by a call
+    is re-raised.
+    """
+    if workers is None or workers <= 1 or len(calls) <= 1:
+        return [func(*args) for func, args in calls]
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(calls))) as pool:
+        futures = [pool.submit(func, *args) for func, args in calls]
+        return [future.result() for future in futures]
+
+
+def api_for_site(api, site_name):
+    """
+    Return a shallow copy of the API object pointed at another site. The copy
+    shares the credentials of the original but changing its site does not
+    affect any other worker.
+    """
+    site_api = copy.copy(api)
+    site_api.site = site_name
+    return site_api
+
+
+class _ThreadOutput(object):
+    """
+    Stand-in for sys.stdout that sends anything printed by a thread that has
+    a buffer assigned to that buffer instead of the real stream.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buf = getattr(self.local, 'buffer', None)
+        return (buf or self.stream).write(text)
+
+    def flush(self):
+        if getattr(self.local, 'buffer', None) is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def _run_task(func, name):
+    start = time.time()
+    try:
+        result, error = func(name), None
+    except Exception as e:  # pylint: disable=broad-except
+        result, error = None, e
+    return TaskResult(name, result, error, time.time() - start)
+
+
+def run_per_item(func, names, workers=1):
+    """
+    Call func(name) for every name using up to `workers` threads and return
+    a TaskResult for each name in the original order. An exception raised by
+    one call is recorded in its result rather than stopping the others.
+
+    When running in parallel the output printed by each call is held back
+    and printed as one block once that call finishes, so the output of
+    different items is never interleaved.
+    """
+    if workers is None or workers <= 1 or len(names) <= 1:
+        results = []
+        for name in names:
+            result = _run_task(func, name)
+            if result.error:
+                print('Failed: %s' % result.error)
+            results.append(result)
+        return results
+
+    output = _ThreadOutput(sys.stdout)
+    lock = threading.Lock()
+
+    def _buffered(name):
+        output.local.buffer = io.StringIO()
+        try:
+            result = _run_task(func, name)
+            if result.error:
+                print('Failed: %s' % result.error)
+            text = output.local.buffer.getvalue()
+        finally:
+            output.local.buffer = None
+        with lock:
+            output.stream.write(text)
+            output.stream.flush()
+        return result
+
+    sys.stdout = output
+    try:
+        with ThreadPoolExecutor(max_workers=min(workers, len(names))) as pool:
+            futures = {pool.submit(_buffered, name): i
+                       for i, name in enumerate(names)}
+            results = [None] * len(names)
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+    finally:
+        sys.stdout = output.stream
+    return results
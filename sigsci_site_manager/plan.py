@@ -0,0 +1,351 @@
+import datetime
+import hashlib
+import json
+
+from sigsci_site_manager.consts import (RULE_LISTS,
+                                        CUSTOM_SIGNALS,
+                                        REQUEST_RULES,
+                                        SITE_RULES,
+                                        SIGNAL_RULES,
+                                        TEMPLATED_RULES,
+                                        CUSTOM_ALERTS,
+                                        SITE_MEMBERS,
+                                        INTEGRATIONS,
+                                        ADVANCED_RULES)
+from sigsci_site_manager.merge import (_alert_action, _chunk_entries,
+                                       _configured_templated_rules,
+                                       _dest_items, _diff_entries, _index,
+                                       _integration_action, _list_action,
+                                       _member_action, _member_emails)
+from sigsci_site_manager.parallel import run_concurrently
+from sigsci_site_manager.util import (add_new_user, find_equal_rule,
+                                      index_rules)
+
+PLAN_VERSION = 1
+
+
+# The destination state is read and filtered the same way merges do it, so
+# that plans make the same decisions as merges.
+
+def get_dest_rule_lists(api):
+    return _dest_items(RULE_LISTS, api.get_rule_lists())
+
+
+def get_dest_custom_signals(api):
+    return _dest_items(CUSTOM_SIGNALS, api.get_custom_signals())
+
+
+def get_dest_request_rules(api):
+    return _dest_items(REQUEST_RULES, api.get_request_rules())
+
+
+def get_dest_site_rules(api):
+    return _dest_items(SITE_RULES, api.get_site_rules())
+
+
+def get_dest_signal_rules(api):
+    return _dest_items(SIGNAL_RULES, api.get_signal_rules())
+
+
+def get_dest_templated_rules(api):
+    return sorted(_configured_templated_rules(api.get_templated_rules()))
+
+
+def get_dest_custom_alerts(api):
+    return _dest_items(CUSTOM_ALERTS, api.get_custom_alerts())
+
+
+def get_dest_site_members(api):
+    # Corp users decide whether a member is added or invited to the corp
+    members, corp_users = _member_emails(api.get_site_members(),
+                                         api.get_corp_users())
+    return {
+        'members': sorted(members),
+        'corp_users': sorted(corp_users)
+    }
+
+
+def get_dest_integrations(api):
+    return _dest_items(INTEGRATIONS, api.get_integrations())
+
+
+def get_dest_advanced_rules(api):
+    return sorted(rule['shortName'] for rule in
+                  _dest_items(ADVANCED_RULES, api.get_advanced_rules()))
+
+
+# Destination state each category is planned against
+DEST_STATE = {
+    RULE_LISTS: get_dest_rule_lists,
+    CUSTOM_SIGNALS: get_dest_custom_signals,
+    REQUEST_RULES: get_dest_request_rules,
+    SITE_RULES: get_dest_site_rules,
+    SIGNAL_RULES: get_dest_signal_rules,
+    TEMPLATED_RULES: get_dest_templated_rules,
+    CUSTOM_ALERTS: get_dest_custom_alerts,
+    SITE_MEMBERS: get_dest_site_members,
+    INTEGRATIONS: get_dest_integrations,
+    ADVANCED_RULES: get_dest_advanced_rules
+}
+
+
+def state_fingerprint(state):
+    """Hash of the destination state of a category"""
+    return hashlib.sha256(
+        json.dumps(state, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _op(category, action, method, args, description):
+    return {
+        'category': category,
+        'action': action,
+        'method': method,
+        'args': args,
+        'description': description
+    }
+
+
+def plan_rule_lists(data, existing, mirror=False):
+    ops = []
+    by_name_type = _index(existing, ['name', 'type'])
+    by_name = _index(existing, ['name'])
+    for item in data:
+        action, target = _list_action(item, by_name_type, by_name)
+        if action == 'update':
+            additions, deletions = _diff_entries(item['entries'],
+                                                 target['entries'], mirror)
+            for chunk in _chunk_entries(additions, deletions):
+                entries = chunk['entries']
+                ops.append(_op(RULE_LISTS, 'update', 'update_rule_lists',
+                               [target['id'], chunk],
+                               '%s (+%d -%d entries)' %
+                               (item['name'], len(entries['additions']),
+                                len(entries['deletions']))))
+        elif action == 'create':
+            ops.append(_op(RULE_LISTS, 'create', 'add_rule_lists', [target],
+                           target['name']))
+    return ops
+
+
+def plan_custom_signals(data, existing):
+    tags = {signal['tagName'] for signal in existing}
+    return [_op(CUSTOM_SIGNALS, 'create', 'add_custom_signals', [item],
+                item['shortName'])
+            for item in data if item['tagName'] not in tags]
+
+
+def _plan_rules(category, method, data, existing, signal_rule=False):
+    index = index_rules(existing)
+    return [_op(category, 'create', method, [item], item['reason'])
+            for item in data
+            if find_equal_rule(index, item, signal_rule) is None]
+
+
+def plan_request_rules(data, existing):
+    return _plan_rules(REQUEST_RULES, 'add_request_rules', data, existing)
+
+
+def plan_site_rules(data, existing):
+    return _plan_rules(SITE_RULES, 'add_site_rules', data, existing)
+
+
+def plan_signal_rules(data, existing):
+    return _plan_rules(SIGNAL_RULES, 'add_signal_rules', data, existing,
+                       signal_rule=True)
+
+
+def plan_templated_rules(data, existing):
+    configured = set(existing)
+    return [_op(TEMPLATED_RULES, 'create', 'add_templated_rules',
+                [name, data[name]], name)
+            for name in data if name not in configured]
+
+
+def plan_custom_alerts(data, existing):
+    ops = []
+    alerts = _index(existing, ['tagName', 'longName'])
+    for item in data:
+        action, alert = _alert_action(item, alerts)
+        if action == 'create':
+            ops.append(_op(CUSTOM_ALERTS, 'create', 'add_custom_alert',
+                           [item], item['longName']))
+        elif action == 'update':
+            ops.append(_op(CUSTOM_ALERTS, 'update', 'update_custom_alert',
+                           [alert['id'], item], item['longName']))
+    return ops
+
+
+def plan_site_members(data, existing):
+    ops = []
+    members = set(existing['members'])
+    corp_users = set(existing['corp_users'])
+    for item in data:
+        email = item['user']['email']
+        action = _member_action(item, members, corp_users)
+        if action == 'invite':
+            ops.append(_op(SITE_MEMBERS, 'create', 'add_new_user',
+                           [email, item['role'], item['user']['apiUser']],
+                           '%s (New user - Corp role: %s, API user: %s)' %
+                           (email, item['role'], item['user']['apiUser'])))
+        elif action == 'add':
+            ops.append(_op(SITE_MEMBERS, 'create', 'add_members_to_site',
+                           [{'members': [email]}], email))
+    return ops
+
+
+def plan_integrations(data, existing):
+    ops = []
+    integs = _index(existing, ['url', 'type'])
+    for item in data:
+        action, integ = _integration_action(item, integs)
+        if action == 'create':
+            ops.append(_op(INTEGRATIONS, 'create', 'add_integration', [item],
+                           item['name']))
+        elif action == 'update':
+            ops.append(_op(INTEGRATIONS, 'update', 'update_integration',
+                           [integ['id'], item], item['name']))
+    return ops
+
+
+def plan_advanced_rules(data, existing, source):
+    names = set(existing)
+    return [_op(ADVANCED_RULES, 'create', 'copy_advanced_rule',
+                [item['shortName'], source['site']], item['shortName'])
+            for item in data if item['shortName'] not in names]
+
+
+def _planners(data, mirror_lists):
+    """Map each category of the source data to a function planning it"""
+    planners = [
+        (RULE_LISTS, lambda e: plan_rule_lists(data['rule_lists'], e,
+                                               mirror_lists)),
+        (CUSTOM_SIGNALS, lambda e: plan_custom_signals(
+            data['custom_signals'], e)),
+        (TEMPLATED_RULES, lambda e: plan_templated_rules(
+            data['templated_rules'], e)),
+        (CUSTOM_ALERTS, lambda e: plan_custom_alerts(
+            data['custom_alerts'], e)),
+        (SITE_MEMBERS, lambda e: plan_site_members(data['site_members'], e)),
+        (INTEGRATIONS, lambda e: plan_integrations(data['integrations'], e)),
+        (ADVANCED_RULES, lambda e: plan_advanced_rules(
+            data['advanced_rules'], e, data['source'])),
+    ]
+    # Same choice between site rules and the legacy format as merges
+    if 'site_rules' in data:
+        planners.append((SITE_RULES, lambda e: plan_site_rules(
+            data['site_rules'], e)))
+    else:
+        planners.append((REQUEST_RULES, lambda e: plan_request_rules(
+            data['request_rules'], e)))
+        planners.append((SIGNAL_RULES, lambda e: plan_signal_rules(
+            data['signal_rules'], e)))
+    return planners
+
+
+def plans(api, site_name, data, categories, mirror_lists=False, workers=1):
+    """
+    Work out the operations that merging data onto a site would make. The
+    destination state of every planned category is fetched up front, using
+    up to `workers` requests at once, and its fingerprint kept in the plan.
+    """
+    api.site = site_name
+    planners = [(k, planner) for k, planner in _planners(data, mirror_lists)
+                if categories and k in categories]
+    states = run_concurrently([(DEST_STATE[k], (api,)) for k, _ in planners],
+                              workers)
+
+    plan = {
+        'version': PLAN_VERSION,
+        'corp': api.corp,
+        'site': site_name,
+        'source': data['source'],
+        'created': datetime.datetime.utcnow().isoformat() + 'Z',
+        'fingerprints': {},
+        'operations': []
+    }
+    for (k, planner), state in zip(planners, states):
+        plan['fingerprints'][k] = state_fingerprint(state)
+        plan['operations'] += planner(state)
+    return plan
+
+
+def print_plan(plan):
+    ops = plan['operations']
+    for op in ops:
+        print('  %-6s %-15s %s' % (op['action'], op['category'],
+                                   op['description']))
+    print('Plan: %d to create, %d to update' %
+          (len([op for op in ops if op['action'] == 'create']),
+           len([op for op in ops if op['action'] == 'update'])))
+
+
+def plan(api, dst_site, data, file_name, categories=None, mirror_lists=False,
+         workers=1):
+    print("Planning changes to site '%s'..." % dst_site)
+    try:
+        api.get_corp_site(dst_site)
+    except Exception as e:  # pylint: disable=broad-except
+        if 'Site not found' in str(e):
+            print("Site '%s' does not exist" % dst_site)
+            return None
+        raise
+
+    result = plans(api, dst_site, data, categories, mirror_lists, workers)
+    print_plan(result)
+    with open(file_name, 'w') as f:
+        f.write(json.dumps(result, indent=2))
+    print("Saved plan to '%s'" % file_name)
+    return result
+
+
+def _apply_op(api, op):
+    if op['method'] == 'add_new_user':
+        add_new_user(api, *op['args'])
+    else:
+        getattr(api, op['method'])(*op['args'])
+
+
+def changed_categories(api, plan, workers=1):
+    """Categories of the plan whose destination state has changed"""
+    categories = sorted(plan['fingerprints'])
+    states = run_concurrently([(DEST_STATE[k], (api,)) for k in categories],
+                              workers)
+    return [k for k, state in zip(categories, states)
+            if state_fingerprint(state) != plan['fingerprints'][k]]
+
+
+def apply(api, file_name, workers=1, force=False):
+    with open(file_name, 'r') as f:
+        plan = json.loads(f.read())
+    if plan.get('version') != PLAN_VERSION:
+        print('Unsupported plan version: %s' % plan.get('version'))
+        return False
+    if plan['corp'] != api.corp:
+        print("Plan '%s' was made for corp '%s', not '%s'" %
+              (file_name, plan['corp'], api.corp))
+        return False
+
+    print("Applying plan '%s' to site '%s'..." % (file_name, plan['site']))
+    api.site = plan['site']
+
+    # Only the planned categories are read back, to check that the plan
+    # still applies. Nothing is diffed again.
+    changed = changed_categories(api, plan, workers)
+    if changed and not force:
+        print("Site '%s' has changed since the plan was made: %s" %
+              (plan['site'], ', '.join(changed)))
+        print('Make a new plan or use --force to apply it anyway')
+        return False
+
+    failed = 0
+    for op in plan['operations']:
+        print('  %-6s %-15s %s' % (op['action'], op['category'],
+                                   op['description']))
+        try:
+            _apply_op(api, op)
+        except Exception as e:  # pylint: disable=broad-except
+            print('    Failed: %s' % e)
+            failed += 1
+    print('Applied %d of %d operations' %
+          (len(plan['operations']) - failed, len(plan['operations'])))
+    return failed == 0
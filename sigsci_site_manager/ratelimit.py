@@ -0,0 +1,143 @@
+import random
+import threading
+import time
+
+# Retries of a throttled (429) request before giving up
+MAX_RETRIES = 6
+# Backoff delays in seconds, the delay doubles on every retry up to the max
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+# Requests finishing slower than this don't grow the concurrency limit
+LATENCY_TARGET = 2.0
+
+
+class RateGovernor(object):
+    """
+    Client side governor for API requests. It combines:
+
+    * a token bucket allowing `rate` requests per second on average with
+      bursts of up to `burst` requests (no limit when rate is None),
+    * an AIMD concurrency limit, grown by one request per round of fast
+      successful requests and halved when the API throttles a request, kept
+      between 1 and `max_concurrency`,
+    * retries of throttled requests after the Retry-After time sent by the
+      API or an exponential backoff with jitter.
+
+    A single governor is shared by every thread using the API.
+    """
+
+    def __init__(self, rate=None, burst=None, max_concurrency=10,
+                 max_retries=MAX_RETRIES, base_delay=BASE_DELAY,
+                 max_delay=MAX_DELAY, latency_target=LATENCY_TARGET,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate or 1.0)
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.latency_target = latency_target
+        self.clock = clock
+        self.sleep = sleep
+
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self.tokens = self.burst
+        self.updated = clock()
+        self.last_decrease = None
+        self.cond = threading.Condition()
+
+        self.requests = 0
+        self.throttled = 0
+        self.failures = 0
+
+    def _take_token(self):
+        """Take a token from the bucket, returning how long to wait if empty"""
+        if self.rate is None:
+            return 0
+        now = self.clock()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        with self.cond:
+            while True:
+                if self.in_flight < int(self.limit):
+                    wait = self._take_token()
+                    if not wait:
+                        self.in_flight += 1
+                        self.requests += 1
+                        return
+                    # Release the lock while waiting for the bucket to refill
+                    self.cond.wait(wait)
+                else:
+                    self.cond.wait()
+
+    def release(self, latency, throttled=False):
+        with self.cond:
+            self.in_flight -= 1
+            if throttled:
+                self.throttled += 1
+                # Only halve once per round of requests that were in flight
+                # when the API started throttling
+                now = self.clock()
+                if (self.last_decrease is None or
+                        now - self.last_decrease > latency):
+                    self.limit = max(1.0, self.limit / 2)
+                    self.last_decrease = now
+            elif latency < self.latency_target:
+                self.limit = min(float(self.max_concurrency),
+                                 self.limit + 1 / self.limit)
+            self.cond.notify_all()
+
+    def backoff(self, attempt, retry_after=None):
+        """Seconds to wait before retrying a request throttled `attempt` times"""
+        if retry_after is not None:
+            try:
+                return min(self.max_delay, max(0.0, float(retry_after)))
+            except ValueError:
+                # Retry-After may also be an HTTP date, fall back to backoff
+                pass
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        # Jitter so throttled workers don't all retry at the same time
+        return random.uniform(delay / 2, delay)
+
+    def call(self, send):
+        """
+        Send a request with `send()` under the governor, retrying it while
+        the API answers 429. Returns the final response.
+        """
+        attempt = 0
+        while True:
+            self.acquire()
+            start = self.clock()
+            throttled = False
+            try:
+                response = send()
+                throttled = response.status_code == 429
+            finally:
+                self.release(self.clock() - start, throttled)
+
+            if not throttled:
+                return response
+            if attempt >= self.max_retries:
+                with self.cond:
+                    self.failures += 1
+                return response
+            self.sleep(self.backoff(attempt,
+                                    response.headers.get('Retry-After')))
+            attempt += 1
+
+    def stats(self):
+        with self.cond:
+            return {
+                'requests': self.requests,
+                'throttled': self.throttled,
+                'failures': self.failures,
+                'concurrency': int(self.limit)
+            }
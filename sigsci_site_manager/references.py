@@ -0,0 +1,168 @@
+import datetime
+import fnmatch
+import json
+import os
+
+from sigsci_site_manager.archive import category_fingerprint
+from sigsci_site_manager.backup import iter_backup
+from sigsci_site_manager.migrate import (get_advanced_rule_dependencies,
+                                         get_alert_dependencies,
+                                         get_rule_dependencies)
+from sigsci_site_manager.parallel import api_for_site, run_per_item
+
+# Only these categories of a site can reference corp items
+REFERENCE_CATEGORIES = ['site_rules', 'custom_alerts', 'advanced_rules']
+
+
+def site_references(data):
+    """
+    Return the corp items referenced by a site backup, one entry per
+    referencing rule, alert or advanced rule
+    """
+    references = []
+
+    def _add(dependencies, category, name):
+        for kind in sorted(dependencies):
+            for item in sorted(dependencies[kind]):
+                references.append({'item': item, 'type': kind,
+                                   'category': category, 'name': name})
+
+    for i, rule in enumerate(data.get('site_rules') or []):
+        _add(get_rule_dependencies(rule), 'site_rules',
+             rule.get('reason') or 'rule %d' % i)
+    for alert in data.get('custom_alerts') or []:
+        dependency = get_alert_dependencies(alert)
+        if dependency:
+            _add({'signal': [dependency]}, 'custom_alerts',
+                 alert.get('longName') or alert['tagName'])
+    for rule in data.get('advanced_rules') or []:
+        _add(get_advanced_rule_dependencies(rule), 'advanced_rules',
+             rule.get('shortName') or rule.get('id'))
+    return references
+
+
+def load_index(file_name):
+    if not os.path.exists(file_name):
+        return {'corp': None, 'updated': None, 'sites': {}}
+    with open(file_name, 'r') as f:
+        return json.loads(f.read())
+
+
+def save_index(file_name, index):
+    tmp_name = '%s.%d.tmp' % (file_name, os.getpid())
+    with open(tmp_name, 'w') as f:
+        f.write(json.dumps(index, indent=2, sort_keys=True))
+    os.replace(tmp_name, file_name)
+
+
+def update_index(api, file_name, site_names, workers=1, prune=False):
+    """
+    Refresh the entries of the given sites in a corp item reference index,
+    fetching up to `workers` sites at a time. Other sites keep their
+    entries, unless prune is set, when sites not in site_names are dropped
+    as they no longer exist. A site that fails to fetch keeps its previous
+    entry.
+    """
+    index = load_index(file_name)
+    if index['corp'] not in (None, api.corp):
+        raise Exception("Index '%s' is for corp '%s'" %
+                        (file_name, index['corp']))
+    print("Indexing corp item references of %d site%s in '%s'..." %
+          (len(site_names), 's' if len(site_names) != 1 else '', file_name))
+
+    def _fetch(site_name):
+        # Only the categories that can reference corp items are fetched
+        return dict(iter_backup(api_for_site(api, site_name), site_name,
+                                keys=REFERENCE_CATEGORIES))
+
+    results = run_per_item(_fetch, site_names, workers)
+    now = datetime.datetime.utcnow().isoformat() + 'Z'
+    changed = 0
+    for result in results:
+        if result.error:
+            continue
+        data = {k: result.result[k] for k in REFERENCE_CATEGORIES}
+        fingerprint = category_fingerprint(data)
+        entry = index['sites'].get(result.name)
+        if entry and entry['fingerprint'] == fingerprint:
+            entry['updated'] = now
+            continue
+        changed += 1
+        index['sites'][result.name] = {
+            'updated': now,
+            'fingerprint': fingerprint,
+            'references': site_references(data)
+        }
+    if prune:
+        for site_name in set(index['sites']) - set(site_names):
+            del index['sites'][site_name]
+
+    index['corp'] = api.corp
+    index['updated'] = now
+    save_index(file_name, index)
+
+    failed = [r.name for r in results if r.error]
+    print('Indexed %d of %d sites, %d changed, %d corp items referenced' %
+          (len(results) - len(failed), len(results), changed,
+           len(reverse_index(index))))
+    for site_name in failed:
+        print('  Failed: %s' % site_name)
+    return index
+
+
+def reverse_index(index):
+    """
+    Map each referenced corp item, as a (type, item) pair, to the references
+    to it
+    """
+    items = {}
+    for site_name, entry in index['sites'].items():
+        for reference in entry['references']:
+            items.setdefault((reference['type'], reference['item']),
+                             []).append(dict(reference, site=site_name))
+    return items
+
+
+def find_references(index, pattern):
+    """
+    References to the corp items matching a name or wildcard pattern, with
+    or without the corp. prefix, by (type, item)
+    """
+    if not pattern.startswith('corp.'):
+        pattern = 'corp.' + pattern
+    return {key: sorted(references,
+                        key=lambda x: (x['site'], x['category'], x['name']))
+            for key, references in reverse_index(index).items()
+            if fnmatch.fnmatchcase(key[1], pattern)}
+
+
+def _plural(count, word):
+    return '%d %s%s' % (count, word, 's' if count != 1 else '')
+
+
+def print_references(index, pattern=None):
+    if pattern is None:
+        # Summary of every referenced item, most used first
+        items = reverse_index(index)
+        print('%-50s %-10s %s' % ('Item', 'Sites', 'References'))
+        for (kind, item), references in sorted(
+                items.items(), key=lambda x: (-len(x[1]), x[0])):
+            print('  %-48s %-10d %d' % ('%s/%s' % (kind, item),
+                                        len({x['site'] for x in references}),
+                                        len(references)))
+        print('(%s referenced across %s, indexed %s)' %
+              (_plural(len(items), 'corp item'),
+               _plural(len(index['sites']), 'site'), index['updated']))
+        return
+
+    found = find_references(index, pattern)
+    if not found:
+        print("No references to '%s'" % pattern)
+    for (kind, item), references in sorted(found.items()):
+        print('%s/%s: %s in %s' % (
+            kind, item, _plural(len(references), 'reference'),
+            _plural(len({x['site'] for x in references}), 'site')))
+        for reference in references:
+            print('  %-35s %-15s %s' % (reference['site'],
+                                        reference['category'],
+                                        reference['name']))
@@ -2,16 +2,30 @@ import argparse
 import fnmatch
 from getpass import getpass
 import os
+import time
 
-from sigsci_site_manager.api import init_api
-from sigsci_site_manager.backup import backup
+from sigsci_site_manager.api import api_options, init_api, print_stats
+from sigsci_site_manager.backup import (archive_sites, backup, backup_sites,
+                                        backup_to_archive, store_sites)
+from sigsci_site_manager.cache import DEFAULT_CACHE_TTL
 from sigsci_site_manager.clone import clone
+from sigsci_site_manager.compression import CODECS
 from sigsci_site_manager.consts import CATEGORIES
 from sigsci_site_manager.deploy import deploy
-from sigsci_site_manager.merge import merge
+from sigsci_site_manager.diff import LIVE_SITE_PREFIX, diff, is_live_site
+from sigsci_site_manager.journal import Journal
+from sigsci_site_manager.merge import load_source, merge
 from sigsci_site_manager.util import build_category_list
 from sigsci_site_manager.validate import validate
-from sigsci_site_manager.migrate import migrate
+from sigsci_site_manager.migrate import migrate, migrate_files
+from sigsci_site_manager.parallel import api_for_site, run_per_item
+from sigsci_site_manager.plan import apply, plan
+from sigsci_site_manager.references import (load_index, print_references,
+                                            update_index)
+from sigsci_site_manager.store import (lists_containing, list_snapshots,
+                                       open_store, rules_matching,
+                                       sites_using_list)
+from sigsci_site_manager.token_cache import DEFAULT_TOKEN_CACHE
 from sigsci_site_manager.user import do_add_user, do_remove_user, do_list_membership, do_list_users
 from sigsci_site_manager.__version__ import __version__
 
@@ -20,7 +34,8 @@ def do_list(args):
     print('Listing sites for "%s"%s:' %
           (args.corp, ' matching "%s"' %
            args.filter if args.filter != '*' else ''))
-    api = init_api(args.username, args.password, args.token, args.corp)
+    api = init_api(args.username, args.password, args.token, args.corp,
+                   **api_options(args))
     resp = api.get_corp_sites()
     sites = []
     for site in resp['data']:
@@ -43,37 +58,162 @@ def underline(text):
     return chars
 
 
+def open_journal(args):
+    """Open the journal given on the command line, if any"""
+    if not args.journal:
+        return None
+    if args.dry_run:
+        # Nothing is written on a dry run so there is nothing to record
+        print('Dry run, not using journal %s' % args.journal)
+        return None
+    if args.resume:
+        print('Resuming from journal %s' % args.journal)
+    return Journal(args.journal, args.resume)
+
+
 def do_deploy(args):
     api = init_api(args.username, args.password, args.token, args.corp,
-                   args.dry_run)
-    deploy(api, args.site_name, args.file_name, args.display_name,
-           build_category_list(args.include, args.exclude))
+                   args.dry_run, args.workers, **api_options(args))
+    journal = open_journal(args)
+    try:
+        deploy(api, args.site_name, args.file_name, args.display_name,
+               build_category_list(args.include, args.exclude), args.workers,
+               journal)
+    finally:
+        if journal:
+            journal.close()
 
 
 def do_clone(args):
     api = init_api(args.username, args.password, args.token, args.corp,
-                   args.dry_run)
-    clone(api, args.src_site, args.dst_site, args.display_name,
-          build_category_list(args.include, args.exclude))
+                   args.dry_run, args.workers, **api_options(args))
+    journal = open_journal(args)
+    try:
+        clone(api, args.src_site, args.dst_site, args.display_name,
+              build_category_list(args.include, args.exclude), args.workers,
+              journal)
+    finally:
+        if journal:
+            journal.close()
+
+
+def get_matching_sites(api, pattern):
+    # Get the current sites and filter them using the wildcard pattern
+    resp = api.get_corp_sites()
+    sites = []
+    for site in resp['data']:
+        if fnmatch.fnmatch(site['name'], pattern):
+            sites.append(site['name'])
+    return sites
+
+
+def is_site_pattern(name):
+    return any(c in name for c in '*?[')
 
 
 def do_backup(args):
-    api = init_api(args.username, args.password, args.token, args.corp)
-    backup(api, args.site_name, args.file_name)
+    api = init_api(args.username, args.password, args.token, args.corp,
+                   pool_size=args.workers, **api_options(args))
+    if not args.all and not is_site_pattern(args.site_name):
+        if args.store:
+            store_sites(api, [args.site_name], args.file_name)
+        elif args.archive:
+            backup_to_archive(api, args.site_name, args.file_name,
+                              args.workers, args.incremental,
+                              args.skip_unchanged)
+        else:
+            backup(api, args.site_name, args.file_name, args.workers,
+                   args.compression)
+        return
+
+    pattern = '*' if args.all else args.site_name
+    sites = sorted(get_matching_sites(api, pattern))
+    if not sites:
+        print("No sites match '%s'" % pattern)
+        return
+    if args.store:
+        store_sites(api, sites, args.file_name, args.workers)
+    elif args.archive:
+        archive_sites(api, sites, args.file_name, args.workers,
+                      args.incremental, args.skip_unchanged)
+    else:
+        backup_sites(api, sites, args.file_name, args.workers,
+                     args.compression)
+
+
+def do_query(args):
+    if not os.path.isfile(args.db_file):
+        print("error: no snapshot store '%s'" % args.db_file)
+        return
+    conn = open_store(args.db_file)
+    start = time.time()
+    try:
+        if args.list_name:
+            headers = ['SiteName', 'Rule', 'Operator', 'List']
+            rows = sites_using_list(conn, args.list_name, args.as_of)
+        elif args.condition:
+            headers = ['SiteName', 'Rule', 'Type', 'Reason']
+            rows = rules_matching(conn, args.condition[0], args.condition[1],
+                                  args.action, args.as_of)
+        elif args.entry:
+            headers = ['SiteName', 'List']
+            rows = lists_containing(conn, args.entry, args.as_of)
+        elif args.sql:
+            cursor = conn.execute(args.sql)
+            headers = [x[0] for x in cursor.description or []]
+            rows = cursor.fetchall()
+        else:
+            headers = ['Snapshot', 'SiteName', 'Created']
+            rows = list_snapshots(conn, args.as_of)
+    finally:
+        conn.close()
+    elapsed = time.time() - start
 
+    print('  '.join(underline(x) for x in headers))
+    for row in rows:
+        print('  %s' % '  '.join(str(x) for x in row))
+    print('(%d rows in %.1f ms)' % (len(rows), elapsed * 1000))
 
-def do_merge(args):
+
+def do_refs_update(args):
     api = init_api(args.username, args.password, args.token, args.corp,
-                   args.dry_run)
+                   pool_size=args.workers, **api_options(args))
+    pattern = args.site_name or '*'
+    sites = sorted(get_matching_sites(api, pattern))
+    if not sites:
+        print("No sites match '%s'" % pattern)
+        return
+    # Sites are only dropped from the index when all of them were listed
+    update_index(api, args.index_file, sites, args.workers,
+                 prune=pattern == '*')
 
-    # Get the current sites
-    resp = api.get_corp_sites()
 
-    # Filter the sites based on the provided destination pattern
-    sites = []
-    for site in resp['data']:
-        if fnmatch.fnmatch(site['name'], args.dst_site):
-            sites.append(site['name'])
+def do_refs_show(args):
+    if not os.path.isfile(args.index_file):
+        print("error: no reference index '%s', create it with refs update" %
+              args.index_file)
+        return
+    print_references(load_index(args.index_file), args.item)
+
+
+def diff_needs_api(args):
+    return is_live_site(args.old_spec) or is_live_site(args.new_spec)
+
+
+def do_diff(args):
+    api = None
+    if diff_needs_api(args):
+        api = init_api(args.username, args.password, args.token, args.corp,
+                       pool_size=args.workers, **api_options(args))
+    diff(api, args.old_spec, args.new_spec, args.as_json, args.workers)
+
+
+def do_merge(args):
+    api = init_api(args.username, args.password, args.token, args.corp,
+                   args.dry_run, args.workers, **api_options(args))
+
+    # Filter the current sites based on the provided destination pattern
+    sites = get_matching_sites(api, args.dst_site)
 
     # If the user provided an exact match name we don't want to change the
     # existing behavior of the merge command
@@ -101,20 +241,79 @@ def do_merge(args):
 
     # If confirmed, merge with identified sites
     if exact_match or args.yes or cont.lower() in ['y', 'yes']:
-        for site in sites:
-            merge(api, site, args.src_site, args.file_name,
-                  build_category_list(args.include, args.exclude))
+        journal = open_journal(args)
+        try:
+            merge_sites(api, args, sites, exact_match, journal)
+        finally:
+            if journal:
+                journal.close()
+
+
+def merge_sites(api, args, sites, exact_match, journal):
+    # Snapshot the source once and share it with every destination site
+    data = load_source(api, args.src_site, args.file_name, args.workers)
+    categories = build_category_list(args.include, args.exclude)
+    if exact_match:
+        merge(api, sites[0], args.src_site, args.file_name, categories,
+              args.workers, data, args.mirror_lists, journal)
+        return
+
+    def _merge_site(site):
+        # Each site gets its own copy of the API so workers don't change
+        # the site out from under each other. The journal records each
+        # write against its site so a single journal is shared.
+        return merge(api_for_site(api, site), site, args.src_site,
+                     args.file_name, categories, data=data,
+                     mirror_lists=args.mirror_lists, journal=journal)
+
+    results = run_per_item(_merge_site, sites, args.workers)
+    print_merge_summary(results)
+
+
+def do_plan(args):
+    api = init_api(args.username, args.password, args.token, args.corp,
+                   pool_size=args.workers, **api_options(args))
+    data = load_source(api, args.src_site, args.file_name, args.workers)
+    plan(api, args.dst_site, data, args.plan_file,
+         build_category_list(args.include, args.exclude), args.mirror_lists,
+         args.workers)
+
+
+def do_apply(args):
+    api = init_api(args.username, args.password, args.token, args.corp,
+                   args.dry_run, args.workers, **api_options(args))
+    apply(api, args.plan_file, args.workers, args.force)
+
+
+def print_merge_summary(results):
+    print('=' * 80)
+    print('%-45s %-18s %s' % (underline('SiteName'), underline('Result'),
+                              underline('Seconds')))
+    for result in results:
+        if result.error:
+            status = 'failed'
+        elif result.result is False:
+            status = 'not found'
+        else:
+            status = 'merged'
+        print('  %-35s %-10s %7.1f' % (result.name, status, result.elapsed))
 
 
 def do_validate(args):
     api = init_api(args.username, args.password, args.token, args.corp,
-                   args.dry_run)
+                   args.dry_run, **api_options(args))
     validate(api, args.site_name, args.target, args.dry_run)
 
 def do_migrate(args):
-    api = init_api(args.username, args.password, args.token, args.corp)
-    migrate(api, args.file_name, args.output_file, args.dest_corp, args.strip,
-            args.keep_users)
+    api = init_api(args.username, args.password, args.token, args.corp,
+                   pool_size=args.workers, **api_options(args))
+    if len(args.file_name) == 1 and not os.path.isdir(args.file_name[0]):
+        migrate(api, args.file_name[0], args.output_file, args.dest_corp,
+                args.strip, args.keep_users)
+        return
+    migrate_files(api, args.file_name, args.output_file or 'migrated',
+                  args.dest_corp, args.strip, args.keep_users, args.workers,
+                  args.report_file)
 
 def setup_list_command_args(subparsers):
     # List command arguments
@@ -134,12 +333,20 @@ def setup_migrate_command_args(subparsers):
                                 required=True, dest='dest_corp',
                                 help='Destination corp to migrate to')
     migrate_parser.add_argument('--file', '-f', metavar='FILENAME',
-                                required=True, dest='file_name',
-                                help='Filename of to migrate')
+                                required=True, dest='file_name', nargs='+',
+                                help='Backup files or directories of backup '
+                                'files to migrate')
     migrate_parser.add_argument('--out', '-o', metavar='OUTPUTFILE',
                                 required=False, dest='output_file',
                                 help='File to save migrated backup to, defaults'
-                                ' to "migrated_<backup filename>"')
+                                ' to "migrated_<backup filename>". When '
+                                'migrating multiple files this is a directory,'
+                                ' defaults to "migrated"')
+    migrate_parser.add_argument('--report', '-r', metavar='FILENAME',
+                                required=False, dest='report_file',
+                                help='Save a JSON report of the corp items '
+                                'the migrated backups depend on')
+    add_workers_arg(migrate_parser, 'Number of files to migrate concurrently')
     migrate_parser.add_argument('--strip', '-s', action='store_true',
                                 required=False, dest='strip',
                                 help='Strip all items with corp dependencies '
@@ -173,16 +380,161 @@ def args_validate_category_list(value: str):
     return value_list
 
 
+def args_positive_int(value: str):
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            '%s is not a positive integer' % value)
+    return number
+
+
+def add_workers_arg(parser, help_text):
+    parser.add_argument('--workers', '-w', metavar='N', required=False,
+                        type=args_positive_int, default=1, dest='workers',
+                        help='%s (default: 1)' % help_text)
+
+
+def add_journal_args(parser):
+    parser.add_argument('--journal', '-j', metavar='FILENAME',
+                        required=False, dest='journal',
+                        help='Record each completed write in this file so an '
+                        'interrupted run can be resumed')
+    parser.add_argument('--resume', required=False, action='store_true',
+                        dest='resume',
+                        help='Skip the writes already recorded in the '
+                        'journal (requires --journal)')
+
+
 def setup_backup_command_args(subparsers):
     # Backup command arguments
     backup_parser = subparsers.add_parser('backup',
                                           help='Backup a site to a file')
     backup_parser.set_defaults(func=do_backup)
-    backup_parser.add_argument('--name', '-n', metavar='NAME', required=True,
-                               dest='site_name', help='Site name')
+    backup_site_group = backup_parser.add_mutually_exclusive_group(
+        required=True)
+    backup_site_group.add_argument(
+        '--name', '-n', metavar='NAME', dest='site_name',
+        help='Site name (accepts wildcard pattern)')
+    backup_site_group.add_argument('--all', '-a', action='store_true',
+                                   help='Backup all sites in the corp')
     backup_parser.add_argument('--out', '-o', metavar='FILENAME',
                                required=True, dest='file_name',
-                               help='File to save backup to')
+                               help='File to save backup to. When backing '
+                               'up multiple sites this is a directory that '
+                               'gets one file per site and a manifest')
+    add_workers_arg(backup_parser,
+                    'Number of categories to fetch concurrently, or of '
+                    'sites to backup concurrently when backing up multiple '
+                    'sites')
+    backup_parser.add_argument('--archive', required=False,
+                               action='store_true', dest='archive',
+                               help='Save to a backup archive directory where '
+                               'items shared by sites and snapshots are '
+                               'stored once. Read a site back with --file '
+                               'DIR#SITE[@SNAPSHOT]')
+    backup_parser.add_argument('--store', required=False,
+                               action='store_true', dest='store',
+                               help='Save to a SQLite snapshot store that '
+                               'can be queried with the query command. Read '
+                               'a site back with --file DB#SITE[@SNAPSHOT]')
+    backup_parser.add_argument('--incremental', required=False,
+                               action='store_true', dest='incremental',
+                               help='Only store the categories that changed '
+                               'since the latest snapshot of the site in the '
+                               'archive. Requires --archive')
+    backup_parser.add_argument('--skip-unchanged', required=False,
+                               action='store_true', dest='skip_unchanged',
+                               help='Check the small categories first and '
+                               "don't fetch the others when none of them "
+                               'changed. Requires --incremental')
+    backup_parser.add_argument('--compress', '-z', required=False,
+                               choices=sorted(CODECS), dest='compression',
+                               help='Compress the backup. Also chosen by a '
+                               '.gz, .xz or .zst file extension. Compressed '
+                               'backups are detected when read')
+
+
+def setup_query_command_args(subparsers):
+    # Query command arguments
+    query_parser = subparsers.add_parser(
+        'query', help='Query a snapshot store saved by backup --store')
+    query_parser.set_defaults(func=do_query, needs_api=False)
+    query_parser.add_argument('--db', '-d', metavar='FILENAME', required=True,
+                              dest='db_file', help='Snapshot store to query')
+    query_parser.add_argument('--as-of', metavar='SNAPSHOT', type=int,
+                              dest='as_of',
+                              help='Query the latest snapshot of each site '
+                              'up to this snapshot id instead of the latest '
+                              'one')
+    query_group = query_parser.add_mutually_exclusive_group()
+    query_group.add_argument('--list', metavar='LIST', dest='list_name',
+                             help='Rules using a list, by name or by the '
+                             'value rules refer to it with (e.g. corp.ips)')
+    query_group.add_argument('--condition', metavar=('FIELD', 'VALUE'),
+                             nargs=2, dest='condition',
+                             help='Rules with a condition on FIELD equal '
+                             'to VALUE')
+    query_group.add_argument('--entry', metavar='VALUE', dest='entry',
+                             help='Lists containing an entry')
+    query_group.add_argument('--sql', metavar='QUERY', dest='sql',
+                             help='Run an SQL query against the store')
+    query_parser.add_argument('--action', metavar='TYPE', dest='action',
+                              help='With --condition, only rules taking '
+                              'this action (e.g. block)')
+
+
+def setup_refs_command_args(subparsers):
+    # Refs command arguments
+    refs_parser = subparsers.add_parser(
+        'refs', help='Find the rules and alerts using corp lists and signals')
+    refs_parser.set_defaults(func=do_refs_show, needs_api=False, item=None)
+    refs_parser.add_argument('--index', '-i', metavar='FILENAME',
+                             required=True, dest='index_file',
+                             help='Reference index file')
+
+    refs_sub_parser = refs_parser.add_subparsers(title='Refs Command',
+                                                 dest='refs_command')
+    # update subcommand
+    refs_update_parser = refs_sub_parser.add_parser(
+        'update', help='Create or update the index from the corp sites')
+    refs_update_parser.set_defaults(func=do_refs_update, needs_api=True)
+    refs_update_parser.add_argument(
+        '--name', '-n', metavar='NAME', dest='site_name',
+        help='Only update these sites (accepts wildcard pattern). By default '
+        'all sites are updated and deleted sites removed')
+    add_workers_arg(refs_update_parser, 'Number of sites to fetch '
+                    'concurrently')
+
+    # show subcommand
+    refs_show_parser = refs_sub_parser.add_parser(
+        'show', help='Show the references to corp items')
+    refs_show_parser.set_defaults(func=do_refs_show, needs_api=False)
+    refs_show_parser.add_argument(
+        'item', metavar='ITEM', nargs='?',
+        help='Corp list or signal, with or without the corp. prefix (accepts '
+        'wildcard pattern). Without one, a summary of all items is shown')
+
+
+def setup_diff_command_args(subparsers):
+    # Diff command arguments
+    diff_parser = subparsers.add_parser(
+        'diff', help='Compare two site snapshots')
+    diff_parser.set_defaults(func=do_diff, needs_api=diff_needs_api)
+    snapshot_help = ('a site file, DIR#SITE[@SNAPSHOT] in a backup archive '
+                     'or snapshot store, or %sNAME for a live site' %
+                     LIVE_SITE_PREFIX)
+    diff_parser.add_argument('old_spec', metavar='OLD',
+                             help='Snapshot to compare from: ' +
+                             snapshot_help)
+    diff_parser.add_argument('new_spec', metavar='NEW',
+                             help='Snapshot to compare to: ' + snapshot_help)
+    diff_parser.add_argument('--json', action='store_true', dest='as_json',
+                             help='Print the differences as JSON')
+    add_workers_arg(diff_parser, 'Number of categories of a live site to '
+                    'fetch concurrently')
 
 
 def setup_clone_command_args(subparsers):
@@ -200,6 +552,10 @@ def setup_clone_command_args(subparsers):
     clone_parser.add_argument('--dry-run', required=False,
                               action='store_true', dest='dry_run',
                               help='Print actions without making any changes')
+    add_workers_arg(clone_parser,
+                    'Number of source categories to fetch, and of items to '
+                    'create, concurrently')
+    add_journal_args(clone_parser)
     clone_cat_group = clone_parser.add_mutually_exclusive_group()
     clone_cat_group.add_argument(
         '--include', required=False, metavar='CATEGORY_LIST',
@@ -226,10 +582,14 @@ def setup_deploy_command_args(subparsers):
                                help='Display name of the site')
     deploy_parser.add_argument('--file', '-f', metavar='FILENAME',
                                required=True, dest='file_name',
-                               help='Name of site file')
+                               help='Name of site file, or DIR#SITE[@SNAPSHOT]'
+                               ' to read a site from a backup archive or '
+                               'snapshot store')
     deploy_parser.add_argument('--dry-run', required=False,
                                action='store_true', dest='dry_run',
                                help='Print actions without making any changes')
+    add_workers_arg(deploy_parser, 'Number of items to create concurrently')
+    add_journal_args(deploy_parser)
     deploy_cat_group = deploy_parser.add_mutually_exclusive_group()
     deploy_cat_group.add_argument(
         '--include', required=False, metavar='CATEGORY_LIST',
@@ -256,10 +616,21 @@ def setup_merge_command_args(subparsers):
                                  dest='src_site', help='Site to merge from')
     merge_src_group.add_argument('--file', '-f', metavar='FILENAME',
                                  dest='file_name',
-                                 help='Name of site file to merge from')
+                                 help='Name of site file to merge from, or '
+                                 'DIR#SITE[@SNAPSHOT] in a backup archive or '
+                                 'snapshot store')
     merge_parser.add_argument('--dry-run', required=False,
                               action='store_true', dest='dry_run',
                               help='Print actions without making any changes')
+    merge_parser.add_argument('--mirror-lists', required=False,
+                              action='store_true', dest='mirror_lists',
+                              help='Remove entries from existing lists that '
+                              'are not in the source list')
+    add_workers_arg(merge_parser,
+                    'Number of source and destination categories to fetch '
+                    'concurrently, or of sites to merge onto concurrently '
+                    'when the destination matches multiple sites')
+    add_journal_args(merge_parser)
     merge_cat_group = merge_parser.add_mutually_exclusive_group()
     merge_cat_group.add_argument(
         '--include', required=False, metavar='CATEGORY_LIST',
@@ -275,6 +646,64 @@ def setup_merge_command_args(subparsers):
                               help='Automatic yes to prompts')
 
 
+def setup_plan_command_args(subparsers):
+    # Plan command arguments
+    plan_parser = subparsers.add_parser(
+        'plan', help='Save the changes a merge would make to a plan file')
+    plan_parser.set_defaults(func=do_plan)
+    plan_parser.add_argument('--dest', '-d', metavar='SITE', dest='dst_site',
+                             required=True, help='Site to merge onto')
+    plan_src_group = plan_parser.add_mutually_exclusive_group(required=True)
+    plan_src_group.add_argument('--src', '-s', metavar='SITE',
+                                dest='src_site', help='Site to merge from')
+    plan_src_group.add_argument('--file', '-f', metavar='FILENAME',
+                                dest='file_name',
+                                help='Name of site file to merge from, or '
+                                'DIR#SITE[@SNAPSHOT] in a backup archive or '
+                                'snapshot store')
+    plan_parser.add_argument('--out', '-o', metavar='FILENAME',
+                             required=True, dest='plan_file',
+                             help='File to save the plan to')
+    plan_parser.add_argument('--mirror-lists', required=False,
+                             action='store_true', dest='mirror_lists',
+                             help='Remove entries from existing lists that '
+                             'are not in the source list')
+    add_workers_arg(plan_parser,
+                    'Number of source and destination categories to fetch '
+                    'concurrently')
+    plan_cat_group = plan_parser.add_mutually_exclusive_group()
+    plan_cat_group.add_argument(
+        '--include', required=False, metavar='CATEGORY_LIST',
+        type=args_validate_category_list, help=(
+            'CSV list of categories to include in the plan. Options: %s' %
+            ', '.join(CATEGORIES)))
+    plan_cat_group.add_argument(
+        '--exclude', required=False, metavar='CATEGORY_LIST',
+        type=args_validate_category_list, help=(
+            'CSV list of categories to exclude from the plan. Options: %s' %
+            ', '.join(CATEGORIES)))
+
+
+def setup_apply_command_args(subparsers):
+    # Apply command arguments
+    apply_parser = subparsers.add_parser(
+        'apply', help='Apply a plan file made by the plan command')
+    apply_parser.set_defaults(func=do_apply)
+    apply_parser.add_argument('--plan', '-p', metavar='FILENAME',
+                              required=True, dest='plan_file',
+                              help='Plan file to apply')
+    apply_parser.add_argument('--dry-run', required=False,
+                              action='store_true', dest='dry_run',
+                              help='Print actions without making any changes')
+    apply_parser.add_argument('--force', required=False,
+                              action='store_true', dest='force',
+                              help='Apply the plan even if the site has '
+                              'changed since it was made')
+    add_workers_arg(apply_parser,
+                    'Number of categories to check for changes '
+                    'concurrently')
+
+
 def setup_user_command_args(subparsers):
     # Users command arguments
     user_parser = subparsers.add_parser('user', help='Manage users')
@@ -379,6 +808,29 @@ def get_args():
                           dest='token', const='',
                           help='Signal Sciences API token. If omitted will '
                                'try to use value in $SIGSCI_API_TOKEN')
+    parser.add_argument('--token-cache', metavar='FILENAME', nargs='?',
+                        dest='token_cache', const=DEFAULT_TOKEN_CACHE,
+                        help='Reuse the session token from a previous '
+                             'password login until it expires, stored in a '
+                             'file only readable by the current user '
+                             '(default: %s)' % DEFAULT_TOKEN_CACHE)
+    parser.add_argument('--rate-limit', metavar='REQUESTS', type=float,
+                        dest='rate_limit',
+                        help='Maximum average number of API requests per '
+                             'second. Throttled requests are always retried '
+                             'with backoff')
+    parser.add_argument('--cache-ttl', metavar='SECONDS', type=int,
+                        dest='cache_ttl', default=DEFAULT_CACHE_TTL,
+                        help='Seconds to reuse corp level API responses '
+                             '(sites, users, corp lists and signals), 0 to '
+                             'disable (default: %d)' % DEFAULT_CACHE_TTL)
+    parser.add_argument('--cache-file', metavar='FILENAME',
+                        dest='cache_file',
+                        help='Keep cached corp level API responses in this '
+                             'file so later runs can reuse them')
+    parser.add_argument('--stats', action='store_true', dest='stats',
+                        help='Print API statistics when the command '
+                             'finishes')
 
     # List command
     setup_list_command_args(subparsers)
@@ -389,12 +841,25 @@ def get_args():
     # Backup command arguments
     setup_backup_command_args(subparsers)
 
+    # Query command arguments
+    setup_query_command_args(subparsers)
+
+    # Refs command arguments
+    setup_refs_command_args(subparsers)
+
+    # Diff command arguments
+    setup_diff_command_args(subparsers)
+
     # Clone command arguments
     setup_clone_command_args(subparsers)
 
     # Merge command arguments
     setup_merge_command_args(subparsers)
 
+    # Plan and apply command arguments
+    setup_plan_command_args(subparsers)
+    setup_apply_command_args(subparsers)
+
     # user command arguments
     setup_user_command_args(subparsers)
 
@@ -435,6 +900,14 @@ def main():
     if args.corp is None and 'SIGSCI_CORP' in os.environ:
         args.corp = os.environ['SIGSCI_CORP']
 
+    needs_api = getattr(args, 'needs_api', True)
+    if callable(needs_api):
+        needs_api = needs_api(args)
+    if not needs_api:
+        # Offline commands don't need credentials
+        args.func(args)
+        return 0
+
     # Validate corp/username/password|token are present
     if args.corp is None:
         print('error: corp name is required')
@@ -442,9 +915,23 @@ def main():
     if args.username is None:
         print('error: username is required')
         return 1
+    if getattr(args, 'resume', False) and not args.journal:
+        print('error: --resume requires --journal')
+        return 1
+    if getattr(args, 'store', False) and args.archive:
+        print('error: --store and --archive are exclusive')
+        return 1
+    if getattr(args, 'incremental', False) and not args.archive:
+        print('error: --incremental requires --archive')
+        return 1
+    if getattr(args, 'skip_unchanged', False) and not args.incremental:
+        print('error: --skip-unchanged requires --incremental')
+        return 1
     if args.password is None and args.token is None:
         print('error: password or API token is required')
         return 1
 
     args.func(args)
+    if args.stats:
+        print_stats()
     return 0
@@ -0,0 +1,299 @@
+import datetime
+import json
+import os
+import sqlite3
+
+# Every stored backup is a snapshot with an increasing id. Each category is
+# kept verbatim in `categories` so the backup can be rebuilt exactly, and the
+# parts worth querying are also normalized into indexed tables.
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    corp TEXT,
+    site TEXT NOT NULL,
+    created TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS snapshots_site ON snapshots (site, id);
+
+CREATE TABLE IF NOT EXISTS categories (
+    snapshot_id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (snapshot_id, key)
+);
+
+CREATE TABLE IF NOT EXISTS sites (
+    snapshot_id INTEGER PRIMARY KEY,
+    agent_level TEXT,
+    block_duration_seconds INTEGER,
+    block_http_code INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS lists (
+    snapshot_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    type TEXT,
+    description TEXT
+);
+CREATE INDEX IF NOT EXISTS lists_snapshot ON lists (snapshot_id, name);
+CREATE INDEX IF NOT EXISTS lists_name ON lists (name);
+
+CREATE TABLE IF NOT EXISTS list_entries (
+    snapshot_id INTEGER NOT NULL,
+    list_name TEXT NOT NULL,
+    entry TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS list_entries_snapshot
+    ON list_entries (snapshot_id, list_name);
+CREATE INDEX IF NOT EXISTS list_entries_entry ON list_entries (entry);
+
+CREATE TABLE IF NOT EXISTS rules (
+    snapshot_id INTEGER NOT NULL,
+    rule_index INTEGER NOT NULL,
+    type TEXT,
+    enabled INTEGER,
+    group_operator TEXT,
+    reason TEXT,
+    expiration TEXT,
+    signal TEXT,
+    PRIMARY KEY (snapshot_id, rule_index)
+);
+
+CREATE TABLE IF NOT EXISTS conditions (
+    snapshot_id INTEGER NOT NULL,
+    rule_index INTEGER NOT NULL,
+    type TEXT,
+    field TEXT,
+    operator TEXT,
+    value TEXT
+);
+CREATE INDEX IF NOT EXISTS conditions_rule
+    ON conditions (snapshot_id, rule_index);
+CREATE INDEX IF NOT EXISTS conditions_value ON conditions (value, field);
+
+CREATE TABLE IF NOT EXISTS actions (
+    snapshot_id INTEGER NOT NULL,
+    rule_index INTEGER NOT NULL,
+    type TEXT,
+    signal TEXT
+);
+CREATE INDEX IF NOT EXISTS actions_rule ON actions (snapshot_id, rule_index);
+
+CREATE TABLE IF NOT EXISTS signals (
+    snapshot_id INTEGER NOT NULL,
+    tag_name TEXT NOT NULL,
+    short_name TEXT,
+    description TEXT
+);
+CREATE INDEX IF NOT EXISTS signals_snapshot ON signals (snapshot_id);
+CREATE INDEX IF NOT EXISTS signals_tag_name ON signals (tag_name);
+
+CREATE TABLE IF NOT EXISTS alerts (
+    snapshot_id INTEGER NOT NULL,
+    tag_name TEXT,
+    long_name TEXT,
+    interval INTEGER,
+    threshold INTEGER,
+    enabled INTEGER,
+    action TEXT
+);
+CREATE INDEX IF NOT EXISTS alerts_snapshot ON alerts (snapshot_id);
+CREATE INDEX IF NOT EXISTS alerts_tag_name ON alerts (tag_name);
+
+CREATE TABLE IF NOT EXISTS members (
+    snapshot_id INTEGER NOT NULL,
+    email TEXT,
+    role TEXT
+);
+CREATE INDEX IF NOT EXISTS members_snapshot ON members (snapshot_id);
+CREATE INDEX IF NOT EXISTS members_email ON members (email);
+'''
+
+# First bytes of every SQLite database file
+SQLITE_MAGIC = b'SQLite format 3\x00'
+
+# Snapshot ids of the latest snapshot of each site, at or before a given id
+_LATEST = ('SELECT MAX(id) FROM snapshots WHERE id <= :as_of '
+           'GROUP BY site')
+
+
+def is_store(path):
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+
+
+def open_store(path):
+    """
+    Open a snapshot store, creating it if needed. The connection may be
+    used from several threads as long as they don't use it at the same time.
+    """
+    conn = sqlite3.connect(path, check_same_thread=False)
+    # A larger page cache than the 2MB default keeps more of the list entry
+    # index in memory while storing many sites
+    conn.execute('PRAGMA cache_size = -65536')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _conditions(rule):
+    """Yield the single conditions of a rule, flattening condition groups"""
+    stack = list(reversed(rule.get('conditions') or []))
+    while stack:
+        condition = stack.pop()
+        if condition.get('type') == 'group':
+            stack.extend(reversed(condition.get('conditions') or []))
+        else:
+            yield condition
+
+
+def _insert(conn, table, rows):
+    if rows:
+        conn.executemany('INSERT INTO %s VALUES (%s)' %
+                         (table, ', '.join('?' * len(rows[0]))), rows)
+
+
+def store_backup(conn, data):
+    """Store a site backup as a new snapshot and return the snapshot id"""
+    source = data.get('source', {})
+    with conn:
+        snapshot_id = conn.execute(
+            'INSERT INTO snapshots (corp, site, created) VALUES (?, ?, ?)',
+            (source.get('corp'), source.get('site'),
+             datetime.datetime.utcnow().isoformat() + 'Z')).lastrowid
+        _insert(conn, 'categories', [
+            (snapshot_id, key, json.dumps(value))
+            for key, value in data.items() if key != 'source'])
+
+        site = data.get('site') or {}
+        _insert(conn, 'sites', [(snapshot_id, site.get('agentLevel'),
+                                 site.get('blockDurationSeconds'),
+                                 site.get('blockHTTPCode'))])
+        rule_lists = data.get('rule_lists') or []
+        _insert(conn, 'lists', [
+            (snapshot_id, x['name'], x.get('type'), x.get('description'))
+            for x in rule_lists])
+        _insert(conn, 'list_entries', [
+            (snapshot_id, x['name'], entry)
+            for x in rule_lists for entry in x.get('entries') or []])
+
+        rules = data.get('site_rules') or []
+        _insert(conn, 'rules', [
+            (snapshot_id, i, x.get('type'), x.get('enabled'),
+             x.get('groupOperator'), x.get('reason'), x.get('expiration'),
+             x.get('signal'))
+            for i, x in enumerate(rules)])
+        _insert(conn, 'conditions', [
+            (snapshot_id, i, c.get('type'), c.get('field'),
+             c.get('operator'), c.get('value'))
+            for i, x in enumerate(rules) for c in _conditions(x)])
+        _insert(conn, 'actions', [
+            (snapshot_id, i, a.get('type'), a.get('signal'))
+            for i, x in enumerate(rules) for a in x.get('actions') or []])
+
+        _insert(conn, 'signals', [
+            (snapshot_id, x['tagName'], x.get('shortName'),
+             x.get('description'))
+            for x in data.get('custom_signals') or []])
+        _insert(conn, 'alerts', [
+            (snapshot_id, x.get('tagName'), x.get('longName'),
+             x.get('interval'), x.get('threshold'), x.get('enabled'),
+             x.get('action'))
+            for x in data.get('custom_alerts') or []])
+        _insert(conn, 'members', [
+            (snapshot_id, x['user'].get('email'), x.get('role'))
+            for x in data.get('site_members') or []])
+    return snapshot_id
+
+
+def load_stored(path, site_name, snapshot=None):
+    """
+    Rebuild a site backup from a snapshot in a store, the latest snapshot
+    of the site by default
+    """
+    conn = sqlite3.connect(path)
+    try:
+        if snapshot is None:
+            row = conn.execute('SELECT MAX(id) FROM snapshots WHERE site = ?',
+                               (site_name,)).fetchone()
+        else:
+            row = conn.execute(
+                'SELECT id FROM snapshots WHERE site = ? AND id = ?',
+                (site_name, int(snapshot))).fetchone()
+        if row is None or row[0] is None:
+            raise Exception("No snapshot%s of site '%s' in store '%s'" %
+                            ('' if snapshot is None else " '%s'" % snapshot,
+                             site_name, path))
+        corp, site = conn.execute(
+            'SELECT corp, site FROM snapshots WHERE id = ?', row).fetchone()
+        data = {'source': {'corp': corp, 'site': site}}
+        for key, value in conn.execute(
+                'SELECT key, value FROM categories WHERE snapshot_id = ? '
+                'ORDER BY rowid', row):
+            data[key] = json.loads(value)
+        return data
+    finally:
+        conn.close()
+
+
+def _as_of(conn, as_of):
+    if as_of is None:
+        as_of = conn.execute('SELECT MAX(id) FROM snapshots').fetchone()[0]
+    return as_of or 0
+
+
+def list_snapshots(conn, as_of=None):
+    """Latest snapshot (id, site, created) of every site, as of a snapshot"""
+    return conn.execute(
+        'SELECT id, site, created FROM snapshots WHERE id IN (%s) '
+        'ORDER BY site' % _LATEST, {'as_of': _as_of(conn, as_of)}).fetchall()
+
+
+def sites_using_list(conn, list_name, as_of=None):
+    """
+    Rules using a list in a condition, as (site, rule index, operator,
+    value). list_name is either the value conditions refer to the list by,
+    e.g. "corp.ips", or a bare name matching both site and corp lists.
+    """
+    names = [list_name] if '.' in list_name else [
+        'site.' + list_name, 'corp.' + list_name]
+    return conn.execute(
+        'SELECT s.site, c.rule_index, c.operator, c.value '
+        'FROM conditions c JOIN snapshots s ON s.id = c.snapshot_id '
+        'WHERE c.value IN (:site, :corp) '
+        'AND c.operator IN (\'inList\', \'notInList\') '
+        'AND c.snapshot_id IN (%s) ORDER BY s.site, c.rule_index' % _LATEST,
+        {'site': names[0], 'corp': names[-1],
+         'as_of': _as_of(conn, as_of)}).fetchall()
+
+
+def rules_matching(conn, field, value, action=None, as_of=None):
+    """
+    Site rules with a condition on a field equal to a value, optionally
+    only those taking an action, as (site, rule index, rule type, reason)
+    """
+    sql = ('SELECT DISTINCT s.site, r.rule_index, r.type, r.reason '
+           'FROM conditions c JOIN snapshots s ON s.id = c.snapshot_id '
+           'JOIN rules r ON r.snapshot_id = c.snapshot_id '
+           'AND r.rule_index = c.rule_index '
+           'WHERE c.value = :value AND c.field = :field '
+           'AND c.snapshot_id IN (%s)' % _LATEST)
+    if action:
+        sql += (' AND EXISTS (SELECT 1 FROM actions a WHERE '
+                'a.snapshot_id = r.snapshot_id AND '
+                'a.rule_index = r.rule_index AND a.type = :action)')
+    sql += ' ORDER BY s.site, r.rule_index'
+    return conn.execute(sql, {'field': field, 'value': value,
+                              'action': action,
+                              'as_of': _as_of(conn, as_of)}).fetchall()
+
+
+def lists_containing(conn, entry, as_of=None):
+    """Lists containing an entry, as (site, list name)"""
+    return conn.execute(
+        'SELECT DISTINCT s.site, e.list_name '
+        'FROM list_entries e JOIN snapshots s ON s.id = e.snapshot_id '
+        'WHERE e.entry = :entry AND e.snapshot_id IN (%s) '
+        'ORDER BY s.site, e.list_name' % _LATEST,
+        {'entry': entry, 'as_of': _as_of(conn, as_of)}).fetchall()
@@ -0,0 +1,65 @@
+import json
+import os
+import stat
+import time
+
+# Location of the session token cache, only used when enabled with
+# --token-cache
+DEFAULT_TOKEN_CACHE = os.path.join('~', '.sigsci_site_manager', 'tokens.json')
+
+# How long a cached token is used before logging in again. Tokens that stop
+# working before then are refreshed when the API responds with a 401.
+TOKEN_CACHE_TTL = 8 * 60 * 60
+
+
+def _cache_key(corp, username):
+    return '%s/%s' % (corp, username)
+
+
+def _read_cache(path):
+    path = os.path.expanduser(path)
+    try:
+        mode = os.stat(path).st_mode
+    except OSError:
+        return {}
+    if mode & (stat.S_IRWXG | stat.S_IRWXO):
+        # Like ssh, don't trust a token file others can read or modify
+        print('Warning: ignoring token cache %s, it must only be accessible '
+              'by its owner (chmod 600)' % path)
+        return {}
+    try:
+        with open(path, 'r') as f:
+            return json.loads(f.read())
+    except ValueError:
+        return {}
+
+
+def load_token(path, corp, username):
+    """Return the cached session token for a corp and user if still valid"""
+    entry = _read_cache(path).get(_cache_key(corp, username))
+    if entry and entry.get('expires', 0) > time.time():
+        return entry['token']
+    return None
+
+
+def save_token(path, corp, username, token, ttl=TOKEN_CACHE_TTL):
+    """
+    Store a session token in the cache. The file is only readable by the
+    current user and is replaced atomically.
+    """
+    path = os.path.expanduser(path)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    cache = _read_cache(path)
+    now = time.time()
+    # Drop expired tokens while we're here
+    cache = {k: v for k, v in cache.items() if v.get('expires', 0) > now}
+    cache[_cache_key(corp, username)] = {'token': token, 'expires': now + ttl}
+
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(json.dumps(cache))
+    os.replace(tmp_path, path)
@@ -1,12 +1,12 @@
 import sys
 
-from sigsci_site_manager.api import init_api
+from sigsci_site_manager.api import api_options, init_api
 from sigsci_site_manager.util import add_new_user
 
 
 def do_list_users(args):
     api = init_api(args.username, args.password, args.token, args.corp,
-                   args.dry_run)
+                   args.dry_run, **api_options(args))
     if args.site_name:
         api.site = args.site_name
         users = api.get_site_members()
@@ -35,7 +35,7 @@ def do_list_users(args):
 
 def do_list_membership(args):
     api = init_api(args.username, args.password, args.token, args.corp,
-                   args.dry_run)
+                   args.dry_run, **api_options(args))
     if args.email_id:
         memberships = api.get_memberships(args.email_id)
         cols = ['role', 'site']
@@ -53,7 +53,7 @@ def do_list_membership(args):
 
 def do_add_user(args):
     api = init_api(args.username, args.password, args.token, args.corp,
-                   args.dry_run)
+                   args.dry_run, **api_options(args))
 
     input_file = resolve_input_file(args.file_name)
     location_string = 'corp'
@@ -83,7 +83,7 @@ def do_add_user(args):
 
 def do_remove_user(args):
     api = init_api(args.username, args.password, args.token, args.corp,
-                   args.dry_run)
+                   args.dry_run, **api_options(args))
 
     input_file = resolve_input_file(args.file_name)
     location_string = 'corp'
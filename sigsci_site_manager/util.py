@@ -1,3 +1,6 @@
+import hashlib
+import json
+
 from sigsci_site_manager.consts import CATEGORIES, VALID_ROLES
 
 
@@ -29,96 +32,136 @@ def _equal_single(a, b):
     return True
 
 
-def _equal_multival(a, b):
-    # groupOperator is part of both group and multival
-    if a['groupOperator'] != b['groupOperator']:
-        return False
+def _dumps(value):
+    # Compact, key-sorted JSON used as the stable encoding of normal forms
+    return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+
+def canonical_condition(cond):
+    """
+    Return the normal form of a condition. Single conditions are reduced to
+    their compared fields and group/multival conditions to their operators
+    plus the normal forms of their conditions, sorted so that the order of
+    conditions in the group doesn't matter. Nested groups are handled at any
+    depth.
+    """
+    if cond['type'] == 'single':
+        return [cond['type'], cond['field'], cond['operator'], cond['value']]
 
-    if a['type'] == 'multival':
+    ret = [cond['type'], cond['groupOperator']]
+    if cond['type'] == 'multival':
         # multival has additional fields
-        for key in ['field', 'operator']:
-            if a[key] != b[key]:
-                return False
+        ret += [cond['field'], cond['operator']]
+    ret.append(canonical_conditions(cond['conditions']))
+    return ret
 
-    # Make sure there are the same number of conditions before doing
-    # anything more complicated
-    if len(a['conditions']) != len(b['conditions']):
-        return False
 
-    # Loop through all in list a
-    match_all = False
-    for conda in a['conditions']:
-        # Compare the element in a against all in list b
-        for condb in b['conditions']:
-            # Check each field for a match
-            match = True
-            for key in ['type', 'field', 'operator', 'value']:
-                if conda[key] != condb[key]:
-                    # Non-matching field found
-                    match = False
-            if match:
-                # Found a match so stop looping through b
-                break
-        else:
-            # Nothing in b matched the item from a so stop looping
-            break
-    else:
-        # Never broke from the loop of a due to not matches so all must
-        # have matched
-        match_all = True
+def canonical_conditions(conditions):
+    """Return the order-insensitive normal form of a list of conditions"""
+    return sorted((canonical_condition(c) for c in conditions), key=_dumps)
 
-    return match_all
 
+def _rule_fields(signal_rule):
+    if signal_rule:
+        # Signal rules have an implied action
+        return ['groupOperator', 'signal']
+    # Request rules have an explicit action
+    return ['groupOperator', 'action', 'actions', 'signal']
 
-def equal_conditions(a, b):
-    ret = False
-    if a['type'] == b['type']:
-        if a['type'] == 'single':
-            ret = _equal_single(a, b)
-        elif a['type'] in ('group', 'multival'):
-            ret = _equal_multival(a, b)
+
+def canonical_rule(rule, signal_rule=False):
+    """
+    Return the normal form of a request, site or signal rule, covering only
+    the fields compared by equal_rules(). Fields missing from the rule are
+    left out, as equal_rules() only compares a field both rules have.
+    """
+    ret = {k: rule[k] for k in _rule_fields(signal_rule) if k in rule}
+    ret['conditions'] = canonical_conditions(rule['conditions'])
     return ret
 
 
-def equal_rules(in_a, in_b, signal_rule=False):
+_FINGERPRINTS = {}
+FINGERPRINT_CACHE_SIZE = 100000
+
+
+def _memoized(rule, key, compute):
+    # Keep a reference to the rule so its id can't be reused while cached
+    cached = _FINGERPRINTS.get(key)
+    if cached is not None and cached[0] is rule:
+        return cached[1]
+    value = compute()
+    if len(_FINGERPRINTS) >= FINGERPRINT_CACHE_SIZE:
+        _FINGERPRINTS.clear()
+    _FINGERPRINTS[key] = (rule, value)
+    return value
+
+
+def _hash(value):
+    return hashlib.sha256(_dumps(value).encode('utf-8')).hexdigest()
+
+
+def rule_fingerprint(rule, signal_rule=False):
     """
-    Compares the details of a request or signal rule, exluding some fields
-    that should not be compared.
+    Return a stable hash of the normal form of a rule. Rules with the same
+    fingerprint are equal by equal_rules(), but a rule missing a field the
+    other has can be equal with a different fingerprint, so look rules up
+    with index_rules() and find_equal_rule() rather than by fingerprint.
+
+    Fingerprints are memoized per rule object, so a rule must not be modified
+    after it has been fingerprinted.
     """
-    if signal_rule:
-        # Signal rules have an implied action
-        keys = ['groupOperator', 'conditions', 'signal']
-        simple_fields = ['groupOperator', 'signal']
-    else:
-        # Request rules have an explicit action
-        keys = ['groupOperator', 'conditions', 'action', 'actions', 'signal']
-        simple_fields = ['groupOperator', 'action', 'actions', 'signal']
+    return _memoized(rule, (id(rule), signal_rule),
+                     lambda: _hash(canonical_rule(rule, signal_rule)))
 
-    a = filter_data(in_a, keys)
-    b = filter_data(in_b, keys)
 
-    # Check the simple fields first
-    for key in simple_fields:
-        if key in a and key in b and a[key] != b[key]:
-            return False
+def conditions_fingerprint(rule):
+    """Stable hash of the order-insensitive normal form of rule conditions"""
+    return _memoized(rule, (id(rule), 'conditions'),
+                     lambda: _hash(canonical_conditions(rule['conditions'])))
+
+
+def index_rules(rules):
+    """Index rules on their conditions for find_equal_rule()"""
+    index = {}
+    for rule in rules:
+        index.setdefault(conditions_fingerprint(rule), []).append(rule)
+    return index
+
+
+def find_equal_rule(index, rule, signal_rule=False):
+    """
+    Find a rule of an index_rules() index equal to rule, only comparing
+    the rules that have the same conditions
+    """
+    for candidate in index.get(conditions_fingerprint(rule), []):
+        if equal_rules(rule, candidate, signal_rule):
+            return candidate
+    return None
 
-    # Make sure there are the same number of conditions before doing anything
-    # more complicated
-    if len(a['conditions']) != len(b['conditions']):
+
+def _equal_multival(a, b):
+    return canonical_condition(a) == canonical_condition(b)
+
+
+def equal_conditions(a, b):
+    if a['type'] != b['type'] or a['type'] not in ('single', 'group',
+                                                   'multival'):
         return False
+    return canonical_condition(a) == canonical_condition(b)
 
-    match_all = False
-    for conda in a['conditions']:
-        for condb in b['conditions']:
-            if equal_conditions(conda, condb):
-                break
-        else:
-            # No condition in b matched the one from a
-            break
-    else:
-        match_all = True
 
-    return match_all
+def equal_rules(in_a, in_b, signal_rule=False):
+    """
+    Compares the details of a request or signal rule, exluding some fields
+    that should not be compared. Conditions are compared regardless of their
+    order, other fields only when both rules have them.
+    """
+    if conditions_fingerprint(in_a) != conditions_fingerprint(in_b):
+        return False
+    # Like the conditions, simple fields are only compared when both rules
+    # have them
+    return all(in_a[key] == in_b[key] for key in _rule_fields(signal_rule)
+               if key in in_a and key in in_b)
 
 
 def build_category_list(include: list = None, exclude: list = None):
@@ -0,0 +1,142 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import copy
+import threading
+
+import pytest
+
+import sigsci_site_manager.api as api
+import sigsci_site_manager.token_cache as token_cache
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    logins = 0
+    gets = 0
+
+    def _send_json(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        Handler.logins += 1
+        self._send_json(200, b'{"token": "token%d"}' % Handler.logins)
+
+    def do_PUT(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self._send_json(200, b'{}')
+
+    def do_GET(self):
+        Handler.gets += 1
+        if self.path.endswith('/private'):
+            if self.headers.get('Authorization') == 'Bearer token2':
+                self._send_json(200, b'{"message": "secret"}')
+            else:
+                self._send_json(401, b'{"message": "expired"}')
+            return
+        if self.path.endswith('/empty'):
+            self.send_response(204)
+            self.end_headers()
+            return
+        status = 400 if self.path.endswith('/bad') else 200
+        self._send_json(status, b'{"message": "hello"}')
+
+    def log_message(self, *args):
+        return
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:%d/api/' % httpd.server_address[1]
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def make_api(base_url, pool_size=api.DEFAULT_POOL_SIZE):
+    sigsci = api.init_api('user@test.com', None, 'token', 'corp',
+                          pool_size=pool_size)
+    sigsci.base_url = base_url
+    return sigsci
+
+
+def test_token_cache_and_refresh(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(api.sigsciapi.SigSciApi, 'base_url', server)
+    monkeypatch.setattr(Handler, 'logins', 0)
+    cache = str(tmp_path / 'tokens.json')
+
+    sigsci = api.init_api('user@test.com', 'pw', None, 'corp',
+                          token_cache=cache)
+    assert sigsci.bearer_token == {'token': 'token1'}
+
+    # A second run reuses the cached token without logging in
+    sigsci = api.init_api('user@test.com', 'pw', None, 'corp',
+                          token_cache=cache)
+    assert Handler.logins == 1
+
+    # An expired token is refreshed, cached and the request retried
+    site_api = copy.copy(sigsci)
+    other_api = copy.copy(sigsci)
+    assert site_api._make_request('/private') == {'message': 'secret'}
+    assert Handler.logins == 2
+    assert site_api.bearer_token == {'token': 'token2'}
+    assert token_cache.load_token(cache, 'corp', 'user@test.com') == 'token2'
+
+    # Other copies of the API pick up the new token without logging in again
+    assert other_api._make_request('/private') == {'message': 'secret'}
+    assert Handler.logins == 2
+
+
+def test_make_request(server):
+    sigsci = make_api(server)
+    assert sigsci.get_corp_sites() == {'message': 'hello'}
+    assert sigsci._make_request('/empty') == {'message': 'GET successful.'}
+    with pytest.raises(Exception, match='400 Bad Request: hello'):
+        sigsci._make_request('/bad')
+
+
+def test_pool_reuses_connections(server):
+    sigsci = make_api(server, pool_size=20)
+    adapter = sigsci.session.get_adapter('https://')
+    assert adapter._pool_maxsize == 20
+
+    for _ in range(10):
+        sigsci._make_request('/ping')
+
+    stats = api.pool_stats(sigsci)
+    assert stats['requests'] == 10
+    assert stats['connections'] == 1
+    assert stats['reuse_ratio'] == pytest.approx(0.9)
+    assert stats['open_connections'] == 1
+
+
+def test_corp_cache(server, monkeypatch):
+    monkeypatch.setattr(Handler, 'gets', 0)
+    sigsci = make_api(server)
+    sigsci.site = 'site'
+
+    sigsci.get_corp_users()
+    sigsci.get_corp_users()
+    sigsci.get_corp_sites()
+    sigsci.get_corp_sites()
+    assert Handler.gets == 2
+
+    # Site contents are never cached
+    sigsci.get_corp_site('site')
+    sigsci.get_corp_site('site')
+    sigsci.get_site_members()
+    sigsci.get_site_members()
+    assert Handler.gets == 6
+
+    # Writing to users makes the cached users stale but not the sites
+    sigsci.update_corp_user('user@test.com', {})
+    sigsci.get_corp_users()
+    sigsci.get_corp_sites()
+    assert Handler.gets == 7
+    assert sigsci.cache.stats()['hits'] == 3
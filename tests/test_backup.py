@@ -0,0 +1,217 @@
+import json
+import threading
+import time
+
+import pytest
+
+import sigsci_site_manager.archive as archive
+import sigsci_site_manager.backup as backup
+import sigsci_site_manager.compression as compressions
+
+
+class DummyAPI(object):
+    def __init__(self, delay=0):
+        self.site = None
+        self.corp = 'dummy'
+        self.delay = delay
+        self.threads = set()
+
+    def _get(self, data):
+        self.threads.add(threading.get_ident())
+        time.sleep(self.delay)
+        return {'data': data}
+
+    def get_corp_site(self, site_name):
+        self.threads.add(threading.get_ident())
+        return {'name': site_name, 'agentLevel': 'block',
+                'blockDurationSeconds': 86400, 'blockHTTPCode': 406}
+
+    def get_rule_lists(self):
+        return self._get([{'id': '1', 'name': 'list', 'type': 'ip',
+                           'description': 'list', 'entries': ['1.1.1.1']}])
+
+    def get_site_rules(self):
+        return self._get([{'id': '2', 'type': 'request', 'enabled': True,
+                           'groupOperator': 'all', 'conditions': [],
+                           'actions': [{'type': 'block'}], 'reason': 'rule',
+                           'expiration': ''}])
+
+    def get_custom_signals(self):
+        return self._get([{'tagName': 'site.sig', 'shortName': 'sig',
+                           'description': ''}])
+
+    def get_templated_rules(self):
+        return self._get([
+            {'name': 'LOGINATTEMPT', 'detections': [], 'alerts': []},
+            {'name': 'CMDEXE', 'detections': [
+                {'name': 'CMDEXE', 'fields': [], 'enabled': True}],
+             'alerts': [{'longName': 'a', 'interval': 1, 'threshold': 10,
+                         'skipNotifications': False, 'enabled': True,
+                         'action': 'flagged'}]}])
+
+    def get_custom_alerts(self):
+        return self._get([{'tagName': 'site.sig', 'longName': 'alert',
+                           'interval': 10, 'threshold': 5, 'enabled': True,
+                           'action': 'flagged'}])
+
+    def get_site_members(self):
+        return self._get([{'user': {'email': 'test@test.com'},
+                           'role': 'user'}])
+
+    def get_advanced_rules(self):
+        return self._get([])
+
+    def get_integrations(self):
+        return self._get([{'name': 'hook', 'type': 'generic',
+                           'url': 'https://example.com', 'events': []}])
+
+
+def test_backups_concurrent_matches_sequential():
+    sequential = backup.backups(DummyAPI(), 'dummy')
+    api = DummyAPI(delay=0.01)
+    concurrent = backup.backups(api, 'dummy', workers=4)
+
+    assert json.dumps(concurrent) == json.dumps(sequential)
+    assert len(api.threads) > 1
+
+
+def test_iter_backup_bounds_requests_in_flight():
+    class CountingAPI(DummyAPI):
+        started = 0
+
+        def _get(self, data):
+            self.started += 1
+            return DummyAPI._get(self, data)
+
+    api = CountingAPI(delay=0.01)
+    for i, _ in enumerate(backup.iter_backup(api, 'dummy', workers=2)):
+        # Only the categories yielded so far and the next two are requested
+        assert api.started <= i + 2
+    assert api.started == 8
+
+
+class FailingAPI(DummyAPI):
+    def get_corp_site(self, site_name):
+        if site_name == 'broken':
+            raise Exception('Site not found')
+        return super().get_corp_site(site_name)
+
+
+def test_backup_sites(tmp_path):
+    api = FailingAPI()
+    manifest = backup.backup_sites(api, ['one', 'broken', 'two'],
+                                   str(tmp_path), workers=3)
+
+    assert [s['site'] for s in manifest['sites']] == ['one', 'broken', 'two']
+    assert [s['status'] for s in manifest['sites']] == ['ok', 'failed', 'ok']
+    with open(tmp_path / backup.MANIFEST_FILE) as f:
+        assert json.load(f) == manifest
+    with open(tmp_path / 'two.json') as f:
+        assert json.load(f)['source'] == {'corp': 'dummy', 'site': 'two'}
+    assert not (tmp_path / 'broken.json').exists()
+    # Each site is backed up through its own copy of the API
+    assert api.site is None
+
+
+def test_backup_streams_to_file(tmp_path):
+    file_name = str(tmp_path / 'site.json')
+    backup.backup(DummyAPI(), 'dummy', file_name, workers=4)
+    expected = backup.backups(DummyAPI(), 'dummy')
+    with open(file_name) as f:
+        assert f.read() == json.dumps(expected)
+
+    # Tiny reads make every value span many of them
+    with open(file_name) as f:
+        assert dict(backup.iter_backup_file(f, chunk_size=7)) == expected
+    assert backup.load_backup(file_name) == expected
+
+
+def test_load_backup_rejects_truncated_file(tmp_path):
+    file_name = tmp_path / 'site.json'
+    file_name.write_text('{"source": {"corp": "dummy"}, "site": {"agent')
+    with pytest.raises(ValueError):
+        backup.load_backup(str(file_name))
+
+
+@pytest.mark.parametrize('compression', ['gzip', 'xz', 'zstd'])
+def test_compressed_backup(tmp_path, compression):
+    if compression == 'zstd':
+        pytest.importorskip('zstandard')
+    expected = backup.backups(DummyAPI(), 'dummy')
+
+    # Compression chosen by the extension
+    extension = compressions.CODECS[compression][0]
+    file_name = str(tmp_path / ('site.json' + extension))
+    backup.backup(DummyAPI(), 'dummy', file_name)
+    assert compressions.detect_compression(file_name) == compression
+    assert backup.load_backup(file_name) == expected
+
+    # Compression chosen by the flag is detected without an extension
+    file_name = str(tmp_path / 'site.json')
+    backup.backup(DummyAPI(), 'dummy', file_name, compression=compression)
+    assert compressions.detect_compression(file_name) == compression
+    assert backup.load_backup(file_name) == expected
+
+
+def test_backup_archive(tmp_path):
+    path = str(tmp_path / 'archive')
+    stats = backup.archive_sites(DummyAPI(), ['one', 'two'], path, workers=2)
+    expected = backup.backups(DummyAPI(), 'two')
+
+    # The second site only adds its snapshot manifest
+    assert stats['objects'] == 2 * stats['written']
+    assert backup.load_backup(path + '#two') == expected
+
+    snapshots = archive.list_snapshots(path, 'one')
+    assert len(snapshots) == 1
+    stats = backup.backup_to_archive(DummyAPI(), 'one', path)
+    assert stats['written'] == 0
+    assert archive.list_snapshots(path, 'one')[0] == snapshots[0]
+    assert backup.load_backup('%s#one@%s' % (path, snapshots[0]))[
+        'source'] == {'corp': 'dummy', 'site': 'one'}
+
+    with pytest.raises(Exception, match='No snapshots'):
+        backup.load_backup(path + '#three')
+
+
+class ChangingAPI(DummyAPI):
+    def __init__(self, entries):
+        super(ChangingAPI, self).__init__()
+        self.entries = entries
+        self.fetched = []
+
+    def get_rule_lists(self):
+        self.fetched.append('rule_lists')
+        return self._get([{'id': '1', 'name': 'list', 'type': 'ip',
+                           'description': 'list', 'entries': self.entries}])
+
+
+def test_incremental_backup(tmp_path):
+    path = str(tmp_path / 'archive')
+    backup.backup_to_archive(DummyAPI(), 'one', path, incremental=True)
+    first = archive.list_snapshots(path, 'one')[0]
+
+    # Only the changed list is stored, other categories refer to the first
+    # snapshot, also from a third snapshot
+    api = ChangingAPI(['2.2.2.2'])
+    stats = backup.backup_to_archive(api, 'one', path, incremental=True)
+    assert stats['unchanged'] == len(backup.BACKUP_STEPS) - 1
+    assert stats['written'] == 1
+    stats = backup.backup_to_archive(api, 'one', path, incremental=True)
+    assert stats['unchanged'] == len(backup.BACKUP_STEPS)
+    manifest = archive.load_manifest(path, 'one')
+    assert manifest['categories']['site'] == {'ref': first}
+    assert manifest['categories']['rule_lists']['ref'] != first
+    assert backup.load_backup(path + '#one') == backup.backups(api, 'one')
+
+    # Unchanged cheap categories skip fetching the others
+    api = ChangingAPI(['3.3.3.3'])
+    stats = backup.backup_to_archive(api, 'one', path, incremental=True,
+                                     skip_unchanged=True)
+    assert api.fetched == []
+    assert stats['written'] == 0
+    manifest = archive.load_manifest(path, 'one')
+    assert 'rule_lists' in manifest['unverified']
+    assert 'site' not in manifest['unverified']
+    assert backup.load_backup(path + '#one')['rule_lists'][0][
+        'entries'] == ['2.2.2.2']
@@ -0,0 +1,52 @@
+import sigsci_site_manager.cache as cache
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_and_lru():
+    clock = Clock()
+    c = cache.TTLCache(ttl=10, max_entries=2, clock=clock)
+    c.put('a', {'data': [1]})
+    c.put('b', {'data': [2]})
+    assert c.get('a') == (True, {'data': [1]})
+    # 'b' is the least recently used so it is evicted
+    c.put('c', {'data': [3]})
+    assert c.get('b') == (False, None)
+
+    # Cached values can't be changed through the returned copies
+    _, value = c.get('a')
+    value['data'].append(4)
+    assert c.get('a') == (True, {'data': [1]})
+
+    clock.now += 11
+    assert c.get('a') == (False, None)
+    assert c.stats() == {'hits': 3, 'misses': 2, 'invalidations': 0,
+                         'entries': 1}
+
+
+def test_invalidate():
+    c = cache.TTLCache()
+    c.put('/corps/c/users', 1)
+    c.put('/corps/c/users/a', 2)
+    c.put('/corps/c/sites', 3)
+    c.invalidate('/corps/c/users')
+    assert c.get('/corps/c/users/a') == (False, None)
+    assert c.get('/corps/c/sites') == (True, 3)
+
+
+def test_persistence(tmp_path):
+    clock = Clock()
+    path = str(tmp_path / 'cache.json')
+    c = cache.TTLCache(ttl=10, path=path, clock=clock)
+    c.put('a', 1)
+    c.save()
+
+    assert cache.TTLCache(path=path, clock=clock).get('a') == (True, 1)
+    clock.now += 11
+    assert cache.TTLCache(path=path, clock=clock).get('a') == (False, None)
@@ -0,0 +1,63 @@
+import threading
+import time
+
+import sigsci_site_manager.consts as consts
+import sigsci_site_manager.deploy as deploy
+
+
+class RecordingAPI(object):
+    def __init__(self):
+        self.site = None
+        self.corp = 'dummy'
+        self.calls = []
+        self.threads = set()
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if not name.startswith(('add_', 'create_', 'copy_')):
+            raise AttributeError(name)
+
+        def record(*args):
+            time.sleep(0.005)
+            with self.lock:
+                self.calls.append(name)
+                self.threads.add(threading.get_ident())
+        return record
+
+    def get_corp_site(self, site_name):
+        raise Exception('Site not found')
+
+    def get_corp_users(self):
+        return {'data': []}
+
+
+DATA = {
+    'source': {'corp': 'dummy', 'site': 'src'},
+    'site': {},
+    'rule_lists': [{'name': 'list%d' % i} for i in range(10)],
+    'custom_signals': [{'shortName': 'signal%d' % i} for i in range(10)],
+    'site_rules': [{'reason': 'rule%d' % i} for i in range(10)],
+    'templated_rules': {'LOGINATTEMPT': {}},
+    'custom_alerts': [{'longName': 'alert', 'action': 'info'},
+                      {'longName': 'agent', 'action': 'siteMetricInfo'}],
+    'site_members': [],
+    'integrations': [],
+    'advanced_rules': []
+}
+
+
+def test_deploy_stages():
+    api = RecordingAPI()
+    deploy.deploys(api, 'new', DATA, None, consts.CATEGORIES, workers=8)
+
+    calls = api.calls
+    assert calls[0] == 'create_corp_site'
+    first_stage = {'add_rule_lists', 'add_custom_signals'}
+    last_dependency = max(i for i, c in enumerate(calls) if c in first_stage)
+    first_dependent = min(i for i, c in enumerate(calls)
+                          if c not in first_stage and i > 0)
+    assert last_dependency < first_dependent
+    assert calls.count('add_rule_lists') == 10
+    assert calls.count('add_site_rules') == 10
+    assert calls.count('add_custom_alert') == 1
+    assert len(api.threads) > 1
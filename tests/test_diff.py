@@ -0,0 +1,109 @@
+import json
+
+import sigsci_site_manager.diff as diff
+
+
+def make_rule(path, reason='rule'):
+    return {'type': 'request', 'enabled': True, 'groupOperator': 'all',
+            'conditions': [
+                {'type': 'single', 'field': 'path', 'operator': 'equals',
+                 'value': path},
+                {'type': 'single', 'field': 'method', 'operator': 'equals',
+                 'value': 'POST'}],
+            'actions': [{'type': 'block'}], 'reason': reason,
+            'expiration': ''}
+
+
+OLD = {
+    'source': {'corp': 'dummy', 'site': 'old'},
+    'site': {'agentLevel': 'log', 'blockDurationSeconds': 86400,
+             'blockHTTPCode': 406},
+    'rule_lists': [{'name': 'ips', 'type': 'ip', 'description': '',
+                    'entries': ['1.1.1.1', '2.2.2.2']}],
+    'site_rules': [make_rule('/login'), make_rule('/admin'),
+                   make_rule('/search', 'old reason')],
+    'custom_signals': [{'tagName': 'site.sig', 'shortName': 'sig',
+                        'description': ''}],
+    'templated_rules': {},
+    'site_members': [{'user': {'email': 'a@test.com'}, 'role': 'user'}]
+}
+
+
+def test_diff_snapshots():
+    new = json.loads(json.dumps(OLD))
+    new['source']['site'] = 'new'
+    new['site']['agentLevel'] = 'block'
+    new['rule_lists'][0]['entries'] = ['2.2.2.2', '3.3.3.3']
+    # Same rule with its conditions in another order, and a modified rule
+    new['site_rules'][0]['conditions'].reverse()
+    new['site_rules'][1] = make_rule('/admin/')
+    new['site_rules'][2]['reason'] = 'rule'
+    new['site_members'][0]['role'] = 'admin'
+    new['site_members'].append({'user': {'email': 'b@test.com'},
+                                'role': 'user'})
+
+    result = diff.diff_snapshots(OLD, new)
+    categories = result['categories']
+    assert sorted(categories) == ['rule_lists', 'site', 'site_members',
+                                  'site_rules']
+    assert categories['site']['changed'][0]['fields'] == {
+        'agentLevel': {'old': 'log', 'new': 'block'}}
+    assert categories['rule_lists']['changed'] == [{
+        'key': 'ips|ip', 'name': "'ips' (ip)", 'fields': {},
+        'entries': {'additions': ['3.3.3.3'], 'deletions': ['1.1.1.1']}}]
+    assert categories['site_rules']['added'] == [make_rule('/admin/')]
+    assert categories['site_rules']['removed'] == [make_rule('/admin')]
+    assert [x['fields'] for x in categories['site_rules']['changed']] == [
+        {'reason': {'old': 'old reason', 'new': 'rule'}}]
+    assert categories['site_members']['added'] == [new['site_members'][1]]
+    assert categories['site_members']['changed'][0]['fields'] == {
+        'role': {'old': 'user', 'new': 'admin'}}
+
+    assert diff.diff_snapshots(OLD, OLD)['categories'] == {}
+
+
+def test_diff_files(tmp_path, capsys):
+    old_file = str(tmp_path / 'old.json')
+    with open(old_file, 'w') as f:
+        f.write(json.dumps(OLD))
+    new = dict(OLD, custom_signals=[])
+    new_file = str(tmp_path / 'new.json')
+    with open(new_file, 'w') as f:
+        f.write(json.dumps(new))
+
+    diff.diff(None, old_file, new_file, as_json=True)
+    result = json.loads(capsys.readouterr().out)
+    assert result['categories'] == {'custom_signals': {
+        'added': [], 'removed': OLD['custom_signals'], 'changed': []}}
+
+    diff.diff(None, old_file, new_file)
+    assert "  - 'sig'" in capsys.readouterr().out.splitlines()
+
+
+class SiteAPI(object):
+    def __init__(self, data):
+        self.site = None
+        self.corp = 'dummy'
+        self.data = data
+
+    def get_corp_site(self, site_name):
+        return self.data['site']
+
+    def __getattr__(self, name):
+        # get_<category> reads of the backup categories
+        key = name[len('get_'):]
+        return lambda: {'data': self.data.get(key, [])}
+
+
+def test_diff_live_site_json(tmp_path, capsys):
+    old_file = str(tmp_path / 'old.json')
+    with open(old_file, 'w') as f:
+        f.write(json.dumps(OLD))
+    live = dict(OLD, custom_signals=[], templated_rules=[])
+
+    diff.diff(SiteAPI(live), old_file, 'site:live', as_json=True)
+    out = capsys.readouterr()
+    result = json.loads(out.out)
+    assert result['new'] == {'corp': 'dummy', 'site': 'live'}
+    assert list(result['categories']) == ['custom_signals']
+    assert 'get_site_rules' in out.err
@@ -90,3 +90,8 @@ def test_deploy_category_exclude():
     with pytest.raises(AttributeError,
                        match="object has no attribute 'add_custom_signals'"):
         deploy.deploys(API, 'dummy1', DATA, 'dummy', categories)
+
+
+def test_merge_missing_site():
+    assert merge.merges(API, 'missing', DATA, consts.CATEGORIES) is False
+    assert merge.merges(API, 'dummy', DATA, []) is True
@@ -0,0 +1,113 @@
+import pytest
+
+import sigsci_site_manager.consts as consts
+import sigsci_site_manager.deploy as deploy
+from sigsci_site_manager.journal import SITE, Journal
+
+
+class FlakyAPI(object):
+    def __init__(self, fail_after=None):
+        self.site = None
+        self.corp = 'dummy'
+        self.calls = []
+        self.fail_after = fail_after
+
+    def __getattr__(self, name):
+        if not name.startswith(('add_', 'create_', 'copy_')):
+            raise AttributeError(name)
+
+        def write(item, *args):
+            if self.fail_after is not None and \
+                    len(self.calls) >= self.fail_after:
+                raise KeyboardInterrupt()
+            self.calls.append((name, item.get('name', item.get('tagName'))
+                               if isinstance(item, dict) else item))
+        return write
+
+    def get_corp_site(self, site_name):
+        raise Exception('Site not found')
+
+    def get_corp_users(self):
+        return {'data': []}
+
+
+DATA = {
+    'source': {'corp': 'dummy', 'site': 'src'},
+    'site': {},
+    'rule_lists': [{'name': 'list%d' % i, 'type': 'ip'} for i in range(5)],
+    'custom_signals': [{'shortName': 'signal%d' % i, 'tagName': 'site.s%d' % i}
+                       for i in range(5)],
+    'site_rules': [],
+    'templated_rules': {},
+    'custom_alerts': [],
+    'site_members': [],
+    'integrations': [],
+    'advanced_rules': []
+}
+
+
+def test_journal_skips_truncated_record(tmp_path):
+    path = str(tmp_path / 'journal')
+    journal = Journal(path)
+    journal.record('site', consts.RULE_LISTS, 'a|ip')
+    journal.close()
+    with open(path, 'a') as f:
+        f.write('{"site": "site", "cate')
+
+    journal = Journal(path, resume=True)
+    assert journal.is_completed('site', consts.RULE_LISTS, 'a|ip')
+    assert not journal.is_completed('site', consts.RULE_LISTS)
+    journal.close()
+
+    # Without resuming the journal starts again
+    journal = Journal(path)
+    assert not journal.is_completed('site', consts.RULE_LISTS, 'a|ip')
+    journal.close()
+
+
+def test_journal_resumes_after_truncated_record(tmp_path):
+    path = str(tmp_path / 'journal')
+    journal = Journal(path)
+    journal.record('site', consts.RULE_LISTS, 'a|ip')
+    journal.close()
+    with open(path, 'a') as f:
+        f.write('{"site": "site", "cate')
+
+    journal = Journal(path, resume=True)
+    journal.record('site', consts.RULE_LISTS, 'b|ip')
+    journal.close()
+
+    journal = Journal(path, resume=True)
+    assert journal.is_completed('site', consts.RULE_LISTS, 'a|ip')
+    assert journal.is_completed('site', consts.RULE_LISTS, 'b|ip')
+    journal.close()
+
+
+def test_resume_deploy(tmp_path):
+    path = str(tmp_path / 'journal')
+
+    # Interrupt the deploy after the site and three lists are created
+    api = FlakyAPI(fail_after=4)
+    journal = Journal(path)
+    with pytest.raises(KeyboardInterrupt):
+        deploy.deploys(api, 'new', DATA, None, consts.CATEGORIES,
+                       journal=journal)
+    journal.close()
+
+    api = FlakyAPI()
+    journal = Journal(path, resume=True)
+    assert journal.is_completed('new', SITE)
+    deploy.deploys(api, 'new', DATA, None, consts.CATEGORIES,
+                   journal=journal)
+    journal.close()
+    assert api.calls == [('add_rule_lists', 'list3'),
+                         ('add_rule_lists', 'list4')] + \
+        [('add_custom_signals', 'site.s%d' % i) for i in range(5)]
+
+    # Everything is recorded so resuming again writes nothing
+    api = FlakyAPI()
+    journal = Journal(path, resume=True)
+    deploy.deploys(api, 'new', DATA, None, consts.CATEGORIES,
+                   journal=journal)
+    journal.close()
+    assert api.calls == []
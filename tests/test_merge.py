@@ -152,6 +152,9 @@ def test_merge_rule_lists_add_new_different_type():
         'entries': ['foobar']
     }]
     merge.merge_rule_lists(api, test_data)
+    # The renamed list is added without changing the snapshot, which is
+    # shared between destination sites
+    assert test_data[0]['name'] == 'existing list'
 
 
 def test_merge_rule_lists_add_new_different_type_no_change():
@@ -211,3 +214,152 @@ def test_find_match():
     assert merge._find_match(needle, haystack, ['key1']) == three
     assert merge._find_match(needle, haystack, ['key2']) is None
     assert merge._find_match(needle, haystack, ['key3']) is None
+
+
+def test_merge_shared_snapshot(monkeypatch):
+    def fail_backups(*args, **kwargs):
+        raise AssertionError('source should not be backed up again')
+    monkeypatch.setattr(merge, 'backups', fail_backups)
+
+    merged = []
+    monkeypatch.setattr(merge, 'merges',
+                        lambda api, site, data, *args:
+                        merged.append((site, data)))
+
+    data = {'rule_lists': [{'name': 'list', 'type': 'ip', 'entries': []}]}
+    for site in ['one', 'two']:
+        merge.merge(None, site, src_site='src', data=data)
+
+    assert [site for site, _ in merged] == ['one', 'two']
+    # Merging doesn't change the snapshot so it isn't copied per site
+    assert all(x is data for _, x in merged)
+
+
+class RulesAPI(object):
+    def __init__(self, existing):
+        self.existing = existing
+        self.added = []
+
+    def get_site_rules(self):
+        return {'data': self.existing}
+
+    def add_site_rules(self, item):
+        self.added.append(item['reason'])
+
+    def get_request_rules(self):
+        return {'data': self.existing}
+
+    def add_request_rules(self, item):
+        self.added.append(item['reason'])
+
+
+def test_merge_site_rules():
+    def rule(reason, *values):
+        return {
+            'type': 'request', 'enabled': True, 'groupOperator': 'any',
+            'conditions': [{'type': 'single', 'field': 'ip',
+                            'operator': 'equals', 'value': v}
+                           for v in values],
+            'actions': [{'type': 'block'}], 'reason': reason,
+            'expiration': ''
+        }
+
+    api = RulesAPI([rule('existing', '1.1.1.1', '2.2.2.2')])
+    merge.merge_site_rules(api, [rule('same', '2.2.2.2', '1.1.1.1'),
+                                 rule('new', '3.3.3.3')])
+    assert api.added == ['new']
+
+
+def test_merge_request_rules_legacy_backup():
+    conditions = [{'type': 'single', 'field': 'ip', 'operator': 'equals',
+                   'value': '1.1.1.1'}]
+    # Legacy backups of request rules don't keep actions
+    legacy = {'enabled': True, 'groupOperator': 'all',
+              'conditions': conditions, 'action': 'block', 'signal': None,
+              'reason': 'r', 'expiration': ''}
+    api = RulesAPI([dict(legacy, actions=[{'type': 'block'}])])
+    merge.merge_request_rules(api, [legacy])
+    assert api.added == []
+
+
+def test_merge_rule_lists_mirror():
+    existing = {
+        'rule_lists': [{
+            'id': '1',
+            'name': 'existing list',
+            'type': 'ip',
+            'description': 'existing list',
+            'entries': ['1.1.1.1', '2.2.2.2']
+        }]
+    }
+    expected = {
+        'rule_lists': {
+            '1': {
+                'entries': {
+                    'additions': ['3.3.3.3'],
+                    'deletions': ['1.1.1.1']
+                }
+            }
+        }
+    }
+    api = DummyAPI(existing, expected)
+
+    test_data = [{
+        'name': 'existing list',
+        'type': 'ip',
+        'description': 'existing list',
+        'entries': ['2.2.2.2', '3.3.3.3', '3.3.3.3']
+    }]
+    merge.merge_rule_lists(api, test_data, mirror=True)
+
+
+def test_chunk_entries():
+    additions = ['a%d' % i for i in range(5)]
+    deletions = ['d%d' % i for i in range(3)]
+    chunks = merge._chunk_entries(additions, deletions, size=3)
+
+    assert [len(c['entries']['additions']) + len(c['entries']['deletions'])
+            for c in chunks] == [3, 3, 2]
+    assert sum([c['entries']['deletions'] for c in chunks], []) == deletions
+    assert sum([c['entries']['additions'] for c in chunks], []) == additions
+    assert chunks[0]['entries']['additions'] == []
+
+
+def test_merge_prefetches_destination():
+    class PrefetchAPI(object):
+        def __init__(self):
+            self.corp = 'dummy'
+            self.site = None
+            self.calls = []
+
+        def get_corp_site(self, site_name):
+            return {}
+
+        def __getattr__(self, name):
+            def call(*args):
+                self.calls.append(name)
+                return {'data': []}
+            return call
+
+    data = {
+        'source': {'corp': 'dummy', 'site': 'src'},
+        'rule_lists': [{'name': 'list', 'type': 'ip', 'entries': []}],
+        'custom_signals': [{'tagName': 'site.new', 'shortName': 'new'}],
+        'site_rules': [],
+        'site_members': [{'user': {'email': 'a@b.com', 'apiUser': False},
+                          'role': 'user'}],
+        'templated_rules': {},
+        'custom_alerts': [],
+        'integrations': [],
+        'advanced_rules': []
+    }
+    api = PrefetchAPI()
+    merge.merges(api, 'dst', data,
+                 ['RULE_LISTS', 'CUSTOM_SIGNALS', 'SITE_MEMBERS'], workers=4)
+
+    # Every category read is made once, before anything is written
+    reads = ['get_rule_lists', 'get_custom_signals', 'get_site_members',
+             'get_corp_users']
+    assert sorted(api.calls[:4]) == sorted(reads)
+    assert all(api.calls.count(name) == 1 for name in reads)
+    assert 'add_rule_lists' in api.calls
@@ -0,0 +1,116 @@
+import json
+import os
+
+import sigsci_site_manager.migrate as migrate
+
+
+def _group(conditions):
+    return {'type': 'group', 'groupOperator': 'any',
+            'conditions': conditions}
+
+
+def _in_list(value):
+    return {'type': 'single', 'field': 'ip', 'operator': 'inList',
+            'value': value}
+
+
+def test_get_rule_dependencies():
+    rule = {
+        'conditions': [
+            _in_list('corp.blocked'),
+            _group([_in_list('site.local'),
+                    _group([_in_list('corp.nested'),
+                            _in_list('corp.blocked')])]),
+            {'type': 'single', 'field': 'path', 'operator': 'equals',
+             'value': 'corp.not-a-list'}
+        ],
+        'actions': [{'type': 'addSignal', 'signal': 'corp.flagged'},
+                    {'type': 'addSignal', 'signal': 'site.local'},
+                    {'type': 'block'}]
+    }
+    assert migrate.get_rule_dependencies(rule) == {
+        'rule_list': {'corp.blocked', 'corp.nested'},
+        'signal': {'corp.flagged'}
+    }
+    assert len(migrate.get_dependency_items(rule)) == 5
+
+
+def test_get_rule_dependencies_deep_nesting():
+    # Deeper than the recursion limit
+    rule = {'conditions': [_in_list('corp.deep')]}
+    for _ in range(5000):
+        rule = {'conditions': [_group(rule['conditions'])]}
+    assert migrate.get_rule_dependencies(rule)['rule_list'] == {'corp.deep'}
+
+
+def test_get_advanced_rule_dependencies():
+    rule = {
+        'id': '1',
+        'shortName': 'rule',
+        'preRule': 'if req.matches("matchers/corp.bad-ips") {\n'
+                   '  tag("corp.flagged")\n'
+                   '  tag("site.local")\n'
+                   '}\n'
+                   '#"corp.commented")\n',
+        'postRule': 'if in_list("lists/corp.hosts", host) {}\n',
+        'sampleRequest': 'GET / "corp.sample"\n'
+    }
+    expected = {'rule_list': {'corp.bad-ips', 'corp.hosts'},
+                'signal': {'corp.flagged'}}
+    assert migrate.get_advanced_rule_dependencies(rule) == expected
+
+    # Memoized results can't be changed by callers
+    migrate.get_advanced_rule_dependencies(rule)['signal'].clear()
+    assert migrate.get_advanced_rule_dependencies(rule) == expected
+
+
+class CorpAPI(object):
+    corp = 'src'
+
+    def __init__(self):
+        self.fetches = 0
+
+    def get_corp_rule_lists(self):
+        self.fetches += 1
+        return {'data': [{'id': 'corp.blocked', 'name': 'blocked'}]}
+
+    def get_corp_signals(self):
+        return {'data': [{'tagName': 'corp.flagged'}]}
+
+
+def _backup(site, rule_list):
+    return {
+        'source': {'corp': 'src', 'site': site},
+        'site_members': [],
+        'custom_alerts': [],
+        'advanced_rules': [],
+        'site_rules': [{'reason': 'rule',
+                        'conditions': [_in_list(rule_list)],
+                        'actions': [{'type': 'block'}]}]
+    }
+
+
+def test_migrate_files(tmp_path):
+    backups = tmp_path / 'backups'
+    backups.mkdir()
+    for i in range(6):
+        (backups / ('site%d.json' % i)).write_text(
+            json.dumps(_backup('site%d' % i, 'corp.blocked')))
+    (backups / 'broken.json').write_text(
+        json.dumps(_backup('broken', 'corp.gone')))
+    (backups / 'manifest.json').write_text('{}')
+
+    api = CorpAPI()
+    out_dir = str(tmp_path / 'out')
+    report = migrate.migrate_files(api, [str(backups)], out_dir, 'dst',
+                                   False, False, workers=4)
+
+    assert api.fetches == 1
+    assert len(report['files']) == 7
+    assert len(report['corp_items']['rule_list']['corp.blocked']) == 6
+    assert list(report['missing']['rule_list']) == ['corp.gone']
+    with open(os.path.join(out_dir, 'site0.json')) as f:
+        migrated = json.load(f)
+    assert migrated['source']['corp'] == 'dst'
+    assert migrated['corp_items']['rule_list'] == [
+        {'id': 'corp.blocked', 'name': 'blocked'}]
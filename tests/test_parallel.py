@@ -0,0 +1,29 @@
+import time
+
+import sigsci_site_manager.parallel as parallel
+
+
+def test_run_concurrently_keeps_order():
+    calls = [(time.sleep, (0.02,)), (lambda x: x, (1,)), (lambda x: x, (2,))]
+    assert parallel.run_concurrently(calls, workers=3) == [None, 1, 2]
+
+
+def test_run_per_item_groups_output(capsys):
+    def task(name):
+        for i in range(3):
+            print('%s %d' % (name, i))
+            time.sleep(0.01)
+        if name == 'b':
+            raise ValueError('bad')
+        return name.upper()
+
+    results = parallel.run_per_item(task, ['a', 'b', 'c'], workers=3)
+
+    assert [r.result for r in results] == ['A', None, 'C']
+    assert isinstance(results[1].error, ValueError)
+    lines = capsys.readouterr().out.splitlines()
+    for name in ['a', 'c']:
+        start = lines.index('%s 0' % name)
+        assert lines[start:start + 3] == ['%s %d' % (name, i)
+                                          for i in range(3)]
+    assert 'Failed: bad' in lines
@@ -0,0 +1,94 @@
+import json
+
+import sigsci_site_manager.consts as consts
+import sigsci_site_manager.plan as plan
+
+
+class SiteAPI(object):
+    def __init__(self):
+        self.site = None
+        self.corp = 'dummy'
+        self.lists = [{'id': '1', 'name': 'ips', 'type': 'ip',
+                       'entries': ['1.1.1.1', '2.2.2.2']}]
+        self.signals = [{'tagName': 'site.known'}]
+        self.writes = []
+
+    def get_corp_site(self, site_name):
+        return {'name': site_name}
+
+    def get_rule_lists(self):
+        return {'data': self.lists}
+
+    def get_custom_signals(self):
+        return {'data': self.signals}
+
+    def update_rule_lists(self, list_id, data):
+        self.writes.append(('update_rule_lists', list_id, data))
+
+    def add_rule_lists(self, data):
+        self.writes.append(('add_rule_lists', data['name']))
+
+    def add_custom_signals(self, data):
+        self.writes.append(('add_custom_signals', data['tagName']))
+
+
+DATA = {
+    'source': {'corp': 'dummy', 'site': 'src'},
+    'site_rules': [],
+    'rule_lists': [
+        {'name': 'ips', 'type': 'ip', 'entries': ['1.1.1.1', '3.3.3.3']},
+        {'name': 'new', 'type': 'ip', 'entries': []}
+    ],
+    'custom_signals': [
+        {'tagName': 'site.known', 'shortName': 'known'},
+        {'tagName': 'site.new', 'shortName': 'new'}
+    ]
+}
+
+
+def test_plan_and_apply(tmp_path):
+    plan_file = str(tmp_path / 'plan.json')
+    api = SiteAPI()
+    result = plan.plan(api, 'dst', DATA, plan_file,
+                       [consts.RULE_LISTS, consts.CUSTOM_SIGNALS],
+                       mirror_lists=True)
+
+    assert [(op['action'], op['method']) for op in result['operations']] == [
+        ('update', 'update_rule_lists'),
+        ('create', 'add_rule_lists'),
+        ('create', 'add_custom_signals')]
+    assert result['operations'][0]['args'][1]['entries'] == {
+        'additions': ['3.3.3.3'], 'deletions': ['2.2.2.2']}
+    with open(plan_file) as f:
+        assert json.loads(f.read()) == result
+    assert api.writes == []
+
+    assert plan.apply(api, plan_file)
+    assert api.writes == [
+        ('update_rule_lists', '1',
+         {'entries': {'additions': ['3.3.3.3'], 'deletions': ['2.2.2.2']}}),
+        ('add_rule_lists', 'new'),
+        ('add_custom_signals', 'site.new')]
+
+
+def test_apply_fails_when_site_changed(tmp_path):
+    plan_file = str(tmp_path / 'plan.json')
+    api = SiteAPI()
+    plan.plan(api, 'dst', DATA, plan_file, [consts.CUSTOM_SIGNALS])
+
+    api.signals.append({'tagName': 'site.new'})
+    assert not plan.apply(api, plan_file)
+    assert api.writes == []
+
+    assert plan.apply(api, plan_file, force=True)
+    assert api.writes == [('add_custom_signals', 'site.new')]
+
+
+def test_apply_fails_for_other_corp(tmp_path):
+    plan_file = str(tmp_path / 'plan.json')
+    api = SiteAPI()
+    plan.plan(api, 'dst', DATA, plan_file, [consts.CUSTOM_SIGNALS])
+
+    api.corp = 'other'
+    assert not plan.apply(api, plan_file)
+    assert api.writes == []
@@ -0,0 +1,76 @@
+import sigsci_site_manager.ratelimit as ratelimit
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class Response(object):
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def test_retries_throttled_requests():
+    clock = Clock()
+    governor = ratelimit.RateGovernor(max_concurrency=8, clock=clock,
+                                      sleep=clock.sleep)
+    responses = [Response(429, {'Retry-After': '3'}), Response(429),
+                 Response(200)]
+
+    assert governor.call(lambda: responses.pop(0)).status_code == 200
+    assert clock.slept[0] == 3
+    assert governor.base_delay * 2 / 2 <= clock.slept[1] <= \
+        governor.base_delay * 2
+    assert governor.stats() == {'requests': 3, 'throttled': 2,
+                                'failures': 0, 'concurrency': 2}
+
+
+def test_gives_up_after_max_retries():
+    clock = Clock()
+    governor = ratelimit.RateGovernor(max_retries=2, clock=clock,
+                                      sleep=clock.sleep)
+    assert governor.call(lambda: Response(429)).status_code == 429
+    assert len(clock.slept) == 2
+    assert governor.stats()['failures'] == 1
+
+
+def test_aimd_concurrency_limit():
+    clock = Clock()
+    governor = ratelimit.RateGovernor(max_concurrency=8, clock=clock)
+    governor.acquire()
+    governor.release(0.1, throttled=True)
+    assert governor.limit == 4
+    # A second throttled request from the same round doesn't halve again
+    governor.acquire()
+    governor.release(0.1, throttled=True)
+    assert governor.limit == 4
+
+    # Fast successes grow the limit by about one per round of requests
+    for _ in range(4):
+        governor.acquire()
+        governor.release(0.1)
+    assert 4.9 < governor.limit < 5
+    # Slow successes don't
+    governor.acquire()
+    governor.release(10)
+    assert 4.9 < governor.limit < 5
+
+
+def test_token_bucket():
+    clock = Clock()
+    governor = ratelimit.RateGovernor(rate=2, burst=2, clock=clock)
+    assert governor._take_token() == 0
+    assert governor._take_token() == 0
+    assert governor._take_token() == 0.5
+    clock.now += 0.5
+    assert governor._take_token() == 0
@@ -0,0 +1,69 @@
+from sigsci_site_manager.migrate import ADVANCED_RULE_BODIES
+import sigsci_site_manager.references as references
+
+
+class CorpAPI(object):
+    def __init__(self, sites):
+        self.site = None
+        self.corp = 'dummy'
+        self.sites = sites
+        self.fetched = []
+
+    def get_site_rules(self):
+        self.fetched.append(self.site)
+        return {'data': self.sites[self.site]['site_rules']}
+
+    def get_custom_alerts(self):
+        return {'data': self.sites[self.site]['custom_alerts']}
+
+    def get_advanced_rules(self):
+        return {'data': self.sites[self.site]['advanced_rules']}
+
+
+def make_site(list_name):
+    return {
+        'site_rules': [{
+            'type': 'request', 'enabled': True, 'groupOperator': 'all',
+            'conditions': [{'type': 'single', 'field': 'ip',
+                            'operator': 'inList', 'value': list_name}],
+            'actions': [{'type': 'block'}], 'reason': 'block bad ips',
+            'expiration': ''}],
+        'custom_alerts': [{'tagName': 'corp.attack', 'longName': 'attacks',
+                           'interval': 10, 'threshold': 5, 'enabled': True,
+                           'action': 'flagged'}],
+        'advanced_rules': [dict(
+            {x: '' for x in ADVANCED_RULE_BODIES + ['sampleRequest',
+                                                    'sampleResponse']},
+            id='1', shortName='adv', enabled=True,
+            preRule='tag("corp.attack")\n'
+                    'if req.ip in "lists/corp.bad" { block() }\n')]
+    }
+
+
+def test_update_and_find_references(tmp_path):
+    index_file = str(tmp_path / 'refs.json')
+    api = CorpAPI({'one': make_site('corp.bad'),
+                   'two': make_site('site.local')})
+    references.update_index(api, index_file, ['one', 'two'], workers=2)
+
+    index = references.load_index(index_file)
+    found = references.find_references(index, 'bad')
+    assert [(x['site'], x['category']) for x in found[
+        ('rule_list', 'corp.bad')]] == [
+            ('one', 'advanced_rules'), ('one', 'site_rules'),
+            ('two', 'advanced_rules')]
+    assert len(references.find_references(index, 'corp.*')) == 2
+
+    # Only the listed site is fetched again and unchanged sites are kept
+    api.sites['two'] = make_site('corp.bad')
+    api.fetched = []
+    references.update_index(api, index_file, ['two'])
+    assert api.fetched == ['two']
+    index = references.load_index(index_file)
+    assert sorted(index['sites']) == ['one', 'two']
+    assert len(references.find_references(index, 'bad')[
+        ('rule_list', 'corp.bad')]) == 4
+
+    # Updating all sites drops the deleted ones
+    references.update_index(api, index_file, ['two'], prune=True)
+    assert sorted(references.load_index(index_file)['sites']) == ['two']
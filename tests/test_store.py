@@ -0,0 +1,54 @@
+import sigsci_site_manager.backup as backup
+import sigsci_site_manager.store as store
+
+
+def make_site(site_name, path, entries):
+    return {
+        'source': {'corp': 'dummy', 'site': site_name},
+        'site': {'agentLevel': 'block', 'blockDurationSeconds': 86400,
+                 'blockHTTPCode': 406},
+        'rule_lists': [{'name': 'ips', 'type': 'ip', 'description': '',
+                        'entries': entries}],
+        'site_rules': [{
+            'type': 'request', 'enabled': True, 'groupOperator': 'all',
+            'conditions': [
+                {'type': 'single', 'field': 'path', 'operator': 'equals',
+                 'value': path},
+                {'type': 'group', 'groupOperator': 'any', 'conditions': [
+                    {'type': 'single', 'field': 'ip', 'operator': 'inList',
+                     'value': 'corp.blocked'}]}],
+            'actions': [{'type': 'block'}], 'reason': 'rule',
+            'expiration': ''}],
+        'custom_signals': [{'tagName': 'site.sig', 'shortName': 'sig',
+                            'description': ''}],
+        'custom_alerts': [],
+        'site_members': [{'user': {'email': 'test@test.com'},
+                          'role': 'user'}],
+        'integrations': []
+    }
+
+
+def test_store_queries(tmp_path):
+    path = str(tmp_path / 'corp.db')
+    conn = store.open_store(path)
+    first = store.store_backup(conn, make_site('one', '/login', ['1.1.1.1']))
+    store.store_backup(conn, make_site('two', '/admin', ['2.2.2.2']))
+    latest = store.store_backup(conn, make_site('one', '/admin', []))
+
+    assert [x[:2] for x in store.list_snapshots(conn)] == [
+        (latest, 'one'), (latest - 1, 'two')]
+    assert store.rules_matching(conn, 'path', '/admin', 'block') == [
+        ('one', 0, 'request', 'rule'), ('two', 0, 'request', 'rule')]
+    assert store.rules_matching(conn, 'path', '/admin', 'allow') == []
+    assert store.sites_using_list(conn, 'blocked') == [
+        ('one', 0, 'inList', 'corp.blocked'),
+        ('two', 0, 'inList', 'corp.blocked')]
+    assert store.lists_containing(conn, '1.1.1.1') == []
+    assert store.lists_containing(conn, '1.1.1.1', as_of=first) == [
+        ('one', 'ips')]
+    conn.close()
+
+    assert backup.load_backup(path + '#one') == make_site('one', '/admin',
+                                                          [])
+    assert backup.load_backup('%s#one@%d' % (path, first)) == make_site(
+        'one', '/login', ['1.1.1.1'])
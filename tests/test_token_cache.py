@@ -0,0 +1,26 @@
+import os
+import stat
+
+import sigsci_site_manager.token_cache as token_cache
+
+
+def test_token_cache(tmp_path):
+    path = str(tmp_path / 'cache' / 'tokens.json')
+    assert token_cache.load_token(path, 'corp', 'user') is None
+
+    token_cache.save_token(path, 'corp', 'user', 'abc')
+    token_cache.save_token(path, 'corp', 'other', 'def')
+    assert token_cache.load_token(path, 'corp', 'user') == 'abc'
+    assert token_cache.load_token(path, 'corp', 'other') == 'def'
+    assert token_cache.load_token(path, 'corp2', 'user') is None
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+    token_cache.save_token(path, 'corp', 'user', 'abc', ttl=-1)
+    assert token_cache.load_token(path, 'corp', 'user') is None
+
+
+def test_token_cache_ignores_open_permissions(tmp_path):
+    path = str(tmp_path / 'tokens.json')
+    token_cache.save_token(path, 'corp', 'user', 'abc')
+    os.chmod(path, 0o644)
+    assert token_cache.load_token(path, 'corp', 'user') is None
@@ -140,3 +140,80 @@ def test_build_category_list():
     with pytest.raises(ValueError):
         cats = util.build_category_list(include=[consts.ADVANCED_RULES],
                                         exclude=[consts.CUSTOM_ALERTS])
+
+
+def _rule(conditions, reason='rule'):
+    return {
+        "type": "request",
+        "enabled": True,
+        "groupOperator": "all",
+        "conditions": conditions,
+        "actions": [{"type": "block"}],
+        "reason": reason,
+        "expiration": ""
+    }
+
+
+def _single(field, value):
+    return {"type": "single", "field": field, "operator": "equals",
+            "value": value}
+
+
+def _group(operator, conditions):
+    return {"type": "group", "groupOperator": operator,
+            "conditions": conditions}
+
+
+def test_equal_rules():
+    a = _rule([_single("ip", "1.1.1.1"), _single("path", "/login")])
+    b = _rule([_single("path", "/login"), _single("ip", "1.1.1.1")],
+              reason='other reason')
+    c = _rule([_single("path", "/login"), _single("ip", "2.2.2.2")])
+    d = dict(a, actions=[{"type": "allow"}])
+    assert util.equal_rules(a, b)
+    assert util.rule_fingerprint(a) == util.rule_fingerprint(b)
+    assert not util.equal_rules(a, c)
+    assert not util.equal_rules(a, d)
+
+
+def test_rule_fingerprint_nested_groups():
+    def nested(order):
+        inner = [_single("ip", "1.1.1.1"), _single("ip", "2.2.2.2")]
+        middle = [_group("any", inner[::order]), _single("path", "/a")]
+        return _rule([_group("all", middle[::order]),
+                      _single("method", "POST")][::order])
+
+    a = nested(1)
+    b = nested(-1)
+    assert util.equal_rules(a, b)
+
+    c = nested(1)
+    c["conditions"][0]["conditions"][0]["conditions"][1]["value"] = "3.3.3.3"
+    assert not util.equal_rules(a, c)
+
+    d = nested(1)
+    d["conditions"][0]["conditions"][0]["groupOperator"] = "all"
+    assert not util.equal_rules(a, d)
+
+
+def test_rule_fingerprint_memoized():
+    a = _rule([_single("ip", "1.1.1.1")])
+    fingerprint = util.rule_fingerprint(a)
+    assert util._FINGERPRINTS[(id(a), False)] == (a, fingerprint)
+    assert util.rule_fingerprint(a) == fingerprint
+    assert util.rule_fingerprint(a, signal_rule=True) != fingerprint
+
+
+def test_equal_rules_mismatched_optional_keys():
+    # Legacy request rule backups don't keep actions, the destination does
+    a = _rule([_single("ip", "1.1.1.1")])
+    del a["actions"]
+    b = dict(_rule([_single("ip", "1.1.1.1")]), signal="site.sig")
+    c = dict(b, actions=[{"type": "allow"}])
+    assert util.equal_rules(a, b)
+    assert util.equal_rules(a, c)
+    assert not util.equal_rules(b, c)
+
+    index = util.index_rules([c])
+    assert util.find_equal_rule(index, a) is c
+    assert util.find_equal_rule(index, b) is None